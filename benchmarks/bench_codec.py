@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Throughput benchmark for the PackBits codec in brother_ql.codec.
+
+Encodes and decodes frames typical for labels (mostly blank rows, text-like
+rows, dithered photo rows) and reports MB/s. If the `packbits` package is
+installed, it is measured as a reference.
+
+Usage: python benchmarks/bench_codec.py [--rows 2000] [--row-len 162]
+"""
+
+import argparse
+import random
+import time
+
+from brother_ql import codec
+
+try:
+    import packbits
+except ImportError:
+    packbits = None
+
+
+def make_frame(kind, rows, row_len, seed=0):
+    rnd = random.Random(seed)
+    out = bytearray()
+    for i in range(rows):
+        if kind == 'blank' or (kind == 'text' and i % 8 > 4):
+            out += bytes(row_len)
+        elif kind == 'text':
+            out += bytes(rnd.choice((0, 0, 0, 0xff, rnd.randrange(256))) for j in range(row_len))
+        else:
+            out += bytes(rnd.randrange(256) for j in range(row_len))
+    return bytes(out)
+
+
+def measure(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        secs = time.perf_counter() - start
+        best = secs if best is None else min(best, secs)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--row-len', type=int, default=162)
+    args = parser.parse_args()
+    row_len = args.row_len
+
+    fmt = "{kind:6} {impl:9} {op:7} {mbs:9.1f} MB/s  ratio {ratio:.3f}"
+    for kind in ('blank', 'text', 'photo'):
+        frame = make_frame(kind, args.rows, row_len)
+        mb = len(frame) / 1e6
+        rows = [frame[i:i+row_len] for i in range(0, len(frame), row_len)]
+        secs, encoded = measure(lambda: [codec.encode(row) for row in rows])
+        ratio = sum(len(row) for row in encoded) / len(frame)
+        print(fmt.format(kind=kind, impl='codec', op='encode', mbs=mb/secs, ratio=ratio))
+        secs, decoded = measure(lambda: b''.join(codec.decode(row) for row in encoded))
+        assert decoded == frame
+        print(fmt.format(kind=kind, impl='codec', op='decode', mbs=mb/secs, ratio=ratio))
+        if packbits is not None:
+            secs, encoded = measure(lambda: [packbits.encode(row) for row in rows])
+            ratio = sum(len(row) for row in encoded) / len(frame)
+            print(fmt.format(kind=kind, impl='packbits', op='encode', mbs=mb/secs, ratio=ratio))
+            secs, decoded = measure(lambda: b''.join(packbits.decode(row) for row in encoded))
+            print(fmt.format(kind=kind, impl='packbits', op='decode', mbs=mb/secs, ratio=ratio))
+
+
+if __name__ == '__main__':
+    main()
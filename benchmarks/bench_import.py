@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+Import time benchmark based on ``python -X importtime``.
+
+Starts a fresh interpreter for each of the modules below (several times,
+keeping the fastest run) and reports the cumulative import time and the
+slowest modules imported along the way. With --check, it exits with
+status 1 if a module exceeds its budget. The import times depend on the
+machine and the disk cache, so the unit tests (test_import_time.py) only
+check which modules are imported.
+
+Usage: python benchmarks/bench_import.py [--runs 5] [--top 8] [--check]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+#: Module -> budget for its cumulative import time in milliseconds
+BUDGETS = {
+    'brother_ql': 50,
+    'brother_ql.backends.helpers': 100,
+    'brother_ql.cli': 400,
+}
+
+#: Heavy packages that must not be imported by the modules above
+HEAVY = ('PIL', 'numpy', 'pkg_resources')
+
+
+def import_times(module):
+    """
+    :returns: (cumulative microseconds of `module`, {module: cumulative microseconds}, [imported modules])
+    """
+    code = "import sys, {0}; print(' '.join(sorted(sys.modules)))".format(module)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (os.getcwd(), os.environ.get('PYTHONPATH')) if p))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, check=True, env=env)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative_us)
+    return times.get(module, 0), times, proc.stdout.split()
+
+
+def best_of(module, runs):
+    best = None
+    for i in range(runs):
+        result = import_times(module)
+        if best is None or result[0] < best[0]:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--check', action='store_true', help="exit with status 1 if a budget is exceeded")
+    args = parser.parse_args()
+
+    over_budget = []
+    for module, budget in BUDGETS.items():
+        total, times, modules = best_of(module, args.runs)
+        if total / 1000 >= budget:
+            over_budget.append(module)
+        heavy = [name for name in HEAVY if name in modules]
+        print("{}: {:.1f} ms (budget {} ms), heavy imports: {}".format(module, total / 1000, budget, ', '.join(heavy) or 'none'))
+        top = sorted(times.items(), key=lambda item: item[1], reverse=True)[1:args.top + 1]
+        for name, cumulative in top:
+            print("    {:40s} {:8.1f} ms".format(name, cumulative / 1000))
+    if args.check and over_budget:
+        print("Over budget: " + ', '.join(over_budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
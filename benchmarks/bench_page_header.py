@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmark of the per-page overhead for tiny labels.
+
+For small die-cut labels like d12 and 23x23 the instructions around the
+raster data cost about as much as the raster data itself. This compares
+building the instructions of a page
+
+* with the methods and property setters of BrotherQLRaster (as add_print_page() used to),
+* by deriving the commands from a PageSpec for every page,
+* from the memoized header templates (brother_ql.page.assemble_page),
+
+and reports microseconds per page, for the raster data of an already
+encoded page and for a whole job created with convert().
+
+Usage: python benchmarks/bench_page_header.py [--model QL-720NW] [--pages 2000]
+"""
+
+import argparse
+import time
+
+from PIL import Image, ImageDraw
+
+from brother_ql.conversion import _job_settings, convert, encode_page, preprocess_image
+from brother_ql.page import _header_parts, assemble_page, print_page
+from brother_ql.raster import BrotherQLRaster
+
+
+def facade_page(qlr, job, page, is_first, is_last):
+    label_specs = job['label_specs']
+    qlr.clear()
+    qlr.add_switch_mode()
+    if is_first:
+        qlr.add_status_information()
+    qlr.mtype, qlr.mwidth, qlr.mlength = 0x0B, label_specs['tape_size'][0], label_specs['tape_size'][1]
+    qlr.pquality = 1
+    qlr.add_media_and_quality(page.height)
+    qlr.add_mode_setting(autocut=is_last, peeler=False)
+    if is_last:
+        qlr.add_cut_every(1)
+    qlr.dpi_600 = False
+    qlr.cut_at_end = True
+    qlr.two_color_printing = False
+    qlr.add_expanded_mode()
+    qlr.add_wait(0)
+    qlr.add_margins(label_specs['feed_margin'])
+    qlr.add_compression(page.compress)
+    qlr.buffer.write(page.raster)
+    qlr.add_print(last_page=is_last)
+    return qlr.data
+
+
+def derived_page(qlr, job, page, is_first, is_last):
+    before, rest = _header_parts(job['spec'], page.height, page.compress, is_first, is_last)
+    return b''.join((before, rest, page.raster, print_page(is_last)))
+
+
+def template_page(qlr, job, page, is_first, is_last):
+    return assemble_page(job['spec'], page, is_first, is_last)
+
+
+def per_page(build, qlr, job, page, pages):
+    start = time.perf_counter()
+    for i in range(pages):
+        build(qlr, job, page, i == 0, i == pages - 1)
+    return (time.perf_counter() - start) / pages * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='QL-720NW')
+    parser.add_argument('--pages', type=int, default=2000)
+    args = parser.parse_args()
+
+    fmt = "{label:>7} {what:>22} {usecs:>10.2f}"
+    print("{:>7} {:>22} {:>10}".format('label', 'instructions', 'us/page'))
+    for label in ('d12', '23x23'):
+        qlr = BrotherQLRaster(args.model)
+        job = _job_settings(qlr, label, compress=True)
+        size = job['label_specs']['dots_printable']
+        im = Image.new('RGB', size, 'white')
+        ImageDraw.Draw(im).text((size[0] // 4, size[1] // 2), "42", fill='black')
+        page, _ = encode_page(qlr, *preprocess_image(im, job['label_specs'], qlr, job['options']), False, True)
+        expected = facade_page(BrotherQLRaster(args.model), job, page, True, True)
+        assert derived_page(qlr, job, page, True, True) == template_page(qlr, job, page, True, True) == expected
+        for what, build in (('BrotherQLRaster calls', facade_page), ('derived from PageSpec', derived_page), ('header template', template_page)):
+            print(fmt.format(label=label, what=what, usecs=per_page(build, BrotherQLRaster(args.model), job, page, args.pages)))
+        images = [im] * 200
+        start = time.perf_counter()
+        convert(BrotherQLRaster(args.model), images, label, compress=True)
+        print(fmt.format(label=label, what='convert() per page', usecs=(time.perf_counter() - start) / len(images) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
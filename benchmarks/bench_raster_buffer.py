@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for building raster instructions with BrotherQLRaster.
+
+Shows how the time to build a job scales with the number of pages and
+with the label length (number of raster rows per page). With the chunked
+command buffer the build time grows linearly in both.
+
+Usage: python benchmarks/bench_raster_buffer.py [--model QL-1100]
+"""
+
+import argparse
+import time
+
+from PIL import Image
+
+from brother_ql.raster import BrotherQLRaster
+
+
+def build_job(model, pages, rows):
+    qlr = BrotherQLRaster(model)
+    im = Image.new('1', (qlr.get_pixel_width(), rows), 0)
+    start = time.perf_counter()
+    qlr.add_invalidate()
+    qlr.add_initialize()
+    for i in range(pages):
+        qlr.add_switch_mode()
+        qlr.mtype, qlr.mwidth, qlr.mlength = 0x0A, 102, 0
+        qlr.add_media_and_quality(rows)
+        qlr.add_expanded_mode()
+        qlr.add_margins(35)
+        qlr.add_raster_data(im)
+        qlr.add_print(last_page=(i == pages - 1))
+    data = qlr.data
+    return time.perf_counter() - start, len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='QL-1100')
+    args = parser.parse_args()
+
+    fmt = "{pages:>6} {rows:>7} {size:>12} {secs:>9.4f} {per_page:>12.3f}"
+    print("{:>6} {:>7} {:>12} {:>9} {:>12}".format('pages', 'rows', 'bytes', 'seconds', 'ms per page'))
+    for pages, rows in ((1, 1000), (10, 1000), (100, 1000), (400, 1000),
+                        (1, 5000), (1, 20000), (1, 35000)):
+        secs, size = build_job(args.model, pages, rows)
+        print(fmt.format(pages=pages, rows=rows, size=size, secs=secs, per_page=secs / pages * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of labels made from a template against their full conversion.
+
+A 696x240 label with a fixed base and two text fields is created for a
+number of records
+
+* with brother_ql.template.LabelTemplate (only the fields are rasterized and encoded),
+* with convert() from the composed labels drawn at the native 300 dpi,
+* with convert() from the composed labels drawn at 600 dpi (and scaled down),
+
+and the milliseconds per label and the speedup of the template are reported.
+Composing the labels is not part of the timings of convert(). Most of the time
+of the template goes to drawing the text of the fields with FreeType.
+
+Usage: python benchmarks/bench_template.py [--model QL-720NW] [--labels 300]
+"""
+
+import argparse
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from brother_ql.conversion import convert
+from brother_ql.raster import BrotherQLRaster
+from brother_ql.template import LabelTemplate
+
+REGIONS = {'part': (20, 30, 400, 40), 'qty': (420, 30, 200, 40)}
+
+
+def base_image():
+    im = Image.new('RGB', (696, 240), 'white')
+    draw = ImageDraw.Draw(im)
+    draw.rectangle((0, 0, 695, 10), fill='black')
+    draw.text((20, 100), "Inventory label", fill='black')
+    draw.rectangle((30, 80, 600, 90), fill='black')
+    return im
+
+
+def composed(fields, font):
+    im = base_image()
+    for name, value in fields.items():
+        x, y, width, height = REGIONS[name]
+        region = Image.new('RGB', (width, height), 'white')
+        ImageDraw.Draw(region).text((0, 0), value, fill='black', font=font)
+        im.paste(region, (x, y))
+    return im
+
+
+def measure(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        secs = time.perf_counter() - start
+        best = secs if best is None else min(best, secs)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='QL-720NW')
+    parser.add_argument('--labels', type=int, default=300)
+    args = parser.parse_args()
+
+    font = ImageFont.load_default()
+    records = [{'part': 'Part %d' % i, 'qty': str(i % 50)} for i in range(args.labels)]
+    template = LabelTemplate(BrotherQLRaster(args.model), '62', base_image(), REGIONS, font=font, compress=True)
+    template_secs, data = measure(lambda: template.convert(records))
+    native = [composed(record, font) for record in records]
+    assert convert(BrotherQLRaster(args.model), native, '62', compress=True) == data
+    double = [im.resize((1392, 480)) for im in native]
+
+    fmt = "{what:>26} {msecs:>8.2f} {speedup:>8.1f}x"
+    print("{:>26} {:>8} {:>9}".format('', 'ms/label', 'template'))
+    print(fmt.format(what='template', msecs=template_secs / len(records) * 1e3, speedup=1))
+    for what, images in (('convert() at 300 dpi', native), ('convert() at 600 dpi', double)):
+        secs, _ = measure(lambda: convert(BrotherQLRaster(args.model), images, '62', compress=True))
+        print(fmt.format(what=what, msecs=secs / len(records) * 1e3, speedup=secs / template_secs))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,22 @@
 
 from .exceptions import *
 
-from .raster import BrotherQLRaster
+# The submodules below pull in Pillow and are only imported on first use:
+# brother_ql.BrotherQLRaster, brother_ql.create_label
+_LAZY_ATTRIBUTES = {
+    'BrotherQLRaster': 'brother_ql.raster',
+    'create_label': 'brother_ql.brother_ql_create',
+}
 
-from .brother_ql_create import create_label
+def __getattr__(name):
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    import importlib
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
 
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
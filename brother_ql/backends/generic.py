@@ -1,6 +1,7 @@
 
 
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +14,16 @@ def list_available_devices(ums_warning=True):
 
 class BrotherQLBackendGeneric(object):
 
+    #: Chunks handed to :py:meth:`write_chunks` are coalesced into blocks of up to this many bytes.
+    write_block_size = 64 * 1024
+    #: A rough estimate of the transfer rate to the printer in bytes/s (None if unknown).
+    #: Used to decide whether compressing the raster data pays off.
+    throughput = None
+    #: The transfer rate in bytes/s measured during previous writes of at least
+    #: :py:attr:`measure_min_bytes` bytes (None until measured).
+    measured_throughput = None
+    measure_min_bytes = 16 * 1024
+
     def __init__(self, device_specifier):
         """
         device_specifier can be either a string or an instance
@@ -30,7 +41,53 @@ class BrotherQLBackendGeneric(object):
 
     def write(self, data):
         logger.debug('Writing %d bytes.', len(data))
+        start = time.perf_counter()
         self._write(data)
+        self._measure(len(data), time.perf_counter() - start)
+
+    def _measure(self, num_bytes, secs):
+        if num_bytes < self.measure_min_bytes or secs <= 0:
+            return
+        rate = num_bytes / secs
+        if self.measured_throughput is None:
+            self.measured_throughput = rate
+        else:
+            self.measured_throughput = 0.7 * self.measured_throughput + 0.3 * rate
+
+    def get_throughput(self):
+        """
+        :returns: The measured transfer rate in bytes/s, or the configured estimate if nothing was measured yet.
+        """
+        return self.measured_throughput or self.throughput
+
+    def write_chunks(self, chunks):
+        """
+        Write a sequence of bytes-like chunks, e.g. from
+        :py:meth:`brother_ql.raster.BrotherQLRaster.iter_chunks` or
+        :py:func:`brother_ql.conversion.iter_convert`, without joining all
+        of them into a single bytes object first. Small chunks are coalesced
+        into blocks of up to :py:attr:`write_block_size` bytes, larger chunks
+        are written as they are.
+
+        :returns: The number of bytes written.
+        """
+        block = bytearray()
+        total = 0
+        start = time.perf_counter()
+        for chunk in chunks:
+            if len(block) + len(chunk) > self.write_block_size and block:
+                self._write(bytes(block))
+                block.clear()
+            if len(chunk) >= self.write_block_size:
+                self._write(chunk)
+            else:
+                block += chunk
+            total += len(chunk)
+        if block:
+            self._write(bytes(block))
+        logger.debug('Wrote %d bytes in chunks.', total)
+        self._measure(total, time.perf_counter() - start)
+        return total
 
     def read(self, length=32):
         try:
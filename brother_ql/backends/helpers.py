@@ -29,10 +29,13 @@ def send(instructions, printer_identifier=None, backend_identifier=None, blockin
     """
     Send instruction bytes to a printer.
 
-    :param bytes instructions: The instructions to be sent to the printer.
+    :param instructions: The instructions to be sent to the printer. Either bytes or an iterable
+        of bytes, e.g. from :py:func:`brother_ql.conversion.iter_convert`, whose chunks are sent
+        while they are created (coalesced into blocks, see :py:meth:`BrotherQLBackendGeneric.write_chunks`).
     :param str printer_identifier: Identifier for the printer.
     :param str backend_identifier: Can enforce the use of a specific backend.
     :param bool blocking: Indicates whether the function call should block while waiting for the completion of the printing.
+        The 10 s timeout for the printer's response starts once all instructions are sent.
     """
 
     status = {
@@ -58,11 +61,16 @@ def send(instructions, printer_identifier=None, backend_identifier=None, blockin
 
     printer = BrotherQLBackend(printer_identifier)
 
+    if isinstance(instructions, (bytes, bytearray, memoryview)):
+        logger.info('Sending instructions to the printer. Total: %d bytes.', len(instructions))
+        with open("debug_printer_command.bin", "wb") as f:
+            f.write(instructions)
+        instructions = [instructions]
+    else:
+        logger.info('Sending instructions to the printer while they are created.')
+    total = printer.write_chunks(instructions)
+    logger.info('Sent %d bytes.', total)
     start = time.time()
-    logger.info('Sending instructions to the printer. Total: %d bytes.', len(instructions))
-    with open("debug_printer_command.bin", "wb") as f:
-        f.write(instructions)
-    printer.write(instructions)
     status['outcome'] = 'sent'
 
     if not blocking:
@@ -106,6 +106,9 @@ class BrotherQLBackendLinuxKernel(BrotherQLBackendGeneric):
     BrotherQL backend using the Linux Kernel USB Printer Device Handles
     """
 
+    #: USB printers receive data at around 1 MB/s
+    throughput = 1000000
+
     def __init__(self, device_specifier):
         """
         device_specifier: string or os.open(): identifier in the \
@@ -27,6 +27,9 @@ class BrotherQLBackendNetwork(BrotherQLBackendGeneric):
     BrotherQL backend using the Linux Kernel USB Printer Device Handles
     """
 
+    #: Printers on (wireless) networks typically receive data at a few hundred kB/s at most
+    throughput = 150000
+
     def __init__(self, device_specifier):
         """
         device_specifier: string or os.open(): identifier in the \
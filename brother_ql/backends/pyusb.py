@@ -82,6 +82,9 @@ class BrotherQLBackendPyUSB(BrotherQLBackendGeneric):
     BrotherQL backend using PyUSB
     """
 
+    #: USB printers receive data at around 1 MB/s
+    throughput = 1000000
+
     def __init__(self, device_specifier):
         """
         device_specifier: string or pyusb.core.Device: identifier of the \
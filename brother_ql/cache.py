@@ -0,0 +1,313 @@
+"""
+A content addressed cache for converted pages.
+
+Labels are often printed again and again from the same image. The cache
+maps a digest of the image and of every option influencing the conversion
+(see :py:func:`page_key`) to the raster instructions of the page, so that
+a reprint skips opening, resizing and thresholding the image as well as
+encoding the raster lines.
+
+Only the raster data of a page is cached (together with the number of
+raster lines and the compression setting it was encoded with). The
+instructions around it depend on the position of the page in the job
+(first/last page, page counter) and are created again for every page,
+which is cheap.
+
+There are two tiers: :py:class:`PageCache` keeps the most recently used
+pages in memory and can write through to a :py:class:`DiskPageCache`,
+which keeps its entries across processes and is limited in size.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+
+from brother_ql.encoder import PackedBitmap
+
+logger = logging.getLogger(__name__)
+
+#: Changes whenever the cached data or the key derivation changes.
+CACHE_VERSION = 2
+
+#: The options which are part of the key of a page.
+KEY_OPTIONS = ('model', 'label', 'rotate', 'threshold', 'dither', 'red', 'dpi_600', 'hq', 'compress', 'cut')
+
+#: A converted page: its number of raster lines, whether its raster data is compressed
+#: and the raster data (bytes) itself.
+CachedPage = namedtuple('CachedPage', ['height', 'compress', 'raster'])
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def _hash_source(digest, image):
+    """
+    Hash the encoded source of a PIL image that hasn't been loaded yet, together
+    with its mode, size and frame (which a draft or seek may have changed).
+
+    :returns: Whether the source could be hashed.
+    """
+    if not getattr(image, 'tile', None):
+        return False
+    filename = getattr(image, 'filename', None)
+    fp = getattr(image, 'fp', None)
+    header = 'source {} {} {} {}'.format(image.mode, image.size[0], image.size[1], image.tell()).encode()
+    if isinstance(filename, (str, bytes, os.PathLike)) and filename and os.path.isfile(filename):
+        digest.update(header)
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                digest.update(block)
+        return True
+    if fp is not None and hasattr(fp, 'seek'):
+        position = fp.tell()
+        try:
+            fp.seek(0)
+            digest.update(header)
+            for block in iter(lambda: fp.read(1 << 16), b''):
+                digest.update(block)
+        finally:
+            fp.seek(position)
+        return True
+    return False
+
+
+def image_digest(image):
+    """
+    Hash the content of an image as passed to :py:func:`brother_ql.conversion.convert`.
+
+    :param image: A PIL image, the filename of an image, a file handle or a
+        :py:class:`brother_ql.encoder.PackedBitmap`.
+        The content of a file handle is read and a :py:class:`io.BytesIO`
+        with the same content is returned in its place. For a PIL image that
+        hasn't been loaded yet the encoded source is hashed, so that the image
+        can still be decoded at a reduced size (:py:func:`brother_ql.conversion.draft_image`).
+    :returns: A tuple (digest, image).
+    """
+    digest = hashlib.sha256()
+    if isinstance(image, (str, bytes, os.PathLike)):
+        with open(image, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                digest.update(block)
+    elif isinstance(image, PackedBitmap):
+        digest.update('packed {} {}'.format(*image.size).encode())
+        digest.update(image.data)
+    elif hasattr(image, 'read'):
+        data = image.read()
+        digest.update(data)
+        image = io.BytesIO(data)
+    elif not _hash_source(digest, image):
+        # A loaded PIL image: the decoded pixels (and the palette) are hashed
+        digest.update('{} {} {}'.format(image.mode, *image.size).encode())
+        if image.mode == 'P':
+            digest.update(bytes(image.getpalette() or b''))
+        digest.update(image.tobytes())
+    return digest.hexdigest(), image
+
+
+def page_key(digest, **options):
+    """
+    :param str digest: The digest of the image, see :py:func:`image_digest`.
+    :param options: The conversion options. Besides the ones in :py:data:`KEY_OPTIONS`,
+        every option given is part of the key.
+    :returns: The key of the page (str).
+    """
+    missing = [name for name in KEY_OPTIONS if name not in options]
+    if missing:
+        raise ValueError('Missing options for the page key: ' + ', '.join(missing))
+    items = ','.join('{}={!r}'.format(name, options[name]) for name in sorted(options))
+    material = '{}|{}|{}'.format(CACHE_VERSION, digest, items)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class DiskPageCache(object):
+    """
+    Pages stored as files in a directory, one file per page.
+
+    Entries are written to a temporary file first and moved in place,
+    so concurrent readers never see partial files. If the total size
+    of the entries exceeds `max_bytes`, the least recently used ones
+    are removed.
+
+    :param str directory: The directory to use. Created if necessary.
+    :param int max_bytes: The maximum total size of the entries.
+    """
+
+    _HEADER = struct.Struct('<4sBLB')
+    _MAGIC = b'BQLP'
+    _SUFFIX = '.page'
+
+    def __init__(self, directory, max_bytes=64*1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self._SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        size = self._HEADER.size
+        try:
+            magic, version, height, compress = self._HEADER.unpack_from(data)
+        except struct.error:
+            magic = version = None
+        if magic != self._MAGIC or version != CACHE_VERSION:
+            logger.warning("Ignoring invalid page cache entry %s", path)
+            self.misses += 1
+            return None
+        try:
+            # Mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return CachedPage(height, bool(compress), data[size:])
+
+    def put(self, key, page):
+        header = self._HEADER.pack(self._MAGIC, CACHE_VERSION, page.height, int(page.compress))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(page.raster)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            logger.warning("Couldn't write page cache entry for %s", key, exc_info=True)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._prune()
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self._SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _prune(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def info(self):
+        """
+        :returns: Hit and miss counters, the size limit and the total size of the entries in bytes (:py:class:`CacheInfo`).
+        """
+        return CacheInfo(self.hits, self.misses, self.max_bytes, sum(size for _, size, _ in self._entries()))
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self.hits = 0
+        self.misses = 0
+
+
+class PageCache(object):
+    """
+    A bounded LRU cache of converted pages in memory, optionally backed
+    by a :py:class:`DiskPageCache`. Pages found on disk are kept in memory
+    as well, new pages are written to both tiers.
+
+    :param int maxsize: The maximum number of pages to keep in memory.
+    :param DiskPageCache disk: The second tier, if any.
+    """
+
+    def __init__(self, maxsize=128, disk=None):
+        self.maxsize = maxsize
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+        if self.disk is not None:
+            page = self.disk.get(key)
+        with self._lock:
+            if page is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, page)
+        return page
+
+    def put(self, key, page):
+        with self._lock:
+            self._store(key, page)
+        if self.disk is not None:
+            self.disk.put(key, page)
+
+    def _store(self, key, page):
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        if len(self._pages) > self.maxsize:
+            self._pages.popitem(last=False)
+
+    def info(self):
+        """
+        :returns: Hit and miss counters and the size of the memory tier (:py:class:`CacheInfo`).
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._pages))
+
+    def clear(self):
+        """
+        Remove all pages from the memory tier (the disk tier is kept).
+        """
+        with self._lock:
+            self._pages.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+
+_shared_page_cache = None
+
+def shared_page_cache():
+    """
+    :returns: The in-memory :py:class:`PageCache` shared by all conversions of this process that ask for it.
+    """
+    global _shared_page_cache
+    if _shared_page_cache is None:
+        _shared_page_cache = PageCache()
+    return _shared_page_cache
@@ -11,8 +11,7 @@ import click
 
 # imports from this very package
 from brother_ql.devicedependent import models, label_sizes, label_type_specs, DIE_CUT_LABEL, ENDLESS_LABEL, ROUND_DIE_CUT_LABEL
-from brother_ql.models import ModelsManager
-from brother_ql.backends import available_backends, backend_factory
+from brother_ql.backends import available_backends
 
 
 logger = logging.getLogger('brother_ql')
@@ -112,7 +111,12 @@ def env(ctx, *args, **kwargs):
     print debug info about running environment
     """
     import sys, platform, os, shutil
-    from pkg_resources import get_distribution, working_set
+    import re
+    from importlib import metadata
+    try:
+        from packaging.markers import Marker
+    except ImportError:
+        Marker = None
     print("\n##################\n")
     print("Information about the running environment of brother_ql.")
     print("(Please provide this information when reporting any issue.)\n")
@@ -126,8 +130,18 @@ def env(ctx, *args, **kwargs):
     print("  *", py_version)
     # brother_ql
     print("About the brother_ql package:")
-    pkg = get_distribution('brother_ql')
-    print("  * package location:", pkg.location)
+    pkg = None
+    for dist_name in ('brother_ql-inventree', 'brother_ql'):
+        try:
+            pkg = metadata.distribution(dist_name)
+            break
+        except metadata.PackageNotFoundError:
+            pass
+    if pkg is None:
+        print("  * package not installed, running from", os.path.dirname(os.path.abspath(__file__)))
+        print("\n##################\n")
+        return
+    print("  * package location:", pkg.locate_file(''))
     print("  * package version: ", pkg.version)
     try:
         cli_loc = shutil.which('brother_ql')
@@ -139,13 +153,22 @@ def env(ctx, *args, **kwargs):
     fmt = "  {req:14s} | {spec:10s} | {ins_vers:17s}"
     print(fmt.format(req='requirement', spec='requested', ins_vers='installed version'))
     print(fmt.format(req='-' * 14, spec='-'*10, ins_vers='-'*17))
-    requirements = list(pkg.requires())
-    requirements.sort(key=lambda x: x.project_name)
-    for req in requirements:
-        proj = req.project_name
-        req_pkg = get_distribution(proj)
-        spec = ' '.join(req.specs[0]) if req.specs else 'any'
-        print(fmt.format(req=proj, spec=spec, ins_vers=req_pkg.version))
+    requirements = []
+    for req in pkg.requires or []:
+        req, _, marker = req.partition(';')
+        if 'extra' in marker:
+            continue
+        if marker.strip() and Marker is not None and not Marker(marker).evaluate():
+            continue
+        proj, spec = re.match(r'\s*([A-Za-z0-9_.\-]+)\s*(.*)', req).groups()
+        requirements.append((proj, spec.strip() or 'any'))
+    requirements.sort(key=lambda x: x[0].lower())
+    for proj, spec in requirements:
+        try:
+            ins_vers = metadata.version(proj)
+        except metadata.PackageNotFoundError:
+            ins_vers = '-'
+        print(fmt.format(req=proj, spec=spec, ins_vers=ins_vers))
     print("\n##################\n")
 
 @cli.command('print', short_help='Print a label')
@@ -154,7 +177,10 @@ def env(ctx, *args, **kwargs):
 @click.option('-r', '--rotate', type=click.Choice(('auto', '0', '90', '180', '270')), default='auto', help='Rotate the image (counterclock-wise) by this amount of degrees.')
 @click.option('-t', '--threshold', type=float, default=70.0, help='The threshold value (in percent) to discriminate between black and white pixels.')
 @click.option('-d', '--dither', is_flag=True, help='Enable dithering when converting the image to b/w. If set, --threshold is meaningless.')
+@click.option('--dither-mode', type=click.Choice(('floyd-steinberg', 'bayer4', 'bayer8', 'blue-noise')), help='The dithering algorithm (implies --dither). The ordered modes bayer4, bayer8 and blue-noise are fast and deterministic, so repeated labels and rows can be reused from the caches. Default: floyd-steinberg.')
 @click.option('-c', '--compress', is_flag=True, help='Enable compression (if available with the model). Label creation can take slightly longer but the resulting instruction size is normally considerably smaller.')
+@click.option('--auto-compress', is_flag=True, help='Decide for every page whether compression pays off, based on the estimated compression ratio and the throughput of the backend. Overrides --compress.')
+@click.option('--resample', type=click.Choice(('fast', 'balanced', 'lanczos')), default='lanczos', show_default=True, help='Quality of downscaling large images. fast and balanced shrink the image first (JPEGs already while decoding) and are much faster for photos and high resolution scans.')
 @click.option('--red', is_flag=True, help='Create a label to be printed on black/red/white tape (only with QL-8xx series on DK-22251 labels). You must use this option when printing on black/red tape, even when not printing red.')
 @click.option('--600dpi', 'dpi_600', is_flag=True, help='Print with 600x300 dpi available on some models. Provide your image as 600x600 dpi; perpendicular to the feeding the image will be resized to 300dpi.')
 @click.option('--hq', is_flag=True, help='Print with high quality (slower). Default is low quality.')
@@ -162,13 +188,16 @@ def env(ctx, *args, **kwargs):
 @click.option('-q', '--queue', is_flag=True, help='Enable print queue support.')
 @click.option('--copies', type=int, default=1, show_default=True, help='Specify the number of copies to print.')
 @click.option('--peeler', is_flag=True, help='Enable peeler (label peeling) mode if supported.')
+@click.option('--workers', type=int, default=1, show_default=True, help='Rasterize the pages of multi-page jobs in this many processes.')
+@click.option('--strip-height', type=int, help='Convert long pages on endless labels in bands of this many lines (e.g. 256) and start sending before the whole page is converted. Uses less memory for very long labels; --workers is then the number of threads converting bands. Not used with --queue.')
+@click.option('--cache-dir', type=click.Path(file_okay=False), envvar='BROTHER_QL_CACHE_DIR', help='Keep converted pages in this directory and reuse them when the same image is printed again with the same options.')
 @click.pass_context
 def print_cmd(ctx, *args, **kwargs):
     """ Print a label of the provided IMAGE. """
     backend = ctx.meta.get('BACKEND', 'pyusb')
     model = ctx.meta.get('MODEL')
     printer = ctx.meta.get('PRINTER')
-    from brother_ql.conversion import convert
+    from brother_ql.conversion import iter_convert
     from brother_ql.backends.helpers import send, get_printer
     from brother_ql.raster import BrotherQLRaster
     from brother_ql.print_queue import BrotherPrintQueue
@@ -176,6 +205,22 @@ def print_cmd(ctx, *args, **kwargs):
     qlr.exception_on_warning = True
     kwargs['cut'] = not kwargs['no_cut']
     del kwargs['no_cut']
+    if kwargs.pop('auto_compress'):
+        kwargs['compress'] = 'auto'
+        kwargs['backend'] = backend
+        if backend is None:
+            from brother_ql.backends import guess_backend
+            try:
+                kwargs['backend'] = guess_backend(printer)
+            except ValueError:
+                kwargs['backend'] = 'linux_kernel'
+    dither_mode = kwargs.pop('dither_mode')
+    if dither_mode:
+        kwargs['dither'] = dither_mode
+    cache_dir = kwargs.pop('cache_dir')
+    if cache_dir:
+        from brother_ql.cache import PageCache, DiskPageCache
+        kwargs['page_cache'] = PageCache(disk=DiskPageCache(cache_dir))
     use_print_queue = kwargs.get('queue', False)
 
     images = []
@@ -188,12 +233,16 @@ def print_cmd(ctx, *args, **kwargs):
     kwargs['images'] = images
 
     if use_print_queue:
+        # The print queue sends whole pages
+        kwargs.pop('strip_height')
         printer_instance = get_printer(printer_identifier=printer, backend_identifier=backend)
         queue = BrotherPrintQueue(printer_instance, qlr)
-        queue.queue_image(**kwargs)
+        if kwargs.get('compress') == 'auto':
+            kwargs['backend'] = printer_instance
+        queue.queue_pages(iter_convert(qlr=qlr, preamble=False, **kwargs))
         queue.submit()
     else:
-        instructions = convert(qlr=qlr, **kwargs)
+        instructions = iter_convert(qlr=qlr, **kwargs)
         send(instructions=instructions, printer_identifier=printer, backend_identifier=backend, blocking=True)
 
 @cli.command(name='analyze', help='interpret a binary file containing raster instructions for the Brother QL-Series printers')
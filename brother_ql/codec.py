@@ -0,0 +1,77 @@
+"""
+PackBits compression as used for the raster lines sent to the printers.
+
+The encoder finds runs of identical bytes with a regular expression
+(scanned in C) and copies everything else as literal blocks, so the
+work done in Python is proportional to the number of runs and blocks,
+not to the number of bytes. The decoder likewise copies whole blocks.
+"""
+
+import re
+
+#: A run of at least three identical bytes. Shorter runs are cheaper as part of a literal block.
+_RUN = re.compile(b'(.)\\1{2,}', re.DOTALL)
+
+#: The maximum number of bytes covered by a single literal block or run.
+MAX_BLOCK = 128
+
+
+def _literal(out, data, start, end):
+    while start < end:
+        num = min(end - start, MAX_BLOCK)
+        out.append(num - 1)
+        out += data[start:start+num]
+        start += num
+
+
+def _run(out, byte, num):
+    while num > 0:
+        chunk = min(num, MAX_BLOCK)
+        out.append(257 - chunk if chunk > 1 else 0)
+        out.append(byte)
+        num -= chunk
+
+
+def encode(data):
+    """
+    Compress `data` with PackBits.
+
+    :param bytes data: The data to compress (a single raster line, usually).
+    :returns: The compressed data (bytes).
+    """
+    data = bytes(data)
+    out = bytearray()
+    pos = 0
+    for match in _RUN.finditer(data):
+        start, end = match.span()
+        _literal(out, data, pos, start)
+        _run(out, data[start], end - start)
+        pos = end
+    _literal(out, data, pos, len(data))
+    return bytes(out)
+
+
+def decode(data):
+    """
+    Decompress PackBits compressed `data`.
+
+    :param bytes data: The compressed data.
+    :returns: The decompressed data (bytes).
+    """
+    data = bytes(data)
+    out = bytearray()
+    index = 0
+    length = len(data)
+    while index < length:
+        num = data[index]
+        if num < 0x80:
+            out += data[index+1:index+2+num]
+            index += 2 + num
+        elif num > 0x80:
+            out += data[index+1:index+2] * (257 - num)
+            index += 2
+        else:
+            # 0x80 is a no-op
+            index += 1
+    return bytes(out)
+
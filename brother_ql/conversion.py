@@ -2,171 +2,498 @@
 
 import logging
 import datetime
+import itertools
 
 from PIL import Image
-import PIL.ImageOps, PIL.ImageChops
+import PIL.ImageOps
 
 from brother_ql.devicedependent import ENDLESS_LABEL, DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL, PTOUCH_ENDLESS_LABEL
 from brother_ql.devicedependent import label_type_specs, right_margin_addition
 from brother_ql import BrotherQLUnsupportedCmd
-from brother_ql.image_trafos import filtered_hsv
+from brother_ql.image_trafos import separate_colors, ordered_dither, DEFAULT_CUTOFFS, DITHER_MODES
 from brother_ql.raster import BrotherQLRaster
+from brother_ql.encoder import shared_row_cache, image_to_frame, mirror_frame, place_frame, estimate_compression, PackedBitmap, BIT_INVERT
+from brother_ql.cache import CachedPage, image_digest, page_key, shared_page_cache
+from brother_ql.page import MEDIA_DIE_CUT, MEDIA_ENDLESS, MEDIA_PTOUCH_ENDLESS, assemble_page
+from brother_ql.geometry import TRANSPOSE, GeometryPlan, PagePlan, geometry_plan, paste_on_canvas
 
 logger = logging.getLogger(__name__)
 
 logging.getLogger("PIL.PngImagePlugin").setLevel(logging.WARNING)
 
-def preprocess_image(im, label_specs, qlr, options):
+#: compress='auto' で転送速度が分からない場合に想定する転送速度 (bytes/s, USB 程度)
+DEFAULT_THROUGHPUT = 1000000
+
+#: resample オプション: 縮小に使うフィルタと reducing_gap (Image.resize を参照)。
+#: 'lanczos' は従来どおり原寸で処理してから縮小する。'balanced' と 'fast' は先に縮小してから
+#: アルファ合成や色変換を行い、JPEG は Image.draft で縮小してデコードする。
+RESAMPLE_MODES = {
+    'fast': (Image.BILINEAR, 1.0),
+    'balanced': (Image.LANCZOS, 2.0),
+    'lanczos': (Image.LANCZOS, None),
+}
+
+def _geometry(label_specs, options):
     """
-    画像の前処理（ラスタライズ化）を行う関数。
-    options: dictで、red, dither, rotate, dpi_600, dots_printable, device_pixel_width, right_margin_dots, threshold などを含む
-    戻り値: (im, black_im, red_im)
+    ジョブの GeometryPlan。_job_settings() で作ったもの (options['geometry']) があればそれを使う。
+    """
+    geometry = options.get('geometry')
+    if geometry is None:
+        geometry = GeometryPlan(label_specs['kind'] in (ENDLESS_LABEL, PTOUCH_ENDLESS_LABEL), options['dots_printable'], options['device_pixel_width'],
+                                options['right_margin_dots'], options.get('rotate', 'auto'), options.get('dpi_600', False))
+    return geometry
+
+def plan_geometry(size, label_specs, options):
+    """
+    画像のサイズに対するページの変換 (geometry.PagePlan: 回転角、縮小後のサイズ、キャンバス上の位置) を返す。
+    90 度単位でない回転の場合は None
+    サイズが合わないダイカットラベルの場合は ValueError
+    """
+    return _geometry(label_specs, options).page(size)
+
+def _draft_request(im, label_specs, options, plan=None):
+    """
+    draft_image() で Image.draft に渡す (mode, size)。縮小前にデコードを小さくできない場合は None
+    """
+    resample = options.get('resample') or 'lanczos'
+    if resample == 'lanczos':
+        return None
+    if plan is None:
+        try:
+            plan = plan_geometry(im.size, label_specs, options)
+        except ValueError:
+            return None
+    if plan is None:
+        return None
+    width, height = plan.scaled_size
+    gap = RESAMPLE_MODES[resample][1]
+    mode = 'RGB' if options.get('red', False) else 'L'
+    return mode, (int(width * gap), int(height * gap))
+
+def draft_image(im, label_specs, options, plan=None):
+    """
+    resample が 'lanczos' 以外の場合、まだ読み込まれていない JPEG 画像を Image.draft で
+    必要なサイズに近い大きさでデコードするよう設定する（それ以外の画像では何もしない）。
+    plan: plan_geometry() の結果（省略時は計算する）
+    """
+    request = _draft_request(im, label_specs, options, plan)
+    if request is not None:
+        im.draft(*request)
+
+def _pad(im, plan, options):
+    """
+    plan のキャンバス（デバイスの幅）に画像を置く。キャンバスが不要な場合はそのまま返す。
+    """
+    if plan.canvas_size is None:
+        return im
+    return paste_on_canvas(im, plan.canvas_size, plan.offset, reuse=options.get('reuse_canvas', False))
+
+def _stage(stages, key, make):
+    """
+    make() の結果を返す。stages (dict) がある場合は key で共有する (convert_many())。
+    key には入力画像の id() を含める（入力画像は stages に残るので id は変わらない）。
+    """
+    if stages is None:
+        return make()
+    if key not in stages:
+        stages[key] = make()
+    return stages[key]
+
+def _flatten_alpha(im):
+    bg = Image.new("RGB", im.size, (255,255,255))
+    bg.paste(im, im.split()[-1])
+    return bg
+
+def _shrink_first(im, label_specs, options, plan, stages=None):
+    """
+    先に縮小してから、アルファ合成、色変換、回転（transpose）、パディングを行う。
+    stages: 途中の画像を共有する dict（_stage() を参照）
     """
     red = options.get('red', False)
-    dither = options.get('dither', False)
-    rotate = options.get('rotate', 'auto')
-    dpi_600 = options.get('dpi_600', False)
-    dots_printable = options['dots_printable']
-    device_pixel_width = options['device_pixel_width']
-    right_margin_dots = options['right_margin_dots']
-    threshold = options['threshold']
+    resample, reducing_gap = RESAMPLE_MODES[options.get('resample')]
+    draft_image(im, label_specs, options, plan)
+    if im.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        # P, 1 などはそのままでは補間して縮小できない
+        mode = 'RGBA' if im.mode.endswith('A') else 'RGB' if red else 'L'
+        im = _stage(stages, (id(im), 'convert', mode), lambda: im.convert(mode))
+    if not red and im.mode in ('RGB', 'RGBA'):
+        # 白黒印刷では輝度だけを縮小すればよい
+        mode = 'LA' if im.mode == 'RGBA' else 'L'
+        im = _stage(stages, (id(im), 'convert', mode), lambda: im.convert(mode))
+    if im.size != plan.scaled_size:
+        im = _stage(stages, (id(im), 'resize', plan.scaled_size, resample, reducing_gap),
+                    lambda: im.resize(plan.scaled_size, resample, reducing_gap=reducing_gap))
+    if im.mode.endswith('A'):
+        im = _stage(stages, (id(im), 'flatten'), lambda: _flatten_alpha(im))
+    elif im.mode == "L" and red:
+        im = _stage(stages, (id(im), 'convert', 'RGB'), lambda: im.convert("RGB"))
+    if plan.angle:
+        im = _stage(stages, (id(im), 'rotate', plan.angle), lambda: im.transpose(TRANSPOSE[plan.angle]))
+    return _stage(stages, (id(im), 'pad', plan.canvas_size, plan.offset), lambda: _pad(im, plan, options))
 
-    black_im = None
-    red_im = None
+def _fit_to_label(im, label_specs, options, stages=None):
+    """
+    従来の処理: 原寸でアルファ合成と色変換を行い、回転してから縮小し、パディングする。
+    90 度単位の回転は transpose で行い、パディングは 1 回だけ行う。
+    stages: 途中の画像を共有する dict（_stage() を参照）
+    """
+    red = options.get('red', False)
+    dpi_600 = options.get('dpi_600', False)
+    geometry = _geometry(label_specs, options)
+    dots_printable = geometry.dots_printable
+    dots_expected = geometry.dots_expected
 
     if im.mode.endswith('A'):
-        bg = Image.new("RGB", im.size, (255,255,255))
-        bg.paste(im, im.split()[-1])
-        im = bg
+        im = _stage(stages, (id(im), 'flatten'), lambda: _flatten_alpha(im))
     elif im.mode == "P":
-        im = im.convert("RGB" if red else "L")
+        mode = "RGB" if red else "L"
+        im = _stage(stages, (id(im), 'convert', mode), lambda: im.convert(mode))
     elif im.mode == "L" and red:
-        im = im.convert("RGB")
+        im = _stage(stages, (id(im), 'convert', 'RGB'), lambda: im.convert("RGB"))
 
-    if dpi_600:
-        dots_expected = [el*2 for el in dots_printable]
-    else:
-        dots_expected = dots_printable
+    angle = geometry.angle(im.size)
+    if angle % 90:
+        im = _stage(stages, (id(im), 'rotate', angle), lambda: im.rotate(angle, expand=True))
+    elif angle % 360:
+        im = _stage(stages, (id(im), 'rotate', angle % 360), lambda: im.transpose(TRANSPOSE[angle % 360]))
 
-    if label_specs['kind'] in (ENDLESS_LABEL, PTOUCH_ENDLESS_LABEL):
-        if rotate not in ('auto', 0):
-            im = im.rotate(rotate, expand=True)
+    if geometry.endless:
         if dpi_600:
-            im = im.resize((im.size[0]//2, im.size[1]))
+            im = _stage(stages, (id(im), 'resize', (im.size[0]//2, im.size[1]), None), lambda: im.resize((im.size[0]//2, im.size[1])))
         if im.size[0] != dots_printable[0]:
             hsize = int((dots_printable[0] / im.size[0]) * im.size[1])
-            im = im.resize((dots_printable[0], hsize), Image.LANCZOS)
-            if im.size[0] < device_pixel_width:
-                new_im = Image.new(im.mode, (device_pixel_width, im.size[1]), (255,)*len(im.mode))
-                new_im.paste(im, (device_pixel_width-im.size[0]-right_margin_dots, 0))
-                im = new_im
-    elif label_specs['kind'] in (DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL):
-        # 1. auto回転判定
-        if rotate == 'auto':
-            # dots_expectedが縦長で画像が横長なら90度回転
-            if dots_expected[0] < dots_expected[1] and im.size[0] > im.size[1]:
-                im = im.rotate(90, expand=True)
-            # dots_expectedが横長で画像が縦長なら-90度回転（必要なら）
-            elif dots_expected[0] > dots_expected[1] and im.size[0] < im.size[1]:
-                im = im.rotate(-90, expand=True)
-        elif rotate != 0:
-            im = im.rotate(rotate, expand=True)
-        # 2. サイズチェック＆リサイズ
-        if im.size[0] != dots_expected[0] or im.size[1] != dots_expected[1]:
+            im = _stage(stages, (id(im), 'resize', (dots_printable[0], hsize), Image.LANCZOS), lambda: im.resize((dots_printable[0], hsize), Image.LANCZOS))
+        canvas_size = (geometry.device_pixel_width, im.size[1]) if im.size[0] < geometry.device_pixel_width else None
+    else:
+        if im.size != dots_expected:
             logger.info(f"[DEBUG] 画像リサイズ: {im.size} → ({dots_printable[0]})")
-            input_ratio = im.size[0] / im.size[1]
-            expected_ratio = dots_expected[0] / dots_expected[1]
-            ratio_tolerance = 0.01
-            if abs(input_ratio - expected_ratio) / expected_ratio < ratio_tolerance:
-                im = im.resize(dots_expected, Image.LANCZOS)
-            else:
-                raise ValueError("Bad image dimensions: %s. Expecting: %s." % (im.size, dots_expected))
+            geometry.check_size(im.size)
+            im = _stage(stages, (id(im), 'resize', dots_expected, Image.LANCZOS), lambda: im.resize(dots_expected, Image.LANCZOS))
         if dpi_600:
-            im = im.resize((im.size[0]//2, im.size[1]))
-        new_im = Image.new(im.mode, (device_pixel_width, dots_expected[1]), (255,)*len(im.mode))
-        new_im.paste(im, (device_pixel_width-im.size[0]-right_margin_dots, 0))
-        im = new_im
+            im = _stage(stages, (id(im), 'resize', (im.size[0]//2, im.size[1]), None), lambda: im.resize((im.size[0]//2, im.size[1])))
+        canvas_size = (geometry.device_pixel_width, dots_expected[1])
+    plan = PagePlan(angle, im.size, im.size, geometry.offset(im.size[0]), canvas_size)
+    return _stage(stages, (id(im), 'pad', canvas_size, plan.offset), lambda: _pad(im, plan, options))
+
+def preprocess_image(im, label_specs, qlr, options, stages=None):
+    """
+    画像の前処理（ラスタライズ化）を行う関数。
+    options: dictで、red, dither, rotate, dpi_600, dots_printable, device_pixel_width, right_margin_dots, threshold, color_cutoffs, resample などを含む
+    stages: 複数のラベル向けの変換で途中の画像を共有する dict (convert_many())。共有する場合は reuse_canvas を使わないこと
+    戻り値: (im, black_im, red_im)
+    """
+    plan = None
+    if (options.get('resample') or 'lanczos') != 'lanczos':
+        plan = plan_geometry(im.size, label_specs, options)
+    if plan is not None:
+        im = _shrink_first(im, label_specs, options, plan, stages)
+    else:
+        im = _fit_to_label(im, label_specs, options, stages)
+    cutoffs = options.get('color_cutoffs')
+    key = (id(im), 'binarize', options.get('red', False), options.get('dither', False), options['threshold'], tuple(cutoffs) if cutoffs else None)
+    return _stage(stages, key, lambda: binarize_image(im, options))
+
+def binarize_image(im, options):
+    """
+    デバイスの幅にした画像を 2 値化する（2 色印刷の場合は黒と赤に分ける）。
+    戻り値: (im, black_im, red_im)
+    """
+    red = options.get('red', False)
+    dither = options.get('dither', False)
+    threshold = options['threshold']
 
+    black_im = None
+    red_im = None
     if red:
-        filter_h = lambda h: 255 if (h <  40 or h > 210) else 0
-        filter_s = lambda s: 255 if s > 100 else 0
-        filter_v = lambda v: 255 if v >  80 else 0
-        red_im = filtered_hsv(im, filter_h, filter_s, filter_v)
-        red_im = red_im.convert("L")
-        red_im = PIL.ImageOps.invert(red_im)
-        red_im = red_im.point(lambda x: 0 if x < threshold else 255, mode="1")
-        filter_h = lambda h: 255
-        filter_s = lambda s: 255
-        filter_v = lambda v: 255 if v <  80 else 0
-        black_im = filtered_hsv(im, filter_h, filter_s, filter_v)
-        black_im = black_im.convert("L")
-        black_im = PIL.ImageOps.invert(black_im)
-        black_im = black_im.point(lambda x: 0 if x < threshold else 255, mode="1")
-        black_im = PIL.ImageChops.subtract(black_im, red_im)
+        black_im, red_im = separate_colors(im, threshold, options.get('color_cutoffs') or DEFAULT_CUTOFFS)
     else:
         im = im.convert("L")
         im = PIL.ImageOps.invert(im)
-        if dither:
+        if dither in (True, 'floyd-steinberg'):
             im = im.convert("1", dither=Image.FLOYDSTEINBERG)
+        elif dither:
+            im = ordered_dither(im, dither)
         else:
             im = im.point(lambda x: 0 if x < threshold else 255, mode="1")
     return im, black_im, red_im
 
-def add_print_page(qlr, im, black_im, red_im, label_specs, hq, cut, peeler,is_last, is_first, compress, dpi_600, red, tape_size, feed_margin):
-    qlr.clear()
+def choose_compression(qlr, images, throughput=None):
+    """
+    compress='auto' の判定。ページの一部の行を圧縮してサイズを見積もり、
+    転送時間（throughput, bytes/s）と圧縮にかかる時間を比べて圧縮の有無を決める。
+    戻り値: (compress, estimate)
+    """
+    return _choose_compression(qlr, [image_to_frame(image) for image in images], throughput)
+
+def _choose_compression(qlr, frames, throughput=None):
+    if throughput is None:
+        throughput = DEFAULT_THROUGHPUT
+    row_len = qlr.get_pixel_width() // 8
+    frames = [mirror_frame(frame, row_len) for frame in frames]
+    zero_raster = qlr.zero_raster_support and qlr.zero_raster_enabled
+    estimate = estimate_compression(frames, row_len, ptouch=qlr.model.startswith('PT'), zero_raster=zero_raster)
+    time_uncompressed = estimate.uncompressed_size / throughput
+    time_compressed = estimate.compressed_size / throughput + estimate.encode_seconds
+    compress = time_compressed < time_uncompressed
+    logger.debug("Compression estimate: %s, throughput %d bytes/s -> compress=%s", estimate, throughput, compress)
+    return compress, estimate
+
+def _resolve_throughput(throughput=None, backend=None):
+    """
+    backend: バックエンドのインスタンス、クラス、または識別子 ('pyusb', 'network', ...)
+    """
+    if throughput is not None:
+        return throughput
+    if backend is None:
+        return None
+    if isinstance(backend, str):
+        from brother_ql.backends import backend_factory
+        backend = backend_factory(backend)['backend_class']
+    if isinstance(backend, type):
+        return backend.throughput
+    return backend.get_throughput()
+
+def encode_page(qlr, im, black_im, red_im, red, compress, throughput=None):
+    """
+    ページのラスタデータだけを作る。ページの位置に依存する命令（先頭/最終ページ、ページ番号）は含まないので、
+    作ったデータはジョブのどの位置でも使える（ページキャッシュ、並列変換、コピー）。
+    戻り値: (CachedPage, estimate)。estimate は compress='auto' の場合の見積もり、それ以外は None
+    """
+    estimate = None
+    if not qlr.compression_support:
+        compress = False
+    elif compress == 'auto':
+        compress, estimate = choose_compression(qlr, [black_im, red_im] if red else [im], throughput)
+    if red:
+        raster = qlr.encode_raster_data(black_im, red_im, compress=bool(compress))
+    else:
+        raster = qlr.encode_raster_data(im, compress=bool(compress))
+    return CachedPage(im.size[1], bool(compress), raster), estimate
+
+def encode_packed_page(qlr, frames, compress, throughput=None):
+    """
+    encode_page() と同じだが、画像の代わりにデバイスの幅のパックされたビット列 (bytes, memoryview など) を
+    そのままエンコーダに渡す。セットされたビットが印刷されるドット。
+    frames: [black] または 2 色印刷の場合 [black, red]
+    戻り値: (CachedPage, estimate)
+    """
+    estimate = None
+    if not qlr.compression_support:
+        compress = False
+    elif compress == 'auto':
+        compress, estimate = _choose_compression(qlr, frames, throughput)
+    raster = qlr.encode_packed_data(*frames, compress=bool(compress))
+    height = len(memoryview(frames[0]).cast('B')) // (qlr.get_pixel_width() // 8)
+    return CachedPage(height, bool(compress), raster), estimate
+
+def _bitmap_image(bitmap):
+    """
+    PackedBitmap を mode "1" の画像にする（モード "1" ではセットされたビットが白）。
+    """
+    width, height = bitmap.size
+    data = memoryview(bitmap.data).cast('B')
+    if len(data) != (width + 7) // 8 * height:
+        raise ValueError("Bad bitmap data: %d bytes for a size of %s." % (len(data), tuple(bitmap.size)))
+    return Image.frombytes('1', (width, height), bytes(data).translate(BIT_INVERT))
+
+def _packed_frame(image, label_specs, options):
+    """
+    既にラベルの大きさの 2 値データ (mode "1" の画像または PackedBitmap) の場合、
+    画像を作らずにデバイスの幅に配置したフレームを返す。それ以外の場合は None
+    """
+    if isinstance(image, PackedBitmap):
+        size, invert = tuple(image.size), False
+        data = memoryview(image.data).cast('B')
+        if len(data) != (size[0] + 7) // 8 * size[1]:
+            return None
+    elif isinstance(image, Image.Image) and image.mode == '1':
+        size, invert, data = image.size, True, None
+    else:
+        return None
+    if options.get('red', False) or options.get('dpi_600', False) or options['threshold'] <= 0:
+        return None
     try:
-        qlr.add_switch_mode()
-    except BrotherQLUnsupportedCmd:
-        pass
-    if is_first:
-        qlr.add_status_information()
+        plan = plan_geometry(size, label_specs, options)
+    except ValueError:
+        return None
+    if plan is None or plan.angle or plan.scaled_size != size:
+        return None
+    device_pixel_width = options['device_pixel_width']
+    offset = plan.offset
+    if plan.canvas_size is None:
+        if size[0] != device_pixel_width:
+            return None
+        offset = 0
+    if data is None:
+        data = image.tobytes()
+    return place_frame(data, size[0], device_pixel_width, offset, invert=invert)
+
+def _open_image(image):
+    """
+    image: Image インスタンス、画像のファイル名、ファイルハンドル、または PackedBitmap
+    戻り値: Image インスタンスまたは PackedBitmap
+    """
+    if isinstance(image, (Image.Image, PackedBitmap)):
+        return image
+    try:
+        return Image.open(image)
+    except OSError:
+        raise NotImplementedError("The image argument needs to be an Image() instance, the filename to an image, or a file handle.")
+
+def prepare_page(qlr, image, label_specs, options, compress, throughput=None):
+    """
+    画像を開き、前処理してページのラスタデータを作る。
+    image: Image インスタンス、画像のファイル名、ファイルハンドル、または PackedBitmap
+    既にラベルの大きさの 2 値データは前処理せずにそのままエンコードする (_packed_frame)。
+    戻り値: (CachedPage, estimate)、encode_page() を参照
+    """
+    im = _open_image(image)
+    frame = _packed_frame(im, label_specs, options)
+    if frame is not None:
+        return encode_packed_page(qlr, [frame], compress, throughput)
+    if isinstance(im, PackedBitmap):
+        im = _bitmap_image(im)
+    # キャンバスはこの関数の中でしか使わないので、ページ間で再利用できる
+    im, black_im, red_im = preprocess_image(im, label_specs, qlr, dict(options, reuse_canvas=True))
+    return encode_page(qlr, im, black_im, red_im, options.get('red', False), compress, throughput)
+
+def add_print_page(qlr, im, black_im, red_im, label_specs, hq, cut, peeler,is_last, is_first, compress, dpi_600, red, tape_size, feed_margin, throughput=None, cached=None, estimate=None):
+    """
+    cached: encode_page() で作ったページのラスタデータ (CachedPage)。この場合 im, black_im, red_im は使わない
+    estimate: cached と一緒に encode_page() から返された圧縮の見積もり
+    """
+    if cached is None:
+        cached, estimate = encode_page(qlr, im, black_im, red_im, red, compress, throughput)
+    spec = page_spec(qlr, label_specs, hq, cut, peeler, dpi_600, red, tape_size, feed_margin, compress)
+    return _write_page(qlr, spec, cached, estimate, is_first, is_last, throughput)
 
+def page_spec(qlr, label_specs, hq, cut, peeler, dpi_600, red, tape_size, feed_margin, compress=False):
+    """
+    ジョブのページの設定 (page.PageSpec) を返す。変更できないのでスレッド間で共有できる。
+    compress: page.encode_page() で圧縮するかどうか。'auto' は False として扱う（ページごとの判定は encode_page() で行う）
+    """
     # ここにTDの場合は「媒体情報追加コマンド」を
     # qlr.add_device_information()
-
+    media = {}
     if label_specs['kind'] in (DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL):
-        qlr.mtype = 0x0B
-        qlr.mwidth = tape_size[0]
-        qlr.mlength = tape_size[1]
+        media = dict(media_type=MEDIA_DIE_CUT, media_width=tape_size[0], media_length=tape_size[1])
     elif label_specs['kind'] in (ENDLESS_LABEL, ):
-        qlr.mtype = 0x0A
-        qlr.mwidth = tape_size[0]
-        qlr.mlength = 0
+        media = dict(media_type=MEDIA_ENDLESS, media_width=tape_size[0], media_length=0)
     elif label_specs['kind'] in (PTOUCH_ENDLESS_LABEL, ):
-        qlr.mtype = 0x00
-        qlr.mwidth = tape_size[0]
-        qlr.mlength = 0
-    qlr.pquality = int(hq)
-    qlr.add_media_and_quality(im.size[1])
-    try:
-        if cut and is_last:
-            qlr.add_mode_setting(autocut=True, peeler=peeler)
-            qlr.add_cut_every(1)
-        else:
-            qlr.add_mode_setting(autocut=False, peeler=peeler)
-    except BrotherQLUnsupportedCmd:
-        pass
-    try:
-        qlr.dpi_600 = dpi_600
-        qlr.cut_at_end = True
-        qlr.two_color_printing = True if red else False
-        qlr.add_expanded_mode()
-    except BrotherQLUnsupportedCmd:
-        pass
-    qlr.add_wait(0)
-    qlr.add_margins(feed_margin)
+        media = dict(media_type=MEDIA_PTOUCH_ENDLESS, media_width=tape_size[0], media_length=0)
+    return qlr.page_spec(quality=bool(hq), cut=bool(cut), peeler=bool(peeler), cut_at_end=True, dpi_600=bool(dpi_600), two_color=bool(red),
+                         feed_margin=feed_margin, compress=compress is True, **media)
+
+def _write_page(qlr, spec, cached, estimate, is_first, is_last, throughput=None):
+    """
+    ページの命令を page.assemble_page() で作って qlr のバッファに書き、圧縮の判定を記録する。
+    """
+    data = assemble_page(spec, cached, is_first, is_last)
+    qlr.clear()
+    qlr.buffer.write(data)
     if qlr.compression_support:
-        qlr.add_compression(compress)
-    if red:
-        qlr.add_raster_data(black_im, red_im)
+        # 圧縮の判定と実際の圧縮率（ヘッダ付きの非圧縮行に対する比率）を記録する
+        height = cached.height
+        plain_size = height * (2 if spec.two_color else 1) * (3 + qlr.get_pixel_width() // 8)
+        qlr.compression_decisions.append(dict(
+            page=len(qlr.compression_decisions),
+            compress=cached.compress,
+            estimated_ratio=estimate.compressed_size / estimate.plain_size if estimate and estimate.plain_size else None,
+            achieved_ratio=len(cached.raster) / plain_size if plain_size else None,
+            throughput=(throughput or DEFAULT_THROUGHPUT) if estimate else None,
+        ))
+    return data
+
+def _lookup_pages(images, page_cache=None, key_options=None):
+    """
+    各画像について (image, key, cached) を返すジェネレータ。
+    直前と同じ画像（コピー）は image=None で返し、ページキャッシュにあったページは cached で返す。
+    """
+    previous = None
+    for image in images:
+        if previous is not None and image is previous:
+            yield None, None, None
+            continue
+        previous = image
+        key = cached = None
+        if page_cache is not None:
+            digest, image = image_digest(image)
+            key = page_key(digest, **key_options)
+            cached = page_cache.get(key)
+        yield image, key, cached
+
+def _iter_page_bodies(qlr, images, label, options, compress, throughput, page_cache=None, key_options=None, workers=1):
+    """
+    各ページのラスタデータ (CachedPage, estimate) を順番に返すジェネレータ。
+    workers > 1 の場合はプロセスプールで並列に変換する (brother_ql.parallel)。
+    """
+    entries = _lookup_pages(images, page_cache, key_options)
+    if workers and workers > 1:
+        from brother_ql.parallel import rasterize_pages
+        results = rasterize_pages(entries, workers, qlr, label, options, compress, throughput)
     else:
-        qlr.add_raster_data(im)
-    qlr.add_print(last_page=is_last)
-    return qlr.data
+        label_specs = label_type_specs[label]
+        results = ((image, key, cached, prepare_page(qlr, image, label_specs, options, compress, throughput) if image is not None and cached is None else None)
+                   for image, key, cached in entries)
+    last = None
+    for image, key, cached, result in results:
+        if image is None:
+            # コピー: 直前のページのラスタデータをそのまま使う
+            yield last
+            continue
+        if cached is not None:
+            result = (cached, None)
+        elif page_cache is not None:
+            page_cache.put(key, result[0])
+        last = result
+        yield result
 
-def _rasterize_images(qlr: BrotherQLRaster, images, label, queue: bool = False, copies: int = 1, **kwargs):
+def _expand_copies(images, copies=1):
     """
-    copies: 同じ画像を何枚印刷するか（効率化用）
+    画像が 1 つだけの場合、それを copies 回返す。画像が複数ある場合は copies を無視する。
+    images はリストでなくてもよい（先頭の 2 つだけを先に読む）。
+    """
+    if copies <= 1:
+        yield from images
+        return
+    images = iter(images)
+    head = list(itertools.islice(images, 2))
+    if len(head) == 1:
+        yield from itertools.repeat(head[0], copies)
+        return
+    yield from head
+    yield from images
+
+def _with_last(items):
+    """
+    (item, is_last) を返すジェネレータ。最終ページの判定のため 1 つ先まで読む。
+    """
+    items = iter(items)
+    try:
+        current = next(items)
+    except StopIteration:
+        return
+    for item in items:
+        yield current, False
+        current = item
+    yield current, True
+
+def _job_settings(qlr: BrotherQLRaster, label, **kwargs):
+    """
+    convert() のオプションを解釈して、ジョブの設定 (dict) を返す。qlr の設定（row_cache など）も行う。
+    compress: True/False、または 'auto'（ページごとに転送速度と圧縮率の見積もりから判定）
+    throughput / backend: compress='auto' の判定に使う転送速度（bytes/s）、またはバックエンド
+    row_cache: True で圧縮済みラスタ行をプロセス内で共有するキャッシュを使う（RowCache インスタンスも可）
+    color_cutoffs: red=True の場合の赤と黒の分離に使う HSV のしきい値 (image_trafos.ColorCutoffs)
+    dither: True（Floyd-Steinberg）または DITHER_MODES のいずれか。'bayer4', 'bayer8', 'blue-noise' は
+        ピクセルごとに独立した組織的ディザで、結果が決定的なので行キャッシュやページキャッシュが効く
+    resample: 縮小の品質 'fast', 'balanced', 'lanczos'（デフォルト、従来どおり）。RESAMPLE_MODES を参照
+    workers: 2 以上の場合、ページをこの数のプロセスで並列に変換する (brother_ql.parallel)
+    strip_height: エンドレスラベルでこの行数より長いページを、この行数ごとの帯に分けて変換・送信する (brother_ql.strips)。
+        中間画像のメモリが帯の大きさで済み、ページ全体の変換を待たずに送信を始められる。
+        この場合 workers は帯を並列に処理するスレッドの数になり、ページキャッシュは使わない
+    page_cache: True でプロセス内で共有するページキャッシュを使う（PageCache インスタンスも可）。
+        画像と変換オプションが同じページは画像処理とエンコードを省略し、キャッシュしたラスタデータを使う
     """
     label_specs = label_type_specs[label]
     dots_printable = label_specs['dots_printable']
@@ -176,6 +503,12 @@ def _rasterize_images(qlr: BrotherQLRaster, images, label, queue: bool = False,
     cut = kwargs.get('cut', True)
     peeler = kwargs.get('peeler', False)
     dither = kwargs.get('dither', False)
+    if dither is True:
+        dither = 'floyd-steinberg'
+    elif not dither:
+        dither = False
+    elif dither not in DITHER_MODES:
+        raise ValueError("Unknown dither mode: %s. Choose from %s." % (dither, ', '.join(DITHER_MODES)))
     compress = kwargs.get('compress', False)
     red = kwargs.get('red', False)
     rotate = kwargs.get('rotate', 'auto')
@@ -185,53 +518,107 @@ def _rasterize_images(qlr: BrotherQLRaster, images, label, queue: bool = False,
     threshold = kwargs.get('threshold', 70)
     threshold = 100.0 - threshold
     threshold = min(255, max(0, int(threshold/100.0 * 255)))
+    color_cutoffs = kwargs.get('color_cutoffs', None)
+    resample = kwargs.get('resample', None) or 'lanczos'
+    if resample not in RESAMPLE_MODES:
+        raise ValueError("Unknown resample mode: %s. Choose from %s." % (resample, ', '.join(RESAMPLE_MODES)))
+    throughput = _resolve_throughput(kwargs.get('throughput', None), kwargs.get('backend', None))
+    row_cache = kwargs.get('row_cache', None)
+    if row_cache is True:
+        qlr.row_cache = shared_row_cache()
+    elif row_cache:
+        qlr.row_cache = row_cache
+    page_cache = kwargs.get('page_cache', None)
+    if page_cache is True:
+        page_cache = shared_page_cache()
     if red and not qlr.two_color_support:
         raise BrotherQLUnsupportedCmd('Printing in red is not supported with the selected model.')
+
+    key_options = None
+    if page_cache is not None:
+        key_options = dict(model=qlr.model, label=label, rotate=rotate, threshold=threshold, dither=dither, red=red, dpi_600=dpi_600, hq=hq, compress=compress, cut=cut,
+                           color_cutoffs=tuple(color_cutoffs or DEFAULT_CUTOFFS) if red else None, resample=resample,
+                           zero_raster=qlr.zero_raster_support and qlr.zero_raster_enabled)
+        if compress == 'auto':
+            key_options['throughput'] = throughput
+    options = dict(red=red, dither=dither, rotate=rotate, dpi_600=dpi_600, dots_printable=dots_printable, device_pixel_width=device_pixel_width, right_margin_dots=right_margin_dots, threshold=threshold, color_cutoffs=color_cutoffs, resample=resample,
+                   geometry=geometry_plan(qlr.model, label, rotate, dpi_600))
+    spec = page_spec(qlr, label_specs, hq, cut, peeler, dpi_600, red, label_specs['tape_size'], label_specs['feed_margin'], compress)
+    return dict(label=label, label_specs=label_specs, options=options, spec=spec, compress=compress, throughput=throughput, page_cache=page_cache, key_options=key_options,
+                hq=hq, cut=cut, peeler=peeler, dpi_600=dpi_600, red=red, workers=kwargs.get('workers', 1),
+                strip_height=kwargs.get('strip_height', None))
+
+def _assemble_page(qlr: BrotherQLRaster, job, page, estimate, is_first, is_last):
+    """
+    encode_page() で作ったページのラスタデータに、ページの位置に依存する命令を付けて 1 ページ分の命令を返す。
+    """
+    return _write_page(qlr, job['spec'], page, estimate, is_first, is_last, job['throughput'])
+
+def _assemble_strip_page(qlr: BrotherQLRaster, job, page, estimate, is_first, is_last):
+    """
+    strips.strip_page() で帯ごとに作るページの命令を返すジェネレータ。
+    ページの前の命令、各帯のラスタデータ、印刷命令の順に返す。
+    """
+    data = _assemble_page(qlr, job, CachedPage(page.height, page.compress, b''), estimate, is_first, is_last)
+    # 最後の 1 バイトが印刷命令 (0x0C / 0x1A)
+    yield data[:-1]
+    raster_size = 0
+    for chunk in page.chunks:
+        raster_size += len(chunk)
+        yield chunk
+    if qlr.compression_support and qlr.compression_decisions:
+        plain_size = page.height * (2 if job['red'] else 1) * (3 + qlr.get_pixel_width() // 8)
+        qlr.compression_decisions[-1]['achieved_ratio'] = raster_size / plain_size if plain_size else None
+    yield data[-1:]
+
+def _iter_rasterized(qlr: BrotherQLRaster, images, label, copies: int = 1, **kwargs):
+    """
+    ページごとの命令 (bytes) を順番に返すジェネレータ。
+    images はリスト以外の iterable（ジェネレータなど）でもよく、画像は必要になった時点で読み込む。
+    copies: 同じ画像を何枚印刷するか（効率化用）
+    その他のオプションは _job_settings() を参照。
+    """
+    job = _job_settings(qlr, label, **kwargs)
     qlr.add_invalidate()
     qlr.add_initialize()
-    page_data = []
-    logger.info(f"Rasterizing {len(images)} pages (copies={copies})")
-
-    # 画像リストを作成
-    if len(images) == 1 and copies > 1:
-        images_to_process = [images[0]] * copies
-    else:
-        images_to_process = images
+    qlr.compression_decisions = []
+    logger.info(f"Rasterizing {len(images) if hasattr(images, '__len__') else 'a stream of'} pages (copies={copies})")
 
-    for i, image in enumerate(images_to_process):
-        if isinstance(image, Image.Image):
-            im = image
-        else:
-            try:
-                im = Image.open(image)
-            except OSError:
-                raise NotImplementedError("The image argument needs to be an Image() instance, the filename to an image, or a file handle.")
-        options = dict(red=red, dither=dither, rotate=rotate, dpi_600=dpi_600, dots_printable=dots_printable, device_pixel_width=device_pixel_width, right_margin_dots=right_margin_dots, threshold=threshold)
-        im, black_im, red_im = preprocess_image(im, label_specs, qlr, options)
-        is_last = (i == len(images_to_process) - 1)
-        is_first = (i == 0)
-        tape_size = label_specs['tape_size']
-        feed_margin = label_specs['feed_margin']
-        data = add_print_page(qlr, im, black_im, red_im, label_specs, hq, cut, peeler, is_last, is_first, compress, dpi_600, red, tape_size, feed_margin)
-        page_data.append(data)
+    images_to_process = _expand_copies(images, copies)
+    if job['strip_height']:
+        from brother_ql.strips import iter_job
+        yield from iter_job(qlr, job, images_to_process, job['strip_height'], job['workers'] or 1)
+        return
+    bodies = _iter_page_bodies(qlr, images_to_process, label, job['options'], job['compress'], job['throughput'], job['page_cache'], job['key_options'], job['workers'])
+    for i, ((page, estimate), is_last) in enumerate(_with_last(bodies)):
+        yield _assemble_page(qlr, job, page, estimate, i == 0, is_last)
 
+def _rasterize_images(qlr: BrotherQLRaster, images, label, queue: bool = False, copies: int = 1, **kwargs):
+    page_data = list(_iter_rasterized(qlr, images, label, copies=copies, **kwargs))
     if queue:
         return page_data
     else:
         data = b''.join(page_data)
         return data
 
-def convert(qlr: BrotherQLRaster, images, label, **kwargs):
-    # Legacy method with no queue support, returns a single bytes object
+def iter_convert(qlr: BrotherQLRaster, images, label, preamble: bool = True, **kwargs):
+    """
+    convert() のジェネレータ版。最初に初期化の命令（preamble=False の場合は省略）、
+    その後 1 ページ分の命令 (bytes) ずつ返すので、ジョブ全体をメモリに持たずに送信を始められる。
+    images はリスト以外の iterable でもよい。画像の代わりにパックされた 2 値データ (encoder.PackedBitmap) も使える。戻り値は helpers.send() や
+    BrotherPrintQueue.queue_pages()（preamble=False で）にそのまま渡せる。
+    """
     qlr.add_invalidate()
     qlr.add_initialize()
-    # qlr.add_status_information()
     setup_data = qlr.data
     qlr.clear()
+    if preamble:
+        yield setup_data
+    yield from _iter_rasterized(qlr, images, label, **kwargs)
 
-    copies = kwargs.pop('copies', 1)
-    page_data = _rasterize_images(qlr, images, label, copies=copies, **kwargs)
-    return setup_data + page_data
+def convert(qlr: BrotherQLRaster, images, label, **kwargs):
+    # Legacy method with no queue support, returns a single bytes object
+    return b''.join(iter_convert(qlr, images, label, **kwargs))
 
 def queue_convert(qlr: BrotherQLRaster, images, label, **kwargs):
     # Queue conversion method, init handled by the print queue class
@@ -239,3 +626,88 @@ def queue_convert(qlr: BrotherQLRaster, images, label, **kwargs):
     kwargs['queue'] = True
     page_data = _rasterize_images(qlr, images, label, **kwargs)
     return page_data
+
+def _reopen(image, im):
+    """
+    画像をもう一度開く。image がファイル名、シーク可能なファイルハンドル、またはファイルから開いた Image の場合のみ。
+    戻り値: 新しい Image インスタンス、開き直せない場合は None
+    """
+    source = image
+    if isinstance(image, Image.Image):
+        source = getattr(im, 'filename', None)
+        if not source:
+            return None
+    elif hasattr(image, 'seek'):
+        try:
+            image.seek(0)
+        except (OSError, ValueError):
+            return None
+    return Image.open(source)
+
+def _decode_per_draft(image, im, jobs):
+    """
+    convert_many() 用に、ジョブごとにデコードした画像のリストを返す。
+    JPEG を Image.draft でデコードする場合は、draft のサイズが同じジョブで 1 つのデコードを共有し、
+    サイズが違うジョブには画像を開き直してそれぞれのサイズでデコードする（convert() と同じ結果になる）。
+    開き直せない画像では最初のデコードを共有するので、draft のサイズが違うジョブは convert() と数ドット違うことがある。
+    """
+    if not isinstance(im, Image.Image):
+        return [im] * len(jobs)
+    # draft が効くのは読み込み前の JPEG だけ
+    drafting = bool(getattr(im, 'tile', None)) and type(im).draft is not Image.Image.draft
+    requests = [_draft_request(im, job['label_specs'], job['options']) if drafting else None for job in jobs]
+    decoded = {}
+    for request in requests:
+        if request in decoded:
+            continue
+        decoded_im = im if not decoded else _reopen(image, im)
+        if decoded_im is None:
+            decoded[request] = decoded[requests[0]]
+            continue
+        if request is not None:
+            decoded_im.draft(*request)
+        decoded_im.load()
+        decoded[request] = decoded_im
+    return [decoded[request] for request in requests]
+
+def convert_many(image, targets):
+    """
+    1 つの画像を複数のプリンタ／ラベル向けに変換する。
+    画像のデコードは 1 回だけ（JPEG を draft でデコードする場合は draft のサイズごとに 1 回、_decode_per_draft() を参照）で、パラメータが同じ途中の処理（アルファ合成、グレースケール化、回転、縮小、2 値化）は
+    ターゲット間で共有し、ラベルのジオメトリやしきい値が違うところから分岐する。
+    image: Image インスタンス、画像のファイル名、ファイルハンドル、または PackedBitmap
+    targets: (model, label, options) のリスト。model はモデル名または BrotherQLRaster インスタンス、
+        options は convert() のオプションの dict（省略可）。copies 以外のジョブ全体のオプション
+        (workers, page_cache, strip_height) は使わない
+    戻り値: ターゲットごとの命令 (bytes) のリスト（それぞれ convert() の戻り値と同じ。開き直せない JPEG の例外は _decode_per_draft() を参照）
+    """
+    im = _open_image(image)
+    jobs = []
+    for target in targets:
+        model, label = target[:2]
+        kwargs = dict(target[2]) if len(target) > 2 and target[2] else {}
+        qlr = model if isinstance(model, BrotherQLRaster) else BrotherQLRaster(model)
+        jobs.append((qlr, _job_settings(qlr, label, **kwargs), kwargs.get('copies', 1)))
+    images = _decode_per_draft(image, im, [job for qlr, job, copies in jobs])
+    bitmap = _bitmap_image(im) if isinstance(im, PackedBitmap) else None
+    stages = {}
+    results = []
+    for (qlr, job, copies), im in zip(jobs, images):
+        label_specs, options = job['label_specs'], job['options']
+        frame = _packed_frame(im, label_specs, options)
+        if frame is not None:
+            page, estimate = encode_packed_page(qlr, [frame], job['compress'], job['throughput'])
+        else:
+            page_im, black_im, red_im = preprocess_image(im if bitmap is None else bitmap, label_specs, qlr, options, stages)
+            page, estimate = encode_page(qlr, page_im, black_im, red_im, job['red'], job['compress'], job['throughput'])
+        # 前のジョブの最後のページがバッファに残っていることがある
+        qlr.clear()
+        qlr.add_invalidate()
+        qlr.add_initialize()
+        data = [qlr.data]
+        qlr.clear()
+        qlr.compression_decisions = []
+        for i in range(copies):
+            data.append(_assemble_page(qlr, job, page, estimate, i == 0, i == copies - 1))
+        results.append(b''.join(data))
+    return results
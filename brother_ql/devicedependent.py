@@ -17,45 +17,40 @@ import logging
 logger = logging.getLogger(__name__)
 
 ## These module level variables were available here before.
-# Concerning labels
-DIE_CUT_LABEL = None
-ENDLESS_LABEL = None
-ROUND_DIE_CUT_LABEL = None
-PTOUCH_ENDLESS_LABEL = None
-label_type_specs = {}
-label_sizes = []
-# And concerning printer models
-models = []
-min_max_length_dots = {}
-min_max_feed = {}
-number_bytes_per_row = {}
-right_margin_addition = {}
-modesetting = []
-cuttingsupport = []
-expandedmode = []
-compressionsupport = []
-two_color_support = []
+# Concerning labels:
+#   DIE_CUT_LABEL, ENDLESS_LABEL, ROUND_DIE_CUT_LABEL, PTOUCH_ENDLESS_LABEL,
+#   label_type_specs, label_sizes
+# And concerning printer models:
+#   models, min_max_length_dots, min_max_feed, number_bytes_per_row, right_margin_addition,
+#   modesetting, cuttingsupport, expandedmode, compressionsupport, two_color_support
+_LABEL_NAMES = ('DIE_CUT_LABEL', 'ENDLESS_LABEL', 'ROUND_DIE_CUT_LABEL', 'PTOUCH_ENDLESS_LABEL',
+                'label_type_specs', 'label_sizes')
+_MODEL_NAMES = ('models', 'min_max_length_dots', 'min_max_feed', 'number_bytes_per_row', 'right_margin_addition',
+                'modesetting', 'cuttingsupport', 'expandedmode', 'compressionsupport', 'two_color_support')
 
-## Let's recreate them using the improved data structures
-## in brother_ql.models and brother_ql.labels
+## They are now views over the compiled registry built from
+## brother_ql.models and brother_ql.labels (see brother_ql.registry).
+## The lists are immutable and support constant time membership tests.
 
 def _populate_model_legacy_structures():
-    from brother_ql.models import ModelsManager
+    from brother_ql.registry import get_registry
     global models
     global min_max_length_dots, min_max_feed, number_bytes_per_row, right_margin_addition
     global modesetting, cuttingsupport, expandedmode, compressionsupport, two_color_support
 
-    for model in ModelsManager().iter_elements():
-        models.append(model.identifier)
+    registry = get_registry()
+    models = registry.model_identifiers
+    min_max_length_dots, min_max_feed, number_bytes_per_row, right_margin_addition = {}, {}, {}, {}
+    for model in registry.models:
         min_max_length_dots[model.identifier] = model.min_max_length_dots
         min_max_feed[model.identifier] = model.min_max_feed
         number_bytes_per_row[model.identifier] = model.number_bytes_per_row
         right_margin_addition[model.identifier] = model.additional_offset_r
-        if model.mode_setting: modesetting.append(model.identifier)
-        if model.cutting: cuttingsupport.append(model.identifier)
-        if model.expanded_mode: expandedmode.append(model.identifier)
-        if model.compression_support: compressionsupport.append(model.identifier)
-        if model.two_color: two_color_support.append(model.identifier)
+    modesetting = registry.models_with('mode_setting')
+    cuttingsupport = registry.models_with('cutting')
+    expandedmode = registry.models_with('expanded_mode')
+    compressionsupport = registry.models_with('compression_support')
+    two_color_support = registry.models_with('two_color')
 
 def _populate_label_legacy_structures():
     """
@@ -71,10 +66,11 @@ def _populate_label_legacy_structures():
     ROUND_DIE_CUT_LABEL = FormFactor.ROUND_DIE_CUT
     PTOUCH_ENDLESS_LABEL =FormFactor.PTOUCH_ENDLESS
 
-    from brother_ql.labels import LabelsManager
-    lm = LabelsManager()
-    label_sizes = list(lm.iter_identifiers())
-    for label in lm.iter_elements():
+    from brother_ql.registry import get_registry
+    registry = get_registry()
+    label_sizes = registry.label_identifiers
+    label_type_specs = {}
+    for label in registry.labels:
         l = {}
         l['name'] = label.name
         l['kind'] = label.form_factor
@@ -91,4 +87,12 @@ def _populate_all_legacy_structures():
     _populate_label_legacy_structures()
     _populate_model_legacy_structures()
 
-_populate_all_legacy_structures()
+def __getattr__(name):
+    # The structures are only created when they are first accessed.
+    if name in _LABEL_NAMES:
+        _populate_label_legacy_structures()
+    elif name in _MODEL_NAMES:
+        _populate_model_legacy_structures()
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    return globals()[name]
@@ -0,0 +1,332 @@
+"""
+Encoding of 1-bit frames into raster line instructions.
+
+A *frame* is the packed bit content of one color plane of a page,
+row after row, as produced by ``PIL.Image.tobytes()`` for images in mode "1"
+(eight pixels per byte, most significant bit first, a set bit is a printed dot).
+The functions in this module work on whole frames at once. If NumPy is
+available, mirroring and the framing of uncompressed rows are done in bulk
+on arrays, otherwise equivalent pure Python code is used.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from brother_ql import codec
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+#: The 'zero raster' instruction, sent instead of a raster row without any dot.
+ZERO_RASTER = b'\x5A'
+
+#: Translation table reversing the order of the bits in a byte.
+BIT_REVERSE = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+#: Translation table inverting the bits of a byte.
+BIT_INVERT = bytes(255 - i for i in range(256))
+
+#: Page content given as packed bits instead of an image.
+#:
+#: * `data`: The rows of the page (any bytes-like object, e.g. a :py:class:`memoryview`),
+#:   eight pixels per byte, most significant bit first, every row padded to whole bytes.
+#:   A set bit is a printed dot.
+#: * `size`: The size (width, height) of the page in pixels.
+PackedBitmap = namedtuple('PackedBitmap', ['data', 'size'])
+
+if np is not None:
+    _BIT_REVERSE_ARRAY = np.frombuffer(BIT_REVERSE, dtype=np.uint8)
+
+
+def image_to_frame(image):
+    """
+    :param PIL.Image.Image image: The image to convert. Converted to mode "1" if necessary.
+    :returns: The packed bits of the image (bytes).
+    """
+    if image.mode != '1':
+        image = image.convert('1')
+    return image.tobytes(encoder_name='raw')
+
+
+def place_frame(frame, width, device_width, offset, invert=False):
+    """
+    Place the rows of a packed frame on rows of the device width without
+    unpacking them into an image. The pixels left and right of the frame are blank.
+
+    :param frame: The packed bit frame (bytes-like), every row padded to whole bytes.
+    :param int width: The width of the frame in pixels.
+    :param int device_width: The width of the resulting rows in pixels (a multiple of 8).
+    :param int offset: The horizontal position of the frame on the rows.
+    :param bool invert: Invert the bits of the frame (for mode "1" images, where a set bit is white).
+    :returns: The packed bit frame of the device width (bytes).
+    """
+    in_len = (width + 7) // 8
+    row_len = device_width // 8
+    num_rows = len(frame) // in_len
+    if width == device_width and offset == 0:
+        frame = bytes(frame[:num_rows*in_len])
+        return frame.translate(BIT_INVERT) if invert else frame
+    if np is not None:
+        rows = np.frombuffer(frame, dtype=np.uint8, count=num_rows*in_len).reshape(num_rows, in_len)
+        if invert:
+            rows = ~rows
+        if offset < 0 or offset + width > device_width:
+            # Pixels outside of the rows are cut off (like pasting into an image)
+            bits = np.zeros((num_rows, device_width), dtype=np.uint8)
+            start, end = max(0, -offset), min(width, device_width - offset)
+            if start < end:
+                bits[:, offset+start:offset+end] = np.unpackbits(rows, axis=1, count=width)[:, start:end]
+            return np.packbits(bits, axis=1).tobytes()
+        # The bytes are shifted by the offset within a byte and copied to their position
+        shift, first = offset % 8, offset // 8
+        extended = np.zeros((num_rows, in_len + 1), dtype=np.uint8)
+        extended[:, :in_len] = rows
+        if width % 8:
+            extended[:, in_len-1] &= (0xFF << (8 - width % 8)) & 0xFF
+        shifted = extended >> shift
+        if shift:
+            shifted[:, 1:] |= extended[:, :-1] << (8 - shift)
+        used = (shift + width + 7) // 8
+        out = np.zeros((num_rows, row_len), dtype=np.uint8)
+        out[:, first:first+used] = shifted[:, :used]
+        return out.tobytes()
+    # The rows are shifted as integers: the padding bits of the input row
+    # are dropped to the right, then the row is moved to its position.
+    drop = in_len * 8 - width
+    shift = device_width - offset - width
+    mask = (1 << width) - 1
+    clip = (1 << device_width) - 1
+    frame = bytes(frame[:num_rows*in_len])
+    parts = []
+    for start in range(0, num_rows*in_len, in_len):
+        value = int.from_bytes(frame[start:start+in_len], 'big') >> drop
+        if invert:
+            value ^= mask
+        value = value << shift if shift >= 0 else value >> -shift
+        parts.append((value & clip).to_bytes(row_len, 'big'))
+    return b''.join(parts)
+
+
+def mirror_frame(frame, row_len):
+    """
+    Mirror a frame horizontally (the printer expects the rows right to left).
+
+    Instead of transposing an image, the byte order of every row
+    is reversed and the bits of each byte are reversed with a lookup table.
+
+    :param bytes frame: The packed bit frame.
+    :param int row_len: The number of bytes per row.
+    """
+    num_rows = len(frame) // row_len
+    if np is not None:
+        rows = np.frombuffer(frame, dtype=np.uint8, count=num_rows*row_len).reshape(num_rows, row_len)
+        return _BIT_REVERSE_ARRAY[rows[:, ::-1]].tobytes()
+    # Reversing the whole frame reverses the order of the rows as well,
+    # so the rows are taken from the end.
+    reverse = bytes(frame[:num_rows*row_len]).translate(BIT_REVERSE)[::-1]
+    return b''.join(reverse[start:start+row_len] for start in range((num_rows-1)*row_len, -1, -row_len))
+
+
+def row_prefixes(ptouch=False, planes=1):
+    """
+    :returns: The opcode prefixes of the raster rows of each color plane.
+    """
+    if ptouch:
+        return [b'\x47'] * planes
+    if planes == 2:
+        return [b'\x77\x01', b'\x77\x02']
+    return [b'\x67\x00']
+
+
+def row_header(prefix, length, ptouch=False):
+    """
+    :returns: The header (opcode prefix and length field) for a raster row with `length` bytes of payload.
+    """
+    if ptouch:
+        return prefix + bytes([length % 256, length // 256])
+    return prefix + bytes([length])
+
+
+def encode_frames(frames, row_len, ptouch=False, compress=False, zero_raster=False, cache=None):
+    """
+    Create the raster row instructions for one page.
+
+    :param list frames: One frame per color plane (black, and red for two-color printing),
+        already mirrored for the printer.
+    :param int row_len: The number of bytes per row.
+    :param bool ptouch: Use the row framing of the P-touch models.
+    :param bool compress: Compress the rows with PackBits (see :py:mod:`brother_ql.codec`).
+    :param bool zero_raster: Send rows without any dot in all of the planes
+        as a single 'zero raster' instruction (0x5A).
+    :param RowCache cache: A cache for compressed rows to use.
+    :returns: The raster instructions (bytes). For two color planes, the rows of
+        both planes are interleaved.
+    """
+    prefixes = row_prefixes(ptouch, len(frames))
+    num_rows = len(frames[0]) // row_len
+    if compress:
+        return _encode_rows_compressed(frames, row_len, num_rows, prefixes, ptouch, zero_raster, cache)
+    headers = [row_header(prefix, row_len, ptouch) for prefix in prefixes]
+    if np is not None:
+        header_len = len(headers[0])
+        out = np.empty((num_rows, len(frames), header_len + row_len), dtype=np.uint8)
+        for plane, (header, frame) in enumerate(zip(headers, frames)):
+            out[:, plane, :header_len] = np.frombuffer(header, dtype=np.uint8)
+            out[:, plane, header_len:] = np.frombuffer(frame, dtype=np.uint8, count=num_rows*row_len).reshape(num_rows, row_len)
+        if not zero_raster:
+            return out.tobytes()
+        out = out.reshape(num_rows, -1)
+        blank = ~out.reshape(num_rows, len(frames), -1)[:, :, header_len:].any(axis=(1, 2))
+        # Blank rows are reduced to their first byte, which becomes the zero raster opcode.
+        keep = np.ones(out.shape, dtype=bool)
+        keep[blank, 1:] = False
+        out[blank, 0] = ZERO_RASTER[0]
+        return out[keep].tobytes()
+    blank_row = bytes(row_len)
+    parts = []
+    for start in range(0, num_rows*row_len, row_len):
+        rows = [frame[start:start+row_len] for frame in frames]
+        if zero_raster and all(row == blank_row for row in rows):
+            parts.append(ZERO_RASTER)
+            continue
+        for header, row in zip(headers, rows):
+            parts.append(header)
+            parts.append(row)
+    return b''.join(parts)
+
+
+def _encode_rows_compressed(frames, row_len, num_rows, prefixes, ptouch, zero_raster, cache):
+    if cache is None:
+        # Still compress identical rows of this page only once.
+        cache = RowCache(maxsize=None)
+    blank_row = bytes(row_len)
+    # A plane without any dot (often the red one) isn't sliced row by row.
+    empty_planes = [frame.count(0) == len(frame) for frame in frames]
+    parts = []
+    for start in range(0, num_rows*row_len, row_len):
+        rows = [blank_row if empty else frame[start:start+row_len] for frame, empty in zip(frames, empty_planes)]
+        if zero_raster and all(row == blank_row for row in rows):
+            parts.append(ZERO_RASTER)
+            continue
+        for prefix, row in zip(prefixes, rows):
+            key = (prefix, row)
+            encoded = cache.get(key)
+            if encoded is None:
+                encoded = codec.encode(row)
+                encoded = row_header(prefix, len(encoded), ptouch) + encoded
+                cache.put(key, encoded)
+            parts.append(encoded)
+    return b''.join(parts)
+
+
+CompressionEstimate = namedtuple('CompressionEstimate', ['plain_size', 'uncompressed_size', 'compressed_size', 'encode_seconds'])
+
+
+def estimate_compression(frames, row_len, ptouch=False, zero_raster=False, samples=64):
+    """
+    Estimate the size of the raster instructions for a page with and without
+    compression by compressing an evenly spaced sample of its rows.
+
+    :param list frames: The (mirrored) frames of the page, see :py:func:`encode_frames`.
+    :param int samples: The maximum number of rows to compress.
+    :returns: A :py:class:`CompressionEstimate` with the size of the rows without any
+        zero raster instructions or compression (`plain_size`), the estimated sizes
+        without and with compression and the estimated time needed to compress the page.
+    """
+    header_len = len(row_header(row_prefixes(ptouch)[0], 0, ptouch))
+    num_rows = len(frames[0]) // row_len
+    plain_size = num_rows * len(frames) * (header_len + row_len)
+    if num_rows == 0:
+        return CompressionEstimate(plain_size, plain_size, plain_size, 0.0)
+    step = max(1, num_rows // samples)
+    blank_row = bytes(row_len)
+    uncompressed = compressed = sampled = 0
+    start_time = time.perf_counter()
+    for start in range(0, num_rows*row_len, step*row_len):
+        rows = [frame[start:start+row_len] for frame in frames]
+        sampled += 1
+        if zero_raster and all(row == blank_row for row in rows):
+            uncompressed += len(ZERO_RASTER)
+            compressed += len(ZERO_RASTER)
+            continue
+        for row in rows:
+            uncompressed += header_len + row_len
+            compressed += header_len + len(codec.encode(row))
+    encode_seconds = (time.perf_counter() - start_time) * num_rows / sampled
+    scale = num_rows / sampled
+    return CompressionEstimate(plain_size, int(uncompressed * scale), int(compressed * scale), encode_seconds)
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class RowCache(object):
+    """
+    A bounded LRU cache mapping raw raster rows to their compressed
+    form including the row header.
+
+    Labels created from the same template share most of their rows, so a
+    cache kept across pages and jobs avoids compressing them again.
+    Only compressed rows go through the cache: framing uncompressed rows
+    in bulk is cheaper than looking them up.
+
+    :param int maxsize: The maximum number of rows to keep. None for no limit.
+    """
+
+    def __init__(self, maxsize=8192):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._rows[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.maxsize is not None:
+                self._rows.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._rows[key] = value
+            if self.maxsize is not None and len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+
+    def info(self):
+        """
+        :returns: Hit and miss counters and the size of the cache (:py:class:`CacheInfo`).
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._rows))
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+
+_shared_row_cache = None
+
+def shared_row_cache():
+    """
+    :returns: The :py:class:`RowCache` shared by all conversions of this process that ask for it.
+    """
+    global _shared_row_cache
+    if _shared_row_cache is None:
+        _shared_row_cache = RowCache()
+    return _shared_row_cache
@@ -0,0 +1,167 @@
+"""
+The geometry of a page: how an image is rotated, scaled and padded
+to fill the printable area of a label.
+
+A :py:class:`GeometryPlan` is computed once per combination of model,
+label, rotation and resolution (see :py:func:`geometry_plan`). For the
+size of an input image it returns a :py:class:`PagePlan` with the
+composite transform: the rotation (a lossless transpose, only right
+angles are planned), the size to scale the image to and where to place
+it on the canvas of the device width.
+
+Canvases can be reused from page to page (:py:func:`paste_on_canvas`):
+the image of every page covers the same area of the canvas, so the
+margins stay white and only the pasted area is written.
+"""
+
+import functools
+import threading
+from collections import namedtuple
+
+from PIL import Image
+
+from brother_ql.devicedependent import ENDLESS_LABEL, PTOUCH_ENDLESS_LABEL, label_type_specs, right_margin_addition, number_bytes_per_row
+
+#: The transpose methods for rotations (counter-clockwise, in degrees).
+TRANSPOSE = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+
+#: The plan for a page.
+#:
+#: * `angle`: The rotation (counter-clockwise) of the input image: 0, 90, 180 or 270 degrees.
+#: * `scaled_size`: The size to scale the input image to before rotating it.
+#: * `size`: The size of the image after scaling and rotating it.
+#: * `offset`: The horizontal position of the image on the canvas.
+#: * `canvas_size`: The size of the canvas, None if the image isn't padded.
+PagePlan = namedtuple('PagePlan', ['angle', 'scaled_size', 'size', 'offset', 'canvas_size'])
+
+
+class GeometryPlan(object):
+    """
+    The geometry of the pages for a label on a printer.
+
+    :param bool endless: Whether the label is endless (the length of the page follows the image).
+    :param dots_printable: The printable area (width, height) of the label in dots.
+    :param int device_pixel_width: The width of the raster lines of the printer.
+    :param int right_margin_dots: The margin to the right of the printable area.
+    :param rotate: 'auto' or the rotation (counter-clockwise) in degrees.
+    :param bool dpi_600: Whether the image is given in 600x600 dpi and printed in 600x300 dpi.
+    """
+
+    __slots__ = ('endless', 'dots_printable', 'dots_expected', 'device_pixel_width', 'right_margin_dots', 'rotate', 'dpi_600')
+
+    def __init__(self, endless, dots_printable, device_pixel_width, right_margin_dots, rotate='auto', dpi_600=False):
+        self.endless = endless
+        self.dots_printable = tuple(dots_printable)
+        self.dots_expected = tuple(el*2 for el in dots_printable) if dpi_600 else self.dots_printable
+        self.device_pixel_width = device_pixel_width
+        self.right_margin_dots = right_margin_dots
+        self.rotate = rotate
+        self.dpi_600 = dpi_600
+
+    def angle(self, size):
+        """
+        :returns: The rotation for an image of the given size (may be any angle if requested).
+        """
+        if self.endless:
+            return 0 if self.rotate in ('auto', 0) else self.rotate
+        if self.rotate == 'auto':
+            dots_expected = self.dots_expected
+            if dots_expected[0] < dots_expected[1] and size[0] > size[1]:
+                return 90
+            if dots_expected[0] > dots_expected[1] and size[0] < size[1]:
+                return 270
+            return 0
+        return self.rotate
+
+    def check_size(self, size):
+        """
+        :param size: The size of a rotated image for a die-cut label.
+        :raises ValueError: If the aspect ratio doesn't match the label.
+        """
+        dots_expected = self.dots_expected
+        if tuple(size) != dots_expected:
+            input_ratio = size[0] / size[1]
+            expected_ratio = dots_expected[0] / dots_expected[1]
+            if abs(input_ratio - expected_ratio) / expected_ratio >= 0.01:
+                raise ValueError("Bad image dimensions: %s. Expecting: %s." % (tuple(size), list(dots_expected)))
+
+    def page(self, size):
+        """
+        :param size: The size of the input image.
+        :returns: The :py:class:`PagePlan` for the image, None if it is to be rotated by an angle other than a right angle.
+        :raises ValueError: If the image doesn't fit a die-cut label.
+        """
+        angle = self.angle(size)
+        if angle % 90:
+            return None
+        angle %= 360
+        width, height = size
+        if angle in (90, 270):
+            width, height = height, width
+        if self.endless:
+            if self.dpi_600:
+                width //= 2
+            if width != self.dots_printable[0]:
+                height = int((self.dots_printable[0] / width) * height)
+                width = self.dots_printable[0]
+            canvas_size = (self.device_pixel_width, height) if width < self.device_pixel_width else None
+        else:
+            self.check_size((width, height))
+            width, height = self.dots_expected
+            if self.dpi_600:
+                width //= 2
+            canvas_size = (self.device_pixel_width, height)
+        scaled_size = (height, width) if angle in (90, 270) else (width, height)
+        offset = self.device_pixel_width - width - self.right_margin_dots
+        return PagePlan(angle, scaled_size, (width, height), offset, canvas_size)
+
+    def offset(self, width):
+        """
+        :returns: The horizontal position of an image of the given width on the canvas.
+        """
+        return self.device_pixel_width - width - self.right_margin_dots
+
+
+@functools.lru_cache(maxsize=256)
+def geometry_plan(model, label, rotate='auto', dpi_600=False):
+    """
+    :returns: The (shared) :py:class:`GeometryPlan` for a label on a model.
+    """
+    label_specs = label_type_specs[label]
+    try:
+        device_pixel_width = number_bytes_per_row[model] * 8
+    except KeyError:
+        device_pixel_width = number_bytes_per_row['default'] * 8
+    right_margin_dots = label_specs['right_margin_dots'] + right_margin_addition.get(model, 0)
+    endless = label_specs['kind'] in (ENDLESS_LABEL, PTOUCH_ENDLESS_LABEL)
+    return GeometryPlan(endless, label_specs['dots_printable'], device_pixel_width, right_margin_dots, rotate, dpi_600)
+
+
+_canvases = threading.local()
+
+def paste_on_canvas(im, canvas_size, offset, reuse=False):
+    """
+    Place an image on a white canvas.
+
+    :param PIL.Image.Image im: The image.
+    :param canvas_size: The size of the canvas.
+    :param int offset: The horizontal position of the image on the canvas.
+    :param bool reuse: Reuse the canvas of a previous call with the same mode, size and
+        placement of the image in this thread. The returned canvas is only valid until
+        the next such call.
+    """
+    if not reuse:
+        canvas = Image.new(im.mode, canvas_size, (255,)*len(im.mode))
+        canvas.paste(im, (offset, 0))
+        return canvas
+    key = (im.mode, tuple(canvas_size), im.size, offset)
+    cache = getattr(_canvases, 'cache', None)
+    if cache is None:
+        cache = _canvases.cache = {}
+    canvas = cache.get(key)
+    if canvas is None:
+        if len(cache) >= 8:
+            cache.clear()
+        canvas = cache[key] = Image.new(im.mode, canvas_size, (255,)*len(im.mode))
+    canvas.paste(im, (offset, 0))
+    return canvas
@@ -1,5 +1,134 @@
-from PIL import Image
-import colorsys
+import functools
+from collections import namedtuple
+
+from PIL import Image, ImageChops
+
+#: The HSV cutoffs (0-255) separating red and black pixels for two-color printing.
+#: A pixel is red if its hue is below ``red_hue[0]`` or above ``red_hue[1]``, its
+#: saturation above `red_saturation` and its value above `red_value`.
+#: A pixel is black if its value is below `black_value` (and it isn't red).
+ColorCutoffs = namedtuple('ColorCutoffs', ['red_hue', 'red_saturation', 'red_value', 'black_value'])
+
+DEFAULT_CUTOFFS = ColorCutoffs(red_hue=(40, 210), red_saturation=100, red_value=80, black_value=80)
+
+
+def _mask(band, condition):
+    """ A mode "1" mask of the pixels of `band` for which `condition(value)` holds. """
+    return band.point([255 if condition(x) else 0 for x in range(256)], '1')
+
+
+def separate_colors(im, threshold, cutoffs=DEFAULT_CUTOFFS):
+    """
+    Separate an image into its black and red layer for two-color printing.
+
+    The image is converted to HSV once, the red and black pixels are
+    selected with lookup tables on the bands and the masks are combined
+    with :py:mod:`PIL.ImageChops`, so no per-pixel work is done in Python.
+    Pixels of a layer are only printed if they are darker than `threshold`
+    (after inversion, as for black and white printing).
+
+    :param PIL.Image.Image im: The image.
+    :param int threshold: The threshold (0-255) applied to the inverted luminance.
+    :param ColorCutoffs cutoffs: The cutoffs between red, black and white pixels.
+    :returns: A tuple (black_im, red_im) of mode "1" images, a set pixel is printed.
+    """
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    hue, saturation, value = im.convert('HSV').split()
+    low_hue, high_hue = cutoffs.red_hue
+    red_mask = ImageChops.logical_and(
+        ImageChops.logical_and(_mask(hue, lambda h: h < low_hue or h > high_hue),
+                               _mask(saturation, lambda s: s > cutoffs.red_saturation)),
+        _mask(value, lambda v: v > cutoffs.red_value))
+    black_mask = _mask(value, lambda v: v < cutoffs.black_value)
+    if threshold <= 0:
+        # Even the pixels outside of the masks pass the threshold
+        red_im = Image.new('1', im.size, 1)
+        black_im = Image.new('1', im.size, 1)
+    else:
+        dark = _mask(im.convert('L'), lambda l: 255 - l >= threshold)
+        red_im = ImageChops.logical_and(red_mask, dark)
+        black_im = ImageChops.logical_and(black_mask, dark)
+    black_im = ImageChops.subtract(black_im, red_im)
+    return black_im, red_im
+
+
+#: The dithering modes: error diffusion (PIL's Floyd-Steinberg) and ordered dithering
+#: with a 4x4 or 8x8 Bayer matrix or a 16x16 blue noise tile, see :py:func:`ordered_dither`.
+DITHER_MODES = ('floyd-steinberg', 'bayer4', 'bayer8', 'blue-noise')
+
+#: The ranks (0-255) of a 16x16 blue noise tile (void-and-cluster, sigma 1.5), row after row.
+BLUE_NOISE_16 = bytes.fromhex(
+    'c625af3912a245225b90df663be46d95fe5cdb98e161bce3a834c30b9f26b31e'
+    '367b0952892c800371ee2381f75dd38ce5c1a5f01daef63e9953b1cc467a054f'
+    '6817426fce4d64d4be0f6a9318edba972ab2dd9131b7138b28f83ae02faa3cd7'
+    'f57f5501fd9c74e95aa477b65870880e449bc46c24cb4007d94715d102faca62'
+    'ea1a37e68757b082bb94e7839e4a20a7d273ab4cd516f32d6b1f385f27bf8f32'
+    '068dbd0da37696cf51ffc8adf179de6956fc3063ef35480ca68a720a541441b4'
+    '1cda7dc51bdc67e8c01943d892c2ec9a6e3da04e8eb59d7c2e60e2a1335e7e2b'
+    'f2b804eb2959083ff4ac7821f900a9d6498565cd75fbc786d0104bb984c95011'
+)
+
+
+def bayer_matrix(n):
+    """
+    :param int n: The size of the matrix, a power of two.
+    :returns: The ranks (0 to n*n-1) of the n x n Bayer matrix, row after row.
+    """
+    if n == 1:
+        return [0]
+    half = n // 2
+    smaller = bayer_matrix(half)
+    ranks = []
+    for y in range(n):
+        for x in range(n):
+            quadrant = (0, 2, 3, 1)[(y // half) * 2 + x // half]
+            ranks.append(4 * smaller[(y % half) * half + x % half] + quadrant)
+    return ranks
+
+
+@functools.lru_cache(maxsize=None)
+def _threshold_tile(mode):
+    """ A tuple (n, thresholds) with the n x n thresholds (0-255) of an ordered dithering mode. """
+    if mode == 'blue-noise':
+        ranks, n = BLUE_NOISE_16, 16
+    elif mode in ('bayer4', 'bayer8'):
+        n = int(mode[5:])
+        ranks = bayer_matrix(n)
+    else:
+        raise ValueError("Unknown ordered dithering mode: %s" % mode)
+    return n, bytes((2 * rank + 1) * 255 // (2 * n * n) for rank in ranks)
+
+
+@functools.lru_cache(maxsize=8)
+def _threshold_image(mode, size):
+    """ The thresholds of an ordered dithering mode tiled over an image of the given size (mode "L"). """
+    n, tile = _threshold_tile(mode)
+    width, height = size
+    rows = [(tile[y*n:(y+1)*n] * (width // n + 1))[:width] for y in range(n)]
+    return Image.frombytes('L', size, b''.join(rows[y % n] for y in range(height)))
+
+
+def ordered_dither(im, mode='bayer8'):
+    """
+    Binarize an image by comparing every pixel with a threshold from a tile
+    repeated over the image (ordered dithering).
+
+    Unlike error diffusion, every pixel is handled independently of the
+    others: the result is deterministic and a change in one part of the
+    image doesn't change the bits elsewhere, so identical rows stay
+    identical (see :py:class:`brother_ql.encoder.RowCache`). The comparison
+    is done with :py:func:`PIL.ImageChops.subtract` and a lookup table.
+
+    :param PIL.Image.Image im: The image (mode "L"), 255 being full ink.
+    :param str mode: 'bayer4', 'bayer8' or 'blue-noise'.
+    :returns: An image in mode "1", a set pixel is printed.
+    """
+    if im.mode != 'L':
+        im = im.convert('L')
+    above = ImageChops.subtract(im, _threshold_image(mode, im.size))
+    return above.point([0] + [255] * 255, '1')
+
 
 def filtered_hsv(im, filter_h, filter_s, filter_v, default_col=(255,255,255)):
     """ https://stackoverflow.com/a/22237709/183995 """
@@ -7,16 +136,11 @@ def filtered_hsv(im, filter_h, filter_s, filter_v, default_col=(255,255,255)):
     hsv_im = im.convert('HSV')
     H, S, V = 0, 1, 2
     hsv = hsv_im.split()
-    mask_h = hsv[H].point(filter_h)
-    mask_s = hsv[S].point(filter_s)
-    mask_v = hsv[V].point(filter_v)
-
-    Mdat = []
-    for h, s, v in zip(mask_h.getdata(), mask_s.getdata(), mask_v.getdata()):
-        Mdat.append(255 if (h and s and v) else 0)
-
-    mask = mask_h
-    mask.putdata(Mdat)
+    # Each filter is applied as a lookup table, the masks are combined with multiply (255*255/255 = 255)
+    mask = None
+    for band, filter_band in ((hsv[H], filter_h), (hsv[S], filter_s), (hsv[V], filter_v)):
+        band_mask = band.point([255 if filter_band(x) else 0 for x in range(256)])
+        mask = band_mask if mask is None else ImageChops.multiply(mask, band_mask)
 
     filtered_im = Image.new("RGB", im.size, color=default_col)
     filtered_im.paste(im, None, mask)
@@ -1,6 +1,6 @@
 
 from attr import attrs, attrib
-from typing import List, Tuple
+from typing import Tuple
 from enum import IntEnum
 
 import copy
@@ -32,12 +32,13 @@ class Color(IntEnum):
     #: The label can be printed in black, white & red.
     BLACK_RED_WHITE = 1
 
-@attrs
+@attrs(frozen=True, slots=True)
 class Label(object):
     """
     This class represents a label. All specifics of a certain label
     and what the rasterizer needs to take care of depending on the
     label choosen, should be contained in this class.
+    Instances are immutable.
     """
     #: A string identifier given to each label that can be selected. Eg. '29'.
     identifier = attrib(type=str)
@@ -55,8 +56,8 @@ class Label(object):
     #: This is non-zero for some smaller label sizes and for endless labels.
     feed_margin = attrib(type=int, default=0)
     #: If a label can only be printed with certain label printers, this member variable lists the allowed ones.
-    #: Otherwise it's an empty list.
-    restricted_to_models = attrib(type=List[str], factory=list)
+    #: Otherwise it's empty.
+    restricted_to_models = attrib(type=Tuple[str, ...], default=(), converter=tuple)
     #: Some labels allow printing in red, most don't.
     color = attrib(type=Color, default=Color.BLACK_WHITE)
 
@@ -64,7 +65,7 @@ class Label(object):
         """
         Method to determine if certain label can be printed by the specified printer model.
         """
-        if self.restricted_to_models and model not in models: return False
+        if self.restricted_to_models and model not in self.restricted_to_models: return False
         else: return True
 
     @property
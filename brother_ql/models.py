@@ -5,11 +5,12 @@ import copy
 
 from brother_ql.helpers import ElementsManager
 
-@attrs
+@attrs(frozen=True, slots=True)
 class Model(object):
     """
     This class represents a printer model. All specifics of a certain model
     and the opcodes it supports should be contained in this class.
+    Instances are immutable.
     """
 
     #: A string identifier given to each model implemented. Eg. 'QL-500'.
@@ -21,6 +22,8 @@ class Model(object):
     #: The minimum and maximum amount of feeding a label
     min_max_feed = attrib(type=Tuple[int, int], default=(35, 1500))
     number_bytes_per_row = attrib(type=int, default=90)
+    #: The resolution of the print head in dots per inch (across and along the tape).
+    dpi = attrib(type=int, default=300)
     #: The required additional offset from the right side
     additional_offset_r = attrib(type=int, default=0)
     #: Support for the 'mode setting' opcode
@@ -33,6 +36,8 @@ class Model(object):
     #: Model has support for compressing the transmitted raster data.
     #: Some models with only USB connectivity don't support compression.
     compression_support = attrib(type=bool, default=True)
+    #: Model understands the 'zero raster' opcode (0x5A) to send a blank raster line as a single byte.
+    zero_raster = attrib(type=bool, default=False)
     #: Support for two color printing (black/red/white)
     #: available only on some newer models.
     two_color = attrib(type=bool, default=False)
@@ -112,6 +117,7 @@ ALL_MODELS = [
     Model(
         identifier="QL-700",
         min_max_length_dots=(150, 11811),
+        zero_raster=True,
         compression_support=False,
         mode_setting=False,
         series_code=0x34,
@@ -121,6 +127,7 @@ ALL_MODELS = [
     Model(
         identifier="QL-710W",
         min_max_length_dots=(150, 11811),
+        zero_raster=True,
         series_code=0x34,
         model_code=0x36,
         product_id=0x2043,
@@ -128,6 +135,7 @@ ALL_MODELS = [
     Model(
         identifier="QL-720NW",
         min_max_length_dots=(150, 11811),
+        zero_raster=True,
         series_code=0x34,
         model_code=0x37,
         product_id=0x2044,
@@ -135,6 +143,7 @@ ALL_MODELS = [
     Model(
         identifier="QL-800",
         min_max_length_dots=(150, 11811),
+        zero_raster=True,
         two_color=True,
         compression_support=False,
         num_invalidate_bytes=400,
@@ -145,6 +154,7 @@ ALL_MODELS = [
     Model(
         identifier="QL-810W",
         min_max_length_dots=(150, 11811),
+        zero_raster=True,
         two_color=True,
         num_invalidate_bytes=400,
         series_code=0x34,
@@ -154,6 +164,7 @@ ALL_MODELS = [
     Model(
         identifier="QL-820NWB",
         min_max_length_dots=(150, 11811),
+        zero_raster=True,
         two_color=True,
         num_invalidate_bytes=400,
         series_code=0x34,
@@ -181,6 +192,7 @@ ALL_MODELS = [
     Model(
         identifier="QL-1100",
         min_max_length_dots=(301, 35434),
+        zero_raster=True,
         number_bytes_per_row=162,
         additional_offset_r=44,
         series_code=0x34,
@@ -190,6 +202,7 @@ ALL_MODELS = [
     Model(
         identifier="QL-1110NWB",
         min_max_length_dots=(301, 35434),
+        zero_raster=True,
         number_bytes_per_row=162,
         additional_offset_r=44,
         series_code=0x34,
@@ -199,6 +212,7 @@ ALL_MODELS = [
     Model(
         identifier="QL-1115NWB",
         min_max_length_dots=(301, 35434),
+        zero_raster=True,
         number_bytes_per_row=162,
         additional_offset_r=44,
         series_code=0x34,
@@ -207,7 +221,9 @@ ALL_MODELS = [
     ),
     Model(
         identifier="PT-E550W",
+        dpi=180,
         min_max_length_dots=(31, 14172),
+        zero_raster=True,
         number_bytes_per_row=16,
         series_code=0x30,
         model_code=0x68,
@@ -215,7 +231,9 @@ ALL_MODELS = [
     ),
     Model(
         identifier="PT-P700",
+        dpi=180,
         min_max_length_dots=(31, 7086),
+        zero_raster=True,
         number_bytes_per_row=16,
         series_code=0x30,
         model_code=0x67,
@@ -223,7 +241,9 @@ ALL_MODELS = [
     ),
     Model(
         identifier="PT-P750W",
+        dpi=180,
         min_max_length_dots=(31, 7086),
+        zero_raster=True,
         number_bytes_per_row=16,
         series_code=0x30,
         model_code=0x68,
@@ -231,7 +251,9 @@ ALL_MODELS = [
     ),
     Model(
         identifier="PT-P900W",
+        dpi=360,
         min_max_length_dots=(57, 28346),
+        zero_raster=True,
         number_bytes_per_row=70,
         series_code=0x30,
         model_code=0x69,
@@ -239,7 +261,9 @@ ALL_MODELS = [
     ),
     Model(
         identifier="PT-P950NW",
+        dpi=360,
         min_max_length_dots=(57, 28346),
+        zero_raster=True,
         number_bytes_per_row=70,
         series_code=0x30,
         model_code=0x70,
@@ -247,6 +271,7 @@ ALL_MODELS = [
     ),
     Model(
         identifier="TD-4420DN",
+        dpi=203,
         min_max_length_dots=(96, 23977),
         number_bytes_per_row=104,
         series_code=0x35,
@@ -0,0 +1,269 @@
+"""
+Stateless encoding of pages.
+
+A :py:class:`PageSpec` holds everything determining the instructions of
+the pages of a job besides their raster data: the printer model, the
+media and the print settings. It is immutable, so a single spec can be
+shared by any number of threads, and :py:func:`encode_page` turns a spec
+and the packed bits of a page into the instructions of the page without
+touching any other state::
+
+    spec = PageSpec('QL-820NWB', media_type=MEDIA_ENDLESS, media_width=62, compress=True)
+    data = encode_page(spec, PackedBitmap(frame, (720, 200)), is_last=True)
+
+The instructions are built by the functions for the single commands below,
+which :py:class:`brother_ql.raster.BrotherQLRaster` uses as well.
+"""
+
+import functools
+import struct
+
+from attr import attrs, attrib
+
+from brother_ql import BrotherQLRasterError
+from brother_ql.cache import CachedPage
+from brother_ql.encoder import encode_frames, mirror_frame
+from brother_ql.registry import get_registry
+
+#: The media type of die-cut labels.
+MEDIA_DIE_CUT = 0x0B
+#: The media type of endless labels.
+MEDIA_ENDLESS = 0x0A
+#: The media type of P-touch tapes.
+MEDIA_PTOUCH_ENDLESS = 0x00
+
+
+def switch_mode():
+    """ ESC i a: Switch to the raster mode. """
+    return b'\x1B\x69\x61\x01'
+
+
+def status_information():
+    """ ESC i S: Status information request. """
+    return b'\x1B\x69\x53'
+
+
+def media_and_quality(media_type, media_width, media_length, quality, rnumber, first_page):
+    """
+    ESC i z: Print information.
+
+    :param media_type: The media type or None, see :py:data:`MEDIA_ENDLESS` etc.
+    :param media_width: The width of the media in mm or None.
+    :param media_length: The length of the media in mm (0 for endless media) or None.
+    :param bool quality: Whether to give priority to print quality.
+    :param int rnumber: The number of raster lines of the page.
+    :param bool first_page: Whether the page is the first one of the job.
+    """
+    valid_flags = 0x80
+    valid_flags |= (media_type is not None) << 1
+    valid_flags |= (media_width is not None) << 2
+    valid_flags |= (media_length is not None) << 3
+    valid_flags |= bool(quality) << 6
+    media = bytes(0 if val is None else val & 0xFF for val in (media_type, media_width, media_length))
+    return b'\x1B\x69\x7A' + bytes([valid_flags]) + media + struct.pack('<L', rnumber) + (b'\x00\x00' if first_page else b'\x01\x00')
+
+
+def mode_setting(autocut=False, peeler=False):
+    """ ESC i M: Various mode settings. """
+    return b'\x1B\x69\x4D' + bytes([peeler << 4 | autocut << 6])
+
+
+def cut_every(n=1):
+    """ ESC i A: Cut every n labels. """
+    return b'\x1B\x69\x41' + bytes([n & 0xFF])
+
+
+def expanded_mode(ptouch, cut_at_end=True, dpi_600=False, two_color=False, half_cut=True, no_chain_printing=True):
+    """ ESC i K: Expanded mode (the flags differ between P-touch and QL models). """
+    if ptouch:
+        flags = half_cut << 2 | no_chain_printing << 3 | dpi_600 << 5
+    else:
+        flags = two_color << 0 | cut_at_end << 3 | dpi_600 << 6
+    return b'\x1B\x69\x4B' + bytes([flags])
+
+
+def wait(sec=0):
+    """ ESC i w: Wait between pages (0.1 - 25.5 s as 1 - 255). """
+    return b'\x1B\x69\x77' + bytes([sec << 1])
+
+
+def margins(dots=0x23):
+    """ ESC i d: Feed margin in dots. """
+    return b'\x1B\x69\x64' + struct.pack('<H', dots)
+
+
+def compression(compress=True):
+    """ M: Compression of the raster lines. """
+    return b'\x4D' + bytes([compress << 1])
+
+
+def print_page(last_page=True):
+    """ The print command ending a page: 0x1A (print and feed) for the last page, 0x0C (form feed) otherwise. """
+    return b'\x1A' if last_page else b'\x0C'
+
+
+@attrs(frozen=True, slots=True)
+class PageSpec(object):
+    """
+    The settings of the pages of a job. Instances are immutable, use
+    :py:func:`attr.evolve` to derive a spec with other settings.
+    Commands the model doesn't support are left out.
+    """
+
+    #: The printer model, e.g. 'QL-820NWB'.
+    model = attrib(type=str)
+    #: The media type (:py:data:`MEDIA_DIE_CUT`, :py:data:`MEDIA_ENDLESS` or :py:data:`MEDIA_PTOUCH_ENDLESS`), None if not given.
+    media_type = attrib(default=None)
+    #: The width of the media in mm, None if not given.
+    media_width = attrib(default=None)
+    #: The length of the media in mm (0 for endless media), None if not given.
+    media_length = attrib(default=None)
+    #: Print with high quality.
+    quality = attrib(type=bool, default=True)
+    #: Cut after the last page.
+    cut = attrib(type=bool, default=True)
+    #: Peeler mode.
+    peeler = attrib(type=bool, default=False)
+    #: Cut at the end (QL models).
+    cut_at_end = attrib(type=bool, default=True)
+    #: Print with 600x300 dpi.
+    dpi_600 = attrib(type=bool, default=False)
+    #: Two color printing (black/red/white).
+    two_color = attrib(type=bool, default=False)
+    #: Half cut (P-touch models).
+    half_cut = attrib(type=bool, default=True)
+    #: No chain printing (P-touch models).
+    no_chain_printing = attrib(type=bool, default=True)
+    #: The feed margin in dots.
+    feed_margin = attrib(type=int, default=0x23)
+    #: Compress the raster lines (if the model supports it).
+    compress = attrib(type=bool, default=False)
+    #: Send blank raster lines as 'zero raster' instructions (if the model supports it).
+    zero_raster = attrib(type=bool, default=True)
+
+    @model.validator
+    def _check_model(self, attribute, value):
+        try:
+            get_registry().model(value)
+        except KeyError:
+            raise ValueError("Unknown model: %s" % value)
+
+    @property
+    def capabilities(self):
+        """ The :py:class:`brother_ql.models.Model` of the spec. """
+        return get_registry().model(self.model)
+
+    @property
+    def ptouch(self):
+        return self.model.startswith('PT')
+
+    @property
+    def pixel_width(self):
+        """ The width of the raster lines in pixels. """
+        return self.capabilities.number_bytes_per_row * 8
+
+
+def encode_raster(spec, bitmap, second_bitmap=None, row_cache=None):
+    """
+    Encode the raster lines of a page.
+
+    :param PageSpec spec: The settings of the job.
+    :param bitmap: The page as :py:class:`brother_ql.encoder.PackedBitmap` as wide as
+        the printer (:py:attr:`PageSpec.pixel_width`). A set bit is a printed dot.
+    :param second_bitmap: The red layer for two color printing.
+    :param row_cache: An optional :py:class:`brother_ql.encoder.RowCache` (thread-safe).
+    :returns: The raster data (:py:class:`brother_ql.cache.CachedPage`).
+    """
+    width, height = bitmap.size
+    if width != spec.pixel_width:
+        raise BrotherQLRasterError('Wrong pixel width: {}, expected {}'.format(width, spec.pixel_width))
+    row_len = width // 8
+    frames = [memoryview(bitmap.data).cast('B')]
+    if second_bitmap is not None:
+        if tuple(second_bitmap.size) != tuple(bitmap.size):
+            fmt = "First and second bitmap don't have the same dimensions: {} vs {}."
+            raise BrotherQLRasterError(fmt.format(tuple(bitmap.size), tuple(second_bitmap.size)))
+        frames.append(memoryview(second_bitmap.data).cast('B'))
+    if any(len(frame) != row_len * height for frame in frames):
+        raise BrotherQLRasterError('Wrong frame size: expected {} bytes'.format(row_len * height))
+    model = spec.capabilities
+    compress = spec.compress and model.compression_support
+    raster = encode_frames([mirror_frame(frame, row_len) for frame in frames], row_len, ptouch=spec.ptouch, compress=compress,
+                           zero_raster=spec.zero_raster and model.zero_raster, cache=row_cache)
+    return CachedPage(height, compress, raster)
+
+
+#: The number of header templates kept (see :py:func:`header_template`).
+HEADER_CACHE_SIZE = 256
+
+#: The position of the raster count in the print information command (ESC i z).
+_RNUMBER_OFFSET = 7
+
+
+def _header_parts(spec, height, compress, is_first, is_last):
+    model = spec.capabilities
+    before = []
+    if model.mode_setting:
+        before.append(switch_mode())
+    if is_first:
+        before.append(status_information())
+    parts = [media_and_quality(spec.media_type, spec.media_width, spec.media_length, spec.quality, height, is_first)]
+    if model.cutting:
+        parts.append(mode_setting(autocut=spec.cut and is_last, peeler=spec.peeler))
+        if spec.cut and is_last and not spec.ptouch:
+            parts.append(cut_every(1))
+    if model.expanded_mode and not (spec.two_color and not model.two_color):
+        parts.append(expanded_mode(spec.ptouch, spec.cut_at_end, spec.dpi_600, spec.two_color, spec.half_cut, spec.no_chain_printing))
+    parts.append(wait(0))
+    parts.append(margins(spec.feed_margin))
+    if model.compression_support:
+        parts.append(compression(compress))
+    return b''.join(before), b''.join(parts)
+
+
+@functools.lru_cache(maxsize=HEADER_CACHE_SIZE)
+def header_template(spec, compress, is_first=True, is_last=True):
+    """
+    The instructions of a page before its raster data, built once per spec,
+    compression and position of the page in the job.
+
+    :returns: A tuple (template, offset): the instructions (bytes) with a raster
+        count of 0 and the position of the raster count (`<L`) in them.
+    """
+    before, rest = _header_parts(spec, 0, bool(compress), is_first, is_last)
+    return before + rest, len(before) + _RNUMBER_OFFSET
+
+
+def page_header(spec, height, compress, is_first=True, is_last=True):
+    """
+    :returns: The instructions of a page before its raster data (bytes).
+    """
+    template, offset = header_template(spec, bool(compress), is_first, is_last)
+    header = bytearray(template)
+    struct.pack_into('<L', header, offset, height)
+    return bytes(header)
+
+
+def assemble_page(spec, page, is_first=True, is_last=True):
+    """
+    :param PageSpec spec: The settings of the job.
+    :param page: The raster data of the page (:py:class:`brother_ql.cache.CachedPage`).
+    :returns: The instructions of the page (bytes).
+    """
+    return b''.join((page_header(spec, page.height, page.compress, is_first, is_last), page.raster, print_page(is_last)))
+
+
+def encode_page(spec, bitmap, second_bitmap=None, is_first=True, is_last=True, row_cache=None):
+    """
+    Create the instructions of a page. The function doesn't keep any state
+    and can be called by several threads at once with the same spec.
+
+    :param PageSpec spec: The settings of the job.
+    :param bitmap: The page, see :py:func:`encode_raster`.
+    :param second_bitmap: The red layer for two color printing.
+    :param bool is_first: Whether the page is the first one of the job (after the initialization).
+    :param bool is_last: Whether the page is the last one of the job.
+    :param row_cache: An optional :py:class:`brother_ql.encoder.RowCache`.
+    :returns: The instructions of the page (bytes).
+    """
+    return assemble_page(spec, encode_raster(spec, bitmap, second_bitmap, row_cache), is_first, is_last)
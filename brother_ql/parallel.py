@@ -0,0 +1,188 @@
+"""
+Parallel rasterization of multi-page jobs with a process pool.
+
+The pages of a job are independent of each other up to the few
+instructions depending on their position in the job (first/last page,
+page counter). The worker processes therefore only create the raster
+data of the pages (see :py:func:`brother_ql.conversion.prepare_page`),
+the instructions around it are added in order by the calling process
+when the job is assembled.
+
+Images given as PIL images, file handles or packed bitmaps and the resulting raster data
+are passed between the processes in shared memory blocks instead of
+being pickled. Images given as filenames are opened by the workers.
+"""
+
+import io
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from brother_ql.cache import CachedPage
+from brother_ql.encoder import PackedBitmap
+
+logger = logging.getLogger(__name__)
+
+#: The number of pages submitted to the pool ahead of the page being assembled, per worker.
+PAGES_IN_FLIGHT_PER_WORKER = 2
+
+
+def _share(data):
+    """
+    Copy `data` into a new shared memory block.
+
+    :returns: A tuple (block, size). The caller owns the block.
+    """
+    size = len(data)
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    block.buf[:size] = data
+    return block, size
+
+
+def _read(name, size, unlink=False):
+    """
+    :returns: The first `size` bytes of the shared memory block `name`.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+def _release(block):
+    block.close()
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _pack_image(image):
+    """
+    :returns: A tuple (transport, block) with a picklable description of `image`
+        and the shared memory block holding its data (None for filenames).
+    """
+    if isinstance(image, Image.Image):
+        palette = None
+        if image.mode in ('P', 'PA'):
+            palette = (image.palette.mode, image.getpalette(image.palette.mode))
+        block, size = _share(image.tobytes())
+        return ('pixels', image.mode, image.size, palette, block.name, size), block
+    if isinstance(image, PackedBitmap):
+        block, size = _share(memoryview(image.data).cast('B'))
+        return ('packed', tuple(image.size), block.name, size), block
+    if hasattr(image, 'read'):
+        block, size = _share(image.read())
+        return ('file', block.name, size), block
+    return ('path', image), None
+
+
+def _unpack_image(transport):
+    kind = transport[0]
+    if kind == 'path':
+        return transport[1]
+    if kind == 'file':
+        return io.BytesIO(_read(*transport[1:]))
+    if kind == 'packed':
+        return PackedBitmap(_read(*transport[2:]), transport[1])
+    mode, size, palette, name, length = transport[1:]
+    image = Image.frombytes(mode, size, _read(name, length))
+    if palette is not None:
+        image.putpalette(palette[1], palette[0])
+    return image
+
+
+def _rasterize(task):
+    """
+    The worker: create the raster data of one page.
+
+    :returns: A tuple (height, compress, name, size, estimate) with the name
+        and size of the shared memory block holding the raster data, which is
+        to be unlinked by the caller.
+    """
+    from brother_ql.conversion import prepare_page
+    from brother_ql.devicedependent import label_type_specs
+    from brother_ql.encoder import shared_row_cache
+    from brother_ql.raster import BrotherQLRaster
+    settings, transport = task
+    qlr = BrotherQLRaster(settings['model'])
+    qlr.zero_raster_enabled = settings['zero_raster_enabled']
+    if settings['row_cache']:
+        qlr.row_cache = shared_row_cache()
+    image = _unpack_image(transport)
+    page, estimate = prepare_page(qlr, image, label_type_specs[settings['label']], settings['options'], settings['compress'], settings['throughput'])
+    block, size = _share(page.raster)
+    block.close()
+    return page.height, page.compress, block.name, size, estimate
+
+
+def _collect(future):
+    height, compress, name, size, estimate = future.result()
+    return CachedPage(height, compress, _read(name, size, unlink=True)), estimate
+
+
+def _discard(future):
+    """ Free the raster data of a page which won't be used. """
+    if future.cancelled() or future.exception() is not None:
+        return
+    name = future.result()[2]
+    try:
+        _release(shared_memory.SharedMemory(name=name))
+    except FileNotFoundError:
+        pass
+
+
+def rasterize_pages(entries, workers, qlr, label, options, compress, throughput=None):
+    """
+    Create the raster data of pages in a pool of worker processes.
+
+    :param entries: An iterable of (image, key, cached) tuples as created by
+        :py:func:`brother_ql.conversion._lookup_pages`. Only entries with an image
+        and without a cached page are rasterized.
+    :param int workers: The number of worker processes.
+    :param BrotherQLRaster qlr: The raster instance of the job, its model and settings are used by the workers.
+    :returns: A generator of (image, key, cached, result) tuples in the order of `entries`,
+        `result` being a tuple (:py:class:`brother_ql.cache.CachedPage`, estimate) for
+        the rasterized pages and None for the other ones.
+    """
+    settings = dict(model=qlr.model, zero_raster_enabled=qlr.zero_raster_enabled, row_cache=qlr.row_cache is not None,
+                    label=label, options=options, compress=compress, throughput=throughput)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for image, key, cached in entries:
+                future = block = None
+                if image is not None and cached is None:
+                    transport, block = _pack_image(image)
+                    future = executor.submit(_rasterize, (settings, transport))
+                pending.append((image, key, cached, future, block))
+                while len(pending) > workers * PAGES_IN_FLIGHT_PER_WORKER or (pending and pending[0][3] is None):
+                    yield _next(pending)
+            while pending:
+                yield _next(pending)
+        finally:
+            for _, _, _, future, _ in pending:
+                if future is not None:
+                    future.cancel()
+            executor.shutdown(wait=True)
+            for _, _, _, future, block in pending:
+                if future is not None:
+                    _discard(future)
+                if block is not None:
+                    _release(block)
+
+
+def _next(pending):
+    image, key, cached, future, block = pending.popleft()
+    try:
+        result = _collect(future) if future is not None else None
+    finally:
+        if block is not None:
+            _release(block)
+    return image, key, cached, result
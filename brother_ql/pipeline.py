@@ -0,0 +1,311 @@
+"""
+A staged print pipeline overlapping the reading and decoding of images,
+their rasterization and the transmission to the printer.
+
+Every stage runs in its own thread(s) and the stages are connected by
+bounded queues::
+
+    reader -> [decode queue] -> decoders -> [raster queue] -> rasterizers -> transmitter
+
+* The *reader* takes the images from the input iterable (expanding copies
+  and looking pages up in the page cache).
+* The *decoders* open and decode the images (file I/O and image decoding
+  release the GIL in PIL).
+* The *rasterizers* preprocess the images and create the raster data
+  of the pages (see :py:func:`brother_ql.conversion.prepare_page`).
+* The *transmitter* is the thread consuming :py:meth:`PrintPipeline.run`,
+  e.g. :py:func:`brother_ql.backends.helpers.send` in :py:meth:`PrintPipeline.print`.
+  It adds the instructions depending on the position of a page in the job
+  and sends the pages in order.
+
+While page N is on the wire or being printed, the following pages are
+prepared. The number of pages in the pipeline is limited, so the memory
+used doesn't grow with the size of the job. Per-stage statistics are
+available with :py:meth:`PrintPipeline.stats`.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+from brother_ql import conversion
+from brother_ql.encoder import PackedBitmap
+from brother_ql.raster import BrotherQLRaster
+
+logger = logging.getLogger(__name__)
+
+#: Statistics of a stage: the number of items processed, the time spent working on them
+#: (summed over the threads of the stage), the time spent waiting for input and the
+#: current and maximum number of items queued for the stage.
+StageStats = namedtuple('StageStats', ['items', 'busy_seconds', 'wait_seconds', 'queue_depth', 'max_queue_depth'])
+
+STAGES = ('read', 'decode', 'rasterize', 'transmit')
+
+_DONE = object()
+_REPEAT = object()
+
+
+class _Stage(object):
+
+    def __init__(self, name, maxsize=0):
+        self.name = name
+        self.queue = queue.Queue(maxsize) if maxsize else None
+        self.items = 0
+        self.busy = 0.0
+        self.wait = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def account(self, busy=0.0, wait=0.0, items=1):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.wait += wait
+
+    def put(self, item, stopped):
+        while not stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            with self._lock:
+                self.max_depth = max(self.max_depth, self.queue.qsize())
+            return True
+        return False
+
+    def get(self, stopped):
+        start = time.perf_counter()
+        while not stopped.is_set():
+            try:
+                item = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self.account(wait=time.perf_counter() - start, items=0)
+            return item
+        return _DONE
+
+    def stats(self):
+        depth = self.queue.qsize() if self.queue is not None else 0
+        return StageStats(self.items, self.busy, self.wait, depth, self.max_depth)
+
+
+class PrintPipeline(object):
+    """
+    Convert images and send them to a printer in overlapping stages.
+
+    :param BrotherQLRaster qlr: The raster instance of the job.
+    :param str label: The label identifier.
+    :param int decoders: The number of decoding threads.
+    :param int rasterizers: The number of rasterization threads.
+    :param int queue_size: The capacity of the queues between the stages.
+    :param int max_pages_in_flight: The maximum number of pages read but not yet transmitted.
+    :param kwargs: The conversion options of :py:func:`brother_ql.conversion.convert`
+        (except `workers`, the pipeline uses threads).
+    """
+
+    def __init__(self, qlr, label, decoders=2, rasterizers=2, queue_size=4, max_pages_in_flight=None, **kwargs):
+        self.qlr = qlr
+        self.label = label
+        self.decoders = max(1, decoders)
+        self.rasterizers = max(1, rasterizers)
+        self.queue_size = max(1, queue_size)
+        if max_pages_in_flight is None:
+            max_pages_in_flight = 2 * self.queue_size + self.decoders + self.rasterizers
+        self.max_pages_in_flight = max(2, max_pages_in_flight)
+        self.copies = kwargs.pop('copies', 1)
+        kwargs.pop('workers', None)
+        self.options = kwargs
+        self._stages = {name: _Stage(name) for name in STAGES}
+
+    def stats(self):
+        """
+        :returns: A dict mapping the stage names (:py:data:`STAGES`) to :py:class:`StageStats`.
+            Can be called from any thread while the pipeline is running.
+        """
+        return {name: stage.stats() for name, stage in self._stages.items()}
+
+    def _rasterizer_qlr(self):
+        qlr = BrotherQLRaster(self.qlr.model)
+        qlr.zero_raster_enabled = self.qlr.zero_raster_enabled
+        qlr.row_cache = self.qlr.row_cache
+        qlr.exception_on_warning = self.qlr.exception_on_warning
+        return qlr
+
+    def run(self, images, preamble=True):
+        """
+        Start the pipeline for `images` (any iterable).
+
+        :returns: A generator of the instructions (bytes), the preamble first (unless
+            `preamble` is False) and then one page at a time, to be consumed by the transmitter.
+        """
+        qlr = self.qlr
+        job = conversion._job_settings(qlr, self.label, **self.options)
+        qlr.add_invalidate()
+        qlr.add_initialize()
+        setup_data = qlr.data
+        qlr.clear()
+        qlr.compression_decisions = []
+
+        self._stages = stages = {
+            'read': _Stage('read'),
+            'decode': _Stage('decode', self.queue_size),
+            'rasterize': _Stage('rasterize', self.queue_size),
+            'transmit': _Stage('transmit'),
+        }
+        stopped = threading.Event()
+        slots = threading.Semaphore(self.max_pages_in_flight)
+        results = {}
+        state = dict(read=0, done=False, error=None, decoders=self.decoders)
+        ready = threading.Condition()
+
+        def publish(index, result):
+            with ready:
+                results[index] = result
+                ready.notify_all()
+
+        def fail(error):
+            with ready:
+                if state['error'] is None:
+                    state['error'] = error
+                ready.notify_all()
+            stopped.set()
+
+        def read():
+            try:
+                entries = conversion._lookup_pages(conversion._expand_copies(images, self.copies), job['page_cache'], job['key_options'])
+                index = 0
+                while True:
+                    while not slots.acquire(timeout=0.1):
+                        if stopped.is_set():
+                            return
+                    start = time.perf_counter()
+                    try:
+                        image, key, cached = next(entries)
+                    except StopIteration:
+                        slots.release()
+                        break
+                    stages['read'].account(busy=time.perf_counter() - start)
+                    with ready:
+                        state['read'] = index + 1
+                        ready.notify_all()
+                    if image is None:
+                        publish(index, _REPEAT)
+                    elif cached is not None:
+                        publish(index, (cached, None))
+                    elif not stages['decode'].put((index, image, key), stopped):
+                        return
+                    index += 1
+            except BaseException as e:
+                fail(e)
+            finally:
+                with ready:
+                    state['done'] = True
+                    ready.notify_all()
+                for _ in range(self.decoders):
+                    stages['decode'].put(_DONE, stopped)
+
+        def decode():
+            try:
+                while True:
+                    item = stages['decode'].get(stopped)
+                    if item is _DONE:
+                        break
+                    index, image, key = item
+                    start = time.perf_counter()
+                    if not isinstance(image, (Image.Image, PackedBitmap)):
+                        try:
+                            image = Image.open(image)
+                        except OSError:
+                            raise NotImplementedError("The image argument needs to be an Image() instance, the filename to an image, or a file handle.")
+                        conversion.draft_image(image, job['label_specs'], job['options'])
+                    if isinstance(image, Image.Image):
+                        image.load()
+                    stages['decode'].account(busy=time.perf_counter() - start)
+                    if not stages['rasterize'].put((index, image, key), stopped):
+                        break
+            except BaseException as e:
+                fail(e)
+            finally:
+                # The last decoder closes the raster queue
+                with ready:
+                    state['decoders'] -= 1
+                    last_decoder = state['decoders'] == 0
+                if last_decoder:
+                    for _ in range(self.rasterizers):
+                        stages['rasterize'].put(_DONE, stopped)
+
+        def rasterize():
+            try:
+                raster_qlr = self._rasterizer_qlr()
+                while True:
+                    item = stages['rasterize'].get(stopped)
+                    if item is _DONE:
+                        break
+                    index, image, key = item
+                    start = time.perf_counter()
+                    page, estimate = conversion.prepare_page(raster_qlr, image, job['label_specs'], job['options'], job['compress'], job['throughput'])
+                    if job['page_cache'] is not None:
+                        job['page_cache'].put(key, page)
+                    stages['rasterize'].account(busy=time.perf_counter() - start)
+                    publish(index, (page, estimate))
+            except BaseException as e:
+                fail(e)
+
+        threads = [threading.Thread(target=read, name='brother_ql-read', daemon=True)]
+        threads += [threading.Thread(target=decode, name='brother_ql-decode-%d' % i, daemon=True) for i in range(self.decoders)]
+        threads += [threading.Thread(target=rasterize, name='brother_ql-rasterize-%d' % i, daemon=True) for i in range(self.rasterizers)]
+        return self._transmit(threads, setup_data if preamble else None, job, results, state, ready, slots, stopped)
+
+    def _transmit(self, threads, setup_data, job, results, state, ready, slots, stopped):
+        stage = self._stages['transmit']
+        for thread in threads:
+            thread.start()
+        try:
+            if setup_data is not None:
+                yield setup_data
+            index = 0
+            last = None
+            while True:
+                start = time.perf_counter()
+                with ready:
+                    # A page can be assembled once it is ready and it is known whether another page follows
+                    while state['error'] is None and not (index in results and (state['done'] or state['read'] > index + 1)):
+                        if state['done'] and state['read'] <= index:
+                            break
+                        ready.wait(0.1)
+                    if state['error'] is not None:
+                        raise state['error']
+                    if index not in results:
+                        break
+                    result = results.pop(index)
+                    is_last = state['done'] and state['read'] == index + 1
+                stage.account(wait=time.perf_counter() - start, items=0)
+                if result is _REPEAT:
+                    result = last
+                last = result
+                page, estimate = result
+                start = time.perf_counter()
+                data = conversion._assemble_page(self.qlr, job, page, estimate, index == 0, is_last)
+                slots.release()
+                yield data
+                stage.account(busy=time.perf_counter() - start)
+                index += 1
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join()
+
+    def print(self, images, printer_identifier=None, backend_identifier=None, blocking=True):
+        """
+        Run the pipeline and send the instructions to a printer with
+        :py:func:`brother_ql.backends.helpers.send`.
+
+        :returns: The status dict of :py:func:`brother_ql.backends.helpers.send`.
+        """
+        from brother_ql.backends.helpers import send
+        return send(self.run(images), printer_identifier=printer_identifier, backend_identifier=backend_identifier, blocking=blocking)
+
@@ -14,6 +14,8 @@ logger = logging.getLogger(__name__)
 class BrotherPrintQueue:
     def __init__(self, printer: BrotherQLBackendGeneric, rasterizer: BrotherQLRaster):
         self._print_queue = deque()
+        # Iterators of pages which are created while submitting, see queue_pages()
+        self._page_sources = deque()
         self._qlr = rasterizer
         self._printer = printer
         self._printing = False
@@ -25,6 +27,7 @@ class BrotherPrintQueue:
 
     def clear(self):
         self._print_queue.clear()
+        self._page_sources.clear()
 
     def initialize(self):
         self._qlr.clear()
@@ -32,11 +35,11 @@ class BrotherPrintQueue:
         # Standard init sequence
         # Invalidate -> Initialize -> Status Request
         self._qlr.add_invalidate()
-        self._printer.write(self._qlr.data)
+        self._printer.write_chunks(self._qlr.iter_chunks())
         self._qlr.clear()
 
         self._qlr.add_initialize()
-        self._printer.write(self._qlr.data)
+        self._printer.write_chunks(self._qlr.iter_chunks())
         self._qlr.clear()
 
         ready = self._validate_status(phase=0, request=True, timeout=2)
@@ -48,8 +51,9 @@ class BrotherPrintQueue:
     def queue_image(self, **kwargs):
         if self._printing:
             raise RuntimeError("Can't queue images while printing")
-        # BrotherQLRaster page number starts from 0
-        self._qlr.page_number = len(self._print_queue) - 1
+        if kwargs.get('compress') == 'auto':
+            # The printer connection knows its (measured) throughput best
+            kwargs['backend'] = self._printer
         page_data = queue_convert(qlr=self._qlr, **kwargs)
         for p in page_data:
             self._print_queue.append(p)
@@ -59,6 +63,29 @@ class BrotherPrintQueue:
             )
         self.page_count = len(self._print_queue)
 
+    def queue_pages(self, pages):
+        """
+        Queue the pages of an iterable, e.g. ``iter_convert(qlr, images, label, preamble=False)``.
+        The pages are only created while submitting, one ahead of the page being printed,
+        so they don't have to be kept in memory all at once. They aren't included
+        in :py:attr:`page_count` before they are created.
+        """
+        if self._printing:
+            raise RuntimeError("Can't queue pages while printing")
+        self._page_sources.append(iter(pages))
+
+    def _pull_page(self):
+        """
+        Make sure the next page is in the queue if there is one.
+        """
+        while not self._print_queue and self._page_sources:
+            try:
+                self._print_queue.append(next(self._page_sources[0]))
+            except StopIteration:
+                self._page_sources.popleft()
+        self.page_count = len(self._print_queue)
+        return len(self._print_queue) > 0
+
     def submit(self, clear_on_failure: bool = False):
         if not self.ready:
             logger.debug("Printing has failed previously, initializing printer")
@@ -66,9 +93,11 @@ class BrotherPrintQueue:
         self._printing = True
         count = 0
         qsize = len(self._print_queue)
+        if self._page_sources:
+            qsize = f"{qsize}+"
         logger.info(f"Submitting print queue with {qsize} pages")
         completed = False
-        while len(self._print_queue) > 0:
+        while self._pull_page():
             logger.info(f"Submitting page {count+1} of {qsize}")
             printed = self._submit_page()
             count += 1
@@ -79,11 +108,11 @@ class BrotherPrintQueue:
         logger.debug("Queue processing complete")
         remaining_pages = len(self._print_queue)
 
-        if remaining_pages != 0:
+        if remaining_pages != 0 or self._page_sources:
             logger.debug(f"There are {remaining_pages} pages remaining in the queue")
             if clear_on_failure:
                 logger.debug(f"Clearing queue with failed {remaining_pages} pages")
-                self._print_queue.clear()
+                self.clear()
         else:
             completed = True
         self.ready = self._validate_status(phase=0, request=True, timeout=2)
@@ -101,10 +130,12 @@ class BrotherPrintQueue:
         completed = False
 
         while not completed:
-            logger.debug(
-                f"Command data: {' '.join(map(lambda byte: f'{byte:02X}', page_data))}"
-            )
-            self._printer.write(page_data)
+            if logger.isEnabledFor(logging.DEBUG):
+                # Formatting the whole page is expensive, only do it when it's logged
+                logger.debug(
+                    f"Command data: {' '.join(map(lambda byte: f'{byte:02X}', page_data))}"
+                )
+            self._printer.write_chunks((page_data, ))
 
             sts_started = False
             sts_printed = False
@@ -150,7 +181,7 @@ class BrotherPrintQueue:
             logger.debug("Requesting status")
             self._qlr.clear()
             self._qlr.add_status_information()
-            self._printer.write(self._qlr.data)
+            self._printer.write_chunks(self._qlr.iter_chunks())
             self._qlr.clear()
 
         logger.debug("Waiting for response")
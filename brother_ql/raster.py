@@ -7,14 +7,11 @@ The central piece of code in this module is the class
 :py:class:`BrotherQLRaster`.
 """
 
-import struct
 import logging
 
-import packbits
-from PIL import Image
-import io
-
-from brother_ql.models import ModelsManager
+from brother_ql.registry import get_registry
+from brother_ql.encoder import image_to_frame, mirror_frame, encode_frames
+from brother_ql import page
 from .devicedependent import models, \
                              min_max_feed, \
                              min_max_length_dots, \
@@ -26,24 +23,88 @@ from .devicedependent import models, \
                              modesetting
 
 from . import BrotherQLError, BrotherQLUnsupportedCmd, BrotherQLUnknownModel, BrotherQLRasterError
-from io import BytesIO
 
 logger = logging.getLogger(__name__)
 
+class CommandBuffer(object):
+    """
+    An append-only buffer for raster instructions.
+
+    Instructions are collected as a list of chunks, so adding an instruction
+    doesn't copy what has been collected before. The chunks can be handed
+    to a backend one after the other with :py:meth:`iter_chunks` or joined
+    once with :py:meth:`getvalue` / :py:meth:`getbuffer`.
+    """
+
+    def __init__(self, data=b''):
+        self._chunks = []
+        self._length = 0
+        if data:
+            self.write(data)
+
+    def write(self, data):
+        """
+        Append `data` (any bytes-like object) to the buffer.
+        Mutable objects like a bytearray are copied.
+        """
+        if type(data) is not bytes:
+            data = bytes(data)
+        if data:
+            self._chunks.append(data)
+            self._length += len(data)
+
+    def getvalue(self):
+        """
+        :returns: The whole content of the buffer as a single bytes object.
+        """
+        if len(self._chunks) > 1:
+            self._chunks = [b''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else b''
+
+    def getbuffer(self):
+        """
+        :returns: A read-only memoryview on the content of the buffer.
+        """
+        return memoryview(self.getvalue())
+
+    def iter_chunks(self):
+        """
+        Iterate over the chunks in the buffer without joining them.
+        """
+        return iter(list(self._chunks))
+
+    def clear(self):
+        self._chunks = []
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
 class BrotherQLRaster(object):
 
     """
     This class facilitates the creation of a complete set
     of raster instructions by adding them one after the other
     using the methods of the class. Each method call is adding
-    instructions to the member variable :py:attr:`data`.
+    instructions to the member variable :py:attr:`buffer`.
+    The instructions are built by the functions of :py:mod:`brother_ql.page`.
+    An instance collects the instructions of one job and isn't meant to be
+    shared between threads: to encode pages concurrently, use
+    :py:func:`brother_ql.page.encode_page` with a :py:class:`brother_ql.page.PageSpec`
+    (see :py:meth:`page_spec`).
 
     Instatiate the class by providing the printer
     model as argument.
 
     :param str model: Choose from the list of available models.
 
-    :ivar bytes data: The resulting bytecode with all instructions.
+    :ivar CommandBuffer buffer: The buffer collecting the resulting bytecode.
+    :ivar bool zero_raster_enabled: Send blank raster lines as 'zero raster' instructions on models supporting it (:py:attr:`zero_raster_support`). Defaults to True.
+    :ivar RowCache row_cache: An optional :py:class:`brother_ql.encoder.RowCache` for compressed raster rows, e.g. shared between several instances.
+    :ivar list compression_decisions: Filled by :py:func:`brother_ql.conversion.convert` with one dict per page: whether compression was used (`compress`), the `estimated_ratio` for compress='auto' and the `achieved_ratio` of the raster data relative to uncompressed rows.
     :ivar bool exception_on_warning: If set to True, an exception is raised if trying to add instruction which are not supported on the selected model. If set to False, the instruction is simply ignored and a warning sent to logging/stderr.
     """
 
@@ -51,24 +112,27 @@ class BrotherQLRaster(object):
         if model not in models:
             raise BrotherQLUnknownModel()
         self.model = model
-        self.data = b''
+        self.buffer = CommandBuffer()
         self._pquality = True
+        self._mtype = self._mwidth = self._mlength = None
         self.page_number = 0
         self.cut_at_end = True
         self.dpi_600 = False
         self.two_color_printing = False
         self.compression_enabled = False
         self.compression_support = False
+        self.zero_raster_support = False
+        self.zero_raster_enabled = True
+        self.row_cache = None
+        self.compression_decisions = []
         self.exception_on_warning = False
         self.half_cut = True
         self.no_chain_printing = True
 
-        self.num_invalidate_bytes = 200
-        for m in ModelsManager().iter_elements():
-            if self.model == m.identifier:
-                self.num_invalidate_bytes = m.num_invalidate_bytes
-                self.compression_support = m.compression_support
-                break
+        m = get_registry().model(self.model)
+        self.num_invalidate_bytes = m.num_invalidate_bytes
+        self.compression_support = m.compression_support
+        self.zero_raster_support = m.zero_raster
 
     def _warn(self, problem, kind=BrotherQLRasterError):
         """
@@ -94,17 +158,50 @@ class BrotherQLRaster(object):
         """
         self._warn(problem, kind=BrotherQLUnsupportedCmd)
 
+    @property
+    def data(self):
+        """
+        The resulting bytecode with all instructions (bytes).
+        Joined from :py:attr:`buffer` on access.
+        """
+        return self.buffer.getvalue()
+
+    @data.setter
+    def data(self, value):
+        self.buffer.clear()
+        self.buffer.write(value)
+
+    def getbuffer(self):
+        """ :returns: A memoryview on the resulting bytecode. """
+        return self.buffer.getbuffer()
+
+    def iter_chunks(self):
+        """ Iterate over the resulting bytecode in chunks without joining them. """
+        return self.buffer.iter_chunks()
+
     @property
     def two_color_support(self):
         return self.model in two_color_support
 
+    def page_spec(self, **settings):
+        """
+        :param settings: The settings of the pages, see :py:class:`brother_ql.page.PageSpec`.
+        :returns: An immutable :py:class:`brother_ql.page.PageSpec` for the model, using the
+            settings of this instance (:py:attr:`zero_raster_enabled`, :py:attr:`half_cut`,
+            :py:attr:`no_chain_printing`) unless given.
+        """
+        settings.setdefault('zero_raster', self.zero_raster_enabled)
+        settings.setdefault('half_cut', self.half_cut)
+        settings.setdefault('no_chain_printing', self.no_chain_printing)
+        return page.PageSpec(self.model, **settings)
+
     def add_initialize(self):
         self.page_number = 0
-        self.data += b'\x1B\x40' # ESC @
+        self.buffer.write(b'\x1B\x40') # ESC @
 
     def add_status_information(self):
         """ Status Information Request """
-        self.data += b'\x1B\x69\x53' # ESC i S
+        self.buffer.write(page.status_information()) # ESC i S
 
     def add_switch_mode(self):
         """
@@ -115,11 +212,11 @@ class BrotherQLRaster(object):
         if self.model not in modesetting:
             self._unsupported("Trying to switch the operating mode on a printer that doesn't support the command.")
             return
-        self.data += b'\x1B\x69\x61\x01' # ESC i a
+        self.buffer.write(page.switch_mode()) # ESC i a
 
     def add_invalidate(self):
         """ clear command buffer """
-        self.data += b'\x00' * self.num_invalidate_bytes
+        self.buffer.write(b'\x00' * self.num_invalidate_bytes)
 
     @property
     def mtype(self): return self._mtype
@@ -153,39 +250,18 @@ class BrotherQLRaster(object):
       # self.data += b'\x1B\x69\x55\x77\x01\x3F\x0D\x6C\xB2\x00\x6C\x00\x00\x3F\x03\x5F\x05\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x79\x61\x6D\x61\x74\x6F\x20\x32\x33\x30\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x8F\x05\x00\x00\x18\x00\x18\x00\x18\x00\x02\x18\x00\x00\x00\x00'
       # self.data += b'\x1B\x69\x55\x77\x01\x3F\x0D\x3C\x64\x00\x3C\xBC\x00\xC8\x01\xEF\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00\x02\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x52\x44\x20\x36\x30\x6D\x6D\x20\x78\x20\x31\x30\x30\x6D\x6D\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x4F\x03\x00\x00\x18\x00\x00\x00\x00\x00\x01\x18\x00\x00\x00\x00'
       # self.data += b'\x1B\x69\x55\x77\x01\x3F\x0A\x3E\x64\x00\x3E\x23\x01\xB8\x02\x56\x04\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x36\x32\x6D\x20\x78\x20\x31\x30\x30\x6D\x6D\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xE7\x04\x00\x00\x23\x00\x00\x00\x00\x00\x01\x23\x00\x00\x00\x00'
-      self.data += b''
+      self.buffer.write(b'')
     def add_media_and_quality(self, rnumber):
-        self.data += b'\x1B\x69\x7A' # ESC i z
-        valid_flags = 0x80
-        valid_flags |= (self._mtype is not None) << 1
-        valid_flags |= (self._mwidth is not None) << 2
-        valid_flags |= (self._mlength is not None) << 3
-        valid_flags |= self._pquality << 6
-        self.data += bytes([valid_flags])
-        vals = [self._mtype, self._mwidth, self._mlength]
-        self.data += b''.join(b'\x00' if val is None else val for val in vals)
-        self.data += struct.pack('<L', rnumber)
-        # self.data += bytes([0 if self.page_number == 0 else 1])
-        if self.page_number == 0:
-            n9 = 0
-            self.page_number = 1
-        else:
-            n9 = 1
-        self.data += bytes([n9])
-        self.data += b'\x00'
+        media = [None if val is None else val[0] for val in (self._mtype, self._mwidth, self._mlength)]
+        self.buffer.write(page.media_and_quality(*media, self._pquality, rnumber, self.page_number == 0)) # ESC i z
+        self.page_number = 1
         # INFO:  media/quality (1B 69 7A) --> found! (payload: 8E 0A 3E 00 D2 00 00 00 00 00)
 
     def add_mode_setting(self, autocut=False, peeler=False):
         if self.model not in cuttingsupport:
             self._unsupported("Trying to call add_mode_setting(autocut, peeler) with a printer that doesn't support it")
             return
-        self.data += b'\x1B\x69\x4D' # ESC i M
-        flags = 0
-        if peeler:
-            flags |= 0x10  # Bit4: ピーラー
-        if autocut:
-            flags |= 0x40  # Bit6: オートカット
-        self.data += bytes([flags])
+        self.buffer.write(page.mode_setting(bool(autocut), bool(peeler))) # ESC i M
 
     def add_cut_every(self, n=1):
         if self.model not in cuttingsupport:
@@ -193,8 +269,7 @@ class BrotherQLRaster(object):
             return
         if self.model.startswith('PT'):
             return
-        self.data += b'\x1B\x69\x41' # ESC i A
-        self.data += bytes([n & 0xFF])
+        self.buffer.write(page.cut_every(n)) # ESC i A
 
     def add_expanded_mode(self):
         if self.model not in expandedmode:
@@ -203,25 +278,14 @@ class BrotherQLRaster(object):
         if self.two_color_printing and not self.two_color_support:
             self._unsupported("Trying to set two_color_printing in expanded mode on a printer that doesn't support it.")
             return
-        self.data += b'\x1B\x69\x4B' # ESC i K
-        flags = 0x00
-        if self.model.startswith('PT'):
-            flags |= self.half_cut << 2
-            flags |= self.no_chain_printing << 3
-            flags |= self.dpi_600 << 5
-        else:
-            flags |= self.cut_at_end << 3
-            flags |= self.dpi_600 << 6
-            flags |= self.two_color_printing << 0
-        self.data += bytes([flags])
+        self.buffer.write(page.expanded_mode(self.model.startswith('PT'), self.cut_at_end, self.dpi_600, self.two_color_printing,
+                                             self.half_cut, self.no_chain_printing)) # ESC i K
 
     def add_wait(self, sec=0x00): # 0.1 -25.5sec を1 - 255で表記
-        self.data += b'\x1B\x69\x77' # ESC i ｗ
-        self.data += bytes([sec << 1])
+        self.buffer.write(page.wait(sec)) # ESC i ｗ
 
     def add_margins(self, dots=0x23):
-        self.data += b'\x1B\x69\x64' # ESC i d
-        self.data += struct.pack('<H', dots)
+        self.buffer.write(page.margins(dots)) # ESC i d
 
     def add_compression(self, compression=True):
         """
@@ -236,8 +300,7 @@ class BrotherQLRaster(object):
             self._unsupported("Trying to set compression on a printer that doesn't support it")
             return
         self.compression_enabled = compression
-        self.data += b'\x4D' # M
-        self.data += bytes([compression << 1])
+        self.buffer.write(page.compression(compression)) # M
 
     def get_pixel_width(self):
         try:
@@ -255,6 +318,17 @@ class BrotherQLRaster(object):
         :param PIL.Image.Image image: The image to be converted and added to the raster instructions
         :param PIL.Image.Image second_image: A second image with a separate color layer (red layer for the QL-800 series)
         """
+        self.buffer.write(self.encode_raster_data(image, second_image))
+
+    def encode_raster_data(self, image, second_image=None, compress=None):
+        """
+        Create the raster line instructions for the image data without adding them
+        to the instructions, see :py:meth:`add_raster_data`.
+
+        :param bool compress: Whether to compress the lines. Defaults to the setting
+            made with :py:meth:`add_compression`.
+        :returns: The raster instructions (bytes).
+        """
         logger.debug("raster_image_size: {0}x{1}".format(*image.size))
         if image.size[0] != self.get_pixel_width():
             fmt = 'Wrong pixel width: {}, expected {}'
@@ -265,39 +339,42 @@ class BrotherQLRaster(object):
                 fmt = "First and second image don't have the same dimesions: {} vs {}."
                 raise BrotherQLRasterError(fmt.format(image.size, second_image.size))
             images.append(second_image)
-        frames = []
-        for image in images:
-            image = image.transpose(Image.FLIP_LEFT_RIGHT)
-            image = image.convert("1")
-            frames.append(bytes(image.tobytes(encoder_name='raw')))
-        frame_len = len(frames[0])
-        row_len = images[0].size[0]//8
-        start = 0
-        file_str = BytesIO()
-        while start + row_len <= frame_len:
-            for i, frame in enumerate(frames):
-                row = frame[start:start+row_len]
-                if self.compression_enabled:
-                    row = packbits.encode(row)
-                translen = len(row) # number of bytes to be transmitted
-                if self.model.startswith('PT'):
-                    file_str.write(b'\x47')
-                    file_str.write(bytes([translen%256, translen//256]))
-                else:
-                    if second_image:
-                        file_str.write(b'\x77\x01' if i == 0 else b'\x77\x02')
-                    else:
-                        file_str.write(b'\x67\x00')
-                    file_str.write(bytes([translen]))
-                file_str.write(row)
-            start += row_len
-        self.data += file_str.getvalue()
+        return self.encode_packed_data(*[image_to_frame(image) for image in images], compress=compress)
+
+    def encode_packed_data(self, frame, second_frame=None, compress=None):
+        """
+        Create the raster line instructions for image data given as packed bits,
+        see :py:meth:`encode_raster_data`. No image is created in between.
+
+        :param frame: The rows of the image (any bytes-like object, e.g. a :py:class:`memoryview`),
+            each as wide as the printer (:py:meth:`get_pixel_width`), eight pixels per byte,
+            most significant bit first. A set bit is a printed dot.
+        :param second_frame: The rows of a second color layer (red layer for the QL-800 series).
+        :param bool compress: Whether to compress the lines. Defaults to the setting
+            made with :py:meth:`add_compression`.
+        :returns: The raster instructions (bytes).
+        """
+        row_len = self.get_pixel_width() // 8
+        frame = memoryview(frame).cast('B')
+        frames = [frame]
+        if second_frame is not None:
+            second_frame = memoryview(second_frame).cast('B')
+            if len(frame) != len(second_frame):
+                fmt = "First and second frame don't have the same size: {} vs {} bytes."
+                raise BrotherQLRasterError(fmt.format(len(frame), len(second_frame)))
+            frames.append(second_frame)
+        if len(frame) % row_len:
+            fmt = 'Wrong frame size: {} bytes, expected a multiple of {}'
+            raise BrotherQLRasterError(fmt.format(len(frame), row_len))
+        if compress is None:
+            compress = self.compression_enabled
+        frames = [mirror_frame(frame, row_len) for frame in frames]
+        zero_raster = self.zero_raster_support and self.zero_raster_enabled
+        return encode_frames(frames, row_len, ptouch=self.model.startswith('PT'), compress=compress, zero_raster=zero_raster, cache=self.row_cache)
 
     def add_print(self, last_page=True):
-        if last_page:
-            self.data += b'\x1A' # 0x1A = ^Z = SUB; here: EOF = End of File
-        else:
-            self.data += b'\x0C' # 0x0C = FF  = Form Feed
+        # 0x1A = ^Z = SUB; here: EOF = End of File, 0x0C = FF  = Form Feed
+        self.buffer.write(page.print_page(last_page))
 
     def clear(self):
-        self.data = b''
+        self.buffer.clear()
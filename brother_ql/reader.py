@@ -3,11 +3,12 @@
 import struct
 import io
 import logging
+import mmap
 import sys
-from brother_ql.models import ModelsManager
+from collections import namedtuple
+
+from brother_ql import codec
 
-from PIL import Image
-from PIL.ImageOps import colorize
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,7 @@ OPCODES = {
     b'\x1b\x69\x41':         ("cut-every",       1, "cut every n-th page"),
     b'\x1b\x69\x4B':         ("expanded",        1, ""),
     b'\x1b\x69\x64':         ("margins",         2, ""),
+    b'\x1b\x69\x77':         ("wait",            1, "wait between pages"),
     b'\x1b\x69\x55\x77\x01': ('amedia',        127, "Additional media information command"),
     b'\x1b\x69\x55\x41':     ('auto_power_off',       -1, "Auto power off setting command"),
     b'\x1b\x69\x55\x4A':     ('jobid',          14, "Job ID setting command"),
@@ -201,45 +203,189 @@ RESP_BYTE_NAMES = [
 def hex_format(data):
     return ' '.join('{:02X}'.format(byte) for byte in data)
 
+#: How the length of an instruction is determined (see _build_trie())
+_FIXED_LENGTH, _QL_RASTER, _PTOUCH_RASTER = range(3)
+
+#: Returned by _match() if the data ends before the opcode is complete
+_INCOMPLETE = object()
+
+_trie_cache = [None, None]
+
+_INVERT = bytes(255 - byte for byte in range(256))
+
+def _build_trie(opcodes):
+    """
+    A prefix trie of the opcodes: nested dicts indexed by the bytes of the opcodes,
+    with tuples (opcode, definition, kind, fixed_length) at the leaves.
+    """
+    trie = {}
+    for opcode, definition in opcodes.items():
+        node = trie
+        for byte in opcode[:-1]:
+            node = node.setdefault(byte, {})
+            if type(node) is tuple:
+                raise ValueError('Ambiguous opcodes {} and {}'.format(hex_format(node[0]), hex_format(opcode)))
+        if opcode[-1] in node:
+            raise ValueError('Ambiguous opcode {}'.format(hex_format(opcode)))
+        if definition[0] in ('raster QL', '2-color raster QL'):
+            kind = _QL_RASTER
+        elif definition[0] == 'raster P-touch':
+            kind = _PTOUCH_RASTER
+        else:
+            kind = _FIXED_LENGTH
+        node[opcode[-1]] = (opcode, definition, kind, len(opcode) + max(definition[1], 0))
+    return trie
+
+def _opcode_trie():
+    """
+    The prefix trie for the current OPCODES (rebuilt if they were changed).
+    """
+    if _trie_cache[0] != OPCODES:
+        _trie_cache[:] = [dict(OPCODES), _build_trie(OPCODES)]
+    return _trie_cache[1]
+
+def _match(trie, data, offset, end):
+    """
+    :returns: The leaf of the trie for the opcode at data[offset:], None if
+        there is no such opcode or _INCOMPLETE if data ends before the opcode does.
+    """
+    node = trie
+    while offset < end:
+        node = node.get(data[offset])
+        if node is None or type(node) is tuple:
+            return node
+        offset += 1
+    return _INCOMPLETE
+
+def _split(trie, data, offset, end, final=True, raise_exception=False):
+    """
+    Walks data (any bytes-like object, e.g. a memoryview on an mmap) from offset
+    to end and yields the instructions as tuples (opcode, instruction).
+    Stops at an incomplete instruction unless final is True. The offset where
+    the walk stopped is the `value` of the StopIteration.
+    """
+    while offset < end:
+        leaf = _match(trie, data, offset, end)
+        if leaf is None:
+            msg = 'unknown opcode starting with {}...)'.format(hex_format(data[offset:offset+4]))
+            if raise_exception:
+                raise ValueError(msg)
+            logger.warning(msg)
+            offset += 1
+            continue
+        if leaf is _INCOMPLETE:
+            if not final:
+                return offset
+            msg = 'incomplete instruction at the end: {}'.format(hex_format(data[offset:end]))
+            if raise_exception:
+                raise ValueError(msg)
+            logger.warning(msg)
+            return end
+        opcode, definition, kind, length = leaf
+        if kind == _QL_RASTER:
+            length = 3 + data[offset+2] if offset + 2 < end else None
+        elif kind == _PTOUCH_RASTER:
+            length = 3 + data[offset+1] + data[offset+2]*256 if offset + 2 < end else None
+        if length is None or offset + length > end:
+            if not final:
+                return offset
+            # The last instruction is cut off, it is returned as it is
+            length = end - offset
+        leaf_end = offset + length
+        yield opcode, bytes(data[offset:leaf_end])
+        offset = leaf_end
+    return offset
+
+class InstructionParser(object):
+    """
+    Splits instructions fed in pieces of any size, e.g. read from a pipe or a socket,
+    into single instructions. Only an incomplete instruction at the end is kept
+    between the calls of :py:meth:`feed`, so the memory used doesn't grow with the stream.
+
+    Logs warnings for unknown opcodes or raises a ValueError instead, if raise_exception is set to True.
+    """
+
+    def __init__(self, raise_exception=False):
+        self.raise_exception = raise_exception
+        self._trie = _opcode_trie()
+        self._pending = bytearray()
+
+    def feed(self, data):
+        """
+        :param data: The next piece of the stream (bytes-like).
+        :returns: A list of the instructions completed by data as tuples (opcode, instruction).
+        """
+        if self._pending:
+            self._pending += data
+            data = self._pending
+        instructions = []
+        walk = _split(self._trie, data, 0, len(data), final=False, raise_exception=self.raise_exception)
+        while True:
+            try:
+                instructions.append(next(walk))
+            except StopIteration as stop:
+                offset = stop.value
+                break
+        self._pending = bytearray(memoryview(data)[offset:])
+        return instructions
+
+    def close(self):
+        """
+        :returns: The instructions left at the end of the stream (an incomplete
+            last instruction is returned as it is).
+        """
+        data, self._pending = self._pending, bytearray()
+        return list(_split(self._trie, data, 0, len(data), final=True, raise_exception=self.raise_exception))
+
+def iter_instructions(source, raise_exception=False, chunk_size=1 << 16):
+    """
+    Generator of the instructions as tuples (opcode, instruction).
+
+    :param source: A bytes-like object or a binary file object. Regular files
+        are memory-mapped, other file objects (pipes, sockets) are read in chunks.
+    """
+    if not hasattr(source, 'read'):
+        view = memoryview(source).cast('B')
+        yield from _split(_opcode_trie(), view, 0, len(view), raise_exception=raise_exception)
+        return
+    try:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        mapped = None
+    if mapped is not None:
+        try:
+            yield from _split(_opcode_trie(), mapped, source.tell(), len(mapped), raise_exception=raise_exception)
+        finally:
+            mapped.close()
+        return
+    parser = InstructionParser(raise_exception)
+    while True:
+        data = source.read(chunk_size)
+        if not data:
+            break
+        yield from parser.feed(data)
+    yield from parser.close()
+
 def chunker(data, raise_exception=False):
     """
     Breaks data stream (bytes) into a list of bytes objects containing single instructions each.
 
     Logs warnings for unknown opcodes or raises an exception instead, if raise_exception is set to True.
 
-    returns: list of bytes objects
+    returns: generator of bytes objects
     """
-    instructions = []
-    data = bytes(data)
-    while True:
-        if len(data) == 0: break
-        try:
-            opcode = match_opcode(data)
-        except KeyError:
-            msg = 'unknown opcode starting with {}...)'.format(hex_format(data[0:4]))
-            if raise_exception:
-                raise ValueError(msg)
-            else:
-                logger.warning(msg)
-                data = data[1:]
-                continue
-        opcode_def = OPCODES[opcode]
-        num_bytes = len(opcode)
-        if opcode_def[1] > 0: num_bytes += opcode_def[1]
-        elif opcode_def[0] in ('raster QL', '2-color raster QL'):
-            num_bytes += data[2] + 2
-        elif opcode_def[0] in ('raster P-touch',):
-            num_bytes += data[1] + data[2]*256 + 2
-        #payload = data[len(opcode):num_bytes]
-        instructions.append(data[:num_bytes])
-        yield instructions[-1]
-        data = data[num_bytes:]
-    #return instructions
+    for opcode, instruction in iter_instructions(data, raise_exception):
+        yield instruction
 
 def match_opcode(data):
-    matching_opcodes = [opcode for opcode in OPCODES.keys() if data.startswith(opcode)]
-    assert len(matching_opcodes) == 1
-    return matching_opcodes[0]
+    """
+    :returns: The opcode at the start of data.
+    :raises KeyError: If data doesn't start with a known opcode.
+    """
+    leaf = _match(_opcode_trie(), data, 0, len(data))
+    if leaf is None or leaf is _INCOMPLETE:
+        raise KeyError(hex_format(data[0:4]))
+    return leaf[0]
 
 def interpret_response(data):
     data = bytes(data)
@@ -253,11 +399,9 @@ def interpret_response(data):
     model_code = data[4]
 
     # printer model detection
-    model = "Unknown"
-    for m in ModelsManager().iter_elements():
-        if series_code == m.series_code and model_code == m.model_code:
-            model = m.identifier
-            break
+    from brother_ql.registry import get_registry
+    m = get_registry().model_by_codes(series_code, model_code)
+    model = m.identifier if m is not None else "Unknown"
 
     errors = []
     error_info_1 = data[8]
@@ -341,22 +485,64 @@ def merge_specific_instructions(chunks, join_preamble=True, join_raster=True):
     """
     new_instructions = []
     last_opcode = None
-    instruction_buffer = b''
+    instruction_buffer = []
     for instruction in chunks:
         opcode = match_opcode(instruction)
         if   join_preamble and OPCODES[opcode][0] == 'preamble' and last_opcode == 'preamble':
-            instruction_buffer += instruction
+            instruction_buffer.append(instruction)
         elif join_raster   and 'raster' in OPCODES[opcode][0] and 'raster' in last_opcode:
-            instruction_buffer += instruction
+            instruction_buffer.append(instruction)
         else:
             if instruction_buffer:
-                new_instructions.append(instruction_buffer)
-            instruction_buffer = instruction
+                new_instructions.append(b''.join(instruction_buffer))
+            instruction_buffer = [instruction]
         last_opcode = OPCODES[opcode][0]
     if instruction_buffer:
-        new_instructions.append(instruction_buffer)
+        new_instructions.append(b''.join(instruction_buffer))
     return new_instructions
 
+def _packed_rows(rows):
+    """
+    :returns: The decoded raster rows of a page as :py:class:`brother_ql.encoder.PackedBitmap`
+        in the orientation of the label (the rows are sent mirrored), None if there are no rows.
+    """
+    if not len(rows): return None
+    # brother_ql.encoder pulls in NumPy, the reader is also used by the backends
+    from brother_ql.encoder import PackedBitmap, mirror_frame
+    width_dots = max(len(row) for row in rows)
+    blank = b'\x00'*width_dots
+    data = b''.join(row.ljust(width_dots, b'\x00') if len(row) else blank for row in rows)
+    return PackedBitmap(mirror_frame(data, width_dots), (width_dots*8, len(rows)))
+
+class DecodedPage(namedtuple('DecodedPage', ['number', 'black', 'red', 'raster_no', 'media_width', 'high_resolution'])):
+    """
+    A page decoded from the instructions by :py:meth:`BrotherQLReader.iter_pages`.
+
+    * `number`: The number of the page (counting from 1).
+    * `black`: The black dots (:py:class:`brother_ql.encoder.PackedBitmap`, a set bit is a printed dot).
+    * `red`: The red dots of two color pages, otherwise None.
+    * `raster_no`, `media_width`: As given in the media/quality instruction.
+    * `high_resolution`: Whether the page is printed with 600 dpi.
+    """
+    __slots__ = ()
+
+    def image(self):
+        """
+        :returns: The page as PIL image: a mode "1" image, or an RGBA image with
+            red and black dots for two color pages.
+        """
+        from PIL import Image, ImageChops
+        if self.red is None:
+            return Image.frombytes('1', self.black.size, self.black.data.translate(_INVERT), decoder_name='raw')
+        size = self.black.size
+        black = Image.frombytes('1', size, self.black.data, decoder_name='raw').convert('L')
+        red = Image.new('L', size, 0)
+        red.paste(Image.frombytes('1', self.red.size, self.red.data, decoder_name='raw').convert('L').crop((0, 0) + size), (0, 0))
+        # White: (255, 255, 255), red dots: (255, 0, 0), black dots (on top of red): (0, 0, 0)
+        r = ImageChops.invert(black)
+        gb = ImageChops.invert(ImageChops.lighter(black, red))
+        return Image.merge('RGBA', (r, gb, gb, Image.new('L', size, 255)))
+
 class BrotherQLReader(object):
     DEFAULT_FILENAME_FMT = 'label{counter:04d}.png'
 
@@ -375,102 +561,73 @@ class BrotherQLReader(object):
         self.high_resolution_printing = False
         self.filename_fmt = self.DEFAULT_FILENAME_FMT
 
+    def iter_pages(self):
+        """
+        Generator of the pages of the instructions as :py:class:`DecodedPage`, decoded
+        one at a time while reading the instructions (regular files are memory-mapped),
+        so only the rows of the current page are kept in memory.
+        """
+        log_instructions = logger.isEnabledFor(logging.INFO)
+        for opcode, instruction in iter_instructions(self.brother_file):
+            opcode_def = OPCODES[opcode]
+            name = opcode_def[0]
+            if name == 'init':
+                self.mwidth, self.mheight = None, None
+                self.raster_no = None
+                self.black_rows = []
+                self.red_rows = []
+            payload = instruction[len(opcode):]
+            if log_instructions:
+                logger.info(" {} ({}) --> found! (payload: {})".format(name, hex_format(opcode), hex_format(payload)))
+            if name == 'compression':
+                self.compression = payload[0] == 0x02
+            elif name == 'zero raster':
+                self.black_rows.append(bytes())
+                if self.two_color_printing:
+                    self.red_rows.append(bytes())
+            elif name in ('raster QL', '2-color raster QL', 'raster P-touch'):
+                rpl = payload[2:] # raster payload
+                if self.compression:
+                    row = codec.decode(rpl)
+                else:
+                    row = rpl
+                if name in ('raster QL', 'raster P-touch'):
+                    self.black_rows.append(row)
+                else: # 2-color
+                    if   payload[0] == 0x01:
+                        self.black_rows.append(row)
+                    elif payload[0] == 0x02:
+                        self.red_rows.append(row)
+                    else:
+                        raise NotImplementedError("color: 0x%x" % payload[0])
+            elif name == 'expanded':
+                self.two_color_printing = bool(payload[0] & (1 << 0))
+                self.cut_at_end = bool(payload[0] & (1 << 3))
+                self.high_resolution_printing = bool(payload[0] & (1 << 6))
+            elif name == 'media/quality':
+                self.raster_no = struct.unpack('<L', payload[4:8])[0]
+                self.mwidth = instruction[len(opcode) + 2]
+                self.mlength = instruction[len(opcode) + 3]*256
+                fmt = " media width: {} mm, media length: {} mm, raster no: {} rows"
+                logger.info(fmt.format(self.mwidth, self.mlength, self.raster_no))
+            elif name == 'print':
+                logger.info("Len of black rows: %d", len(self.black_rows))
+                logger.info("Len of red   rows: %d", len(self.red_rows))
+                black = _packed_rows(self.black_rows)
+                red = _packed_rows(self.red_rows) if self.two_color_printing else None
+                self.black_rows = []
+                self.red_rows = []
+                if black is None:
+                    continue
+                yield DecodedPage(self.page_counter, black, red, self.raster_no, self.mwidth, self.high_resolution_printing)
+                self.page_counter += 1
+
     def analyse(self):
-        instructions = self.brother_file.read()
-        for instruction in chunker(instructions):
-            for opcode in OPCODES.keys():
-                if instruction.startswith(opcode):
-                    opcode_def = OPCODES[opcode]
-                    if opcode_def[0] == 'init':
-                        self.mwidth, self.mheight = None, None
-                        self.raster_no = None
-                        self.black_rows = []
-                        self.red_rows = []
-                    payload = instruction[len(opcode):]
-                    logger.info(" {} ({}) --> found! (payload: {})".format(opcode_def[0], hex_format(opcode), hex_format(payload)))
-                    if opcode_def[0] == 'compression':
-                        self.compression = payload[0] == 0x02
-                    if opcode_def[0] == 'zero raster':
-                        self.black_rows.append(bytes())
-                        if self.two_color_printing:
-                            self.red_rows.append(bytes())
-                    if opcode_def[0] in ('raster QL', '2-color raster QL', 'raster P-touch'):
-                        rpl = bytes(payload[2:]) # raster payload
-                        if self.compression:
-                            row = bytes()
-                            index = 0
-                            while True:
-                                num = rpl[index]
-                                if num & 0x80:
-                                    num = num - 0x100
-                                if num < 0:
-                                    num = -num + 1
-                                    row += bytes([rpl[index+1]] * num)
-                                    index += 2
-                                else:
-                                    num = num + 1
-                                    row += rpl[index+1:index+1+num]
-                                    index += 1 + num
-                                if index >= len(rpl): break
-                        else:
-                            row = rpl
-                        if opcode_def[0] in ('raster QL', 'raster P-touch'):
-                            self.black_rows.append(row)
-                        else: # 2-color
-                            if   payload[0] == 0x01:
-                                self.black_rows.append(row)
-                            elif payload[0] == 0x02:
-                                self.red_rows.append(row)
-                            else:
-                                raise NotImplementedError("color: 0x%x" % payload[0])
-                    if opcode_def[0] == 'expanded':
-                        self.two_color_printing = bool(payload[0] & (1 << 0))
-                        self.cut_at_end = bool(payload[0] & (1 << 3))
-                        self.high_resolution_printing = bool(payload[0] & (1 << 6))
-                    if opcode_def[0] == 'media/quality':
-                        self.raster_no = struct.unpack('<L', payload[4:8])[0]
-                        self.mwidth = instruction[len(opcode) + 2]
-                        self.mlength = instruction[len(opcode) + 3]*256
-                        fmt = " media width: {} mm, media length: {} mm, raster no: {} rows"
-                        logger.info(fmt.format(self.mwidth, self.mlength, self.raster_no))
-                    if opcode_def[0] == 'print':
-                        logger.info("Len of black rows: %d", len(self.black_rows))
-                        logger.info("Len of red   rows: %d", len(self.red_rows))
-                        def get_im(rows):
-                            if not len(rows): return None
-                            width_dots  = max(len(row) for row in rows)
-                            height_dots = len(rows)
-                            size = (width_dots*8, height_dots)
-                            expanded_rows = []
-                            for row in rows:
-                                if len(row) == 0:
-                                    expanded_rows.append(b'\x00'*width_dots)
-                                else:
-                                    expanded_rows.append(row)
-                            data = bytes(b''.join(expanded_rows))
-                            data = bytes([2**8 + ~byte for byte in data]) # invert b/w
-                            im = Image.frombytes("1", size, data, decoder_name='raw')
-                            return im
-                        if not self.two_color_printing:
-                            im_black = get_im(self.black_rows)
-                            im = im_black
-                        else:
-                            im_black, im_red = (get_im(rows) for rows in (self.black_rows, self.red_rows))
-                            im_black = im_black.convert("RGBA")
-                            im_red = im_red.convert("L")
-                            im_red = colorize(im_red, (255, 0, 0), (255, 255, 255))
-                            im_red = im_red.convert("RGBA")
-                            pixdata_black = im_black.load()
-                            width, height = im_black.size
-                            for y in range(height):
-                                for x in range(width):
-                                    # replace "white" with "transparent"
-                                    if pixdata_black[x, y] == (255, 255, 255, 255):
-                                        pixdata_black[x, y] = (255, 255, 255, 0)
-                            im_red.paste(im_black, (0, 0), im_black)
-                            im = im_red
-                        im = im.transpose(Image.FLIP_LEFT_RIGHT)
-                        img_name = self.filename_fmt.format(counter=self.page_counter)
-                        im.save(img_name)
-                        print('Page saved as {}'.format(img_name))
-                        self.page_counter += 1
+        """
+        Renders the pages of the instructions and saves them as images
+        (named after :py:attr:`filename_fmt`) in the current directory.
+        """
+        for page in self.iter_pages():
+            img_name = self.filename_fmt.format(counter=page.number)
+            page.image().save(img_name)
+            print('Page saved as {}'.format(img_name))
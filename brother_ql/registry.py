@@ -0,0 +1,105 @@
+"""
+A compiled, read-only registry of the printer models and labels.
+
+The registry is built once from :py:data:`brother_ql.models.ALL_MODELS` and
+:py:data:`brother_ql.labels.ALL_LABELS` and indexes them by identifier,
+by the (series code, model code) pair found in status responses and by
+USB product id, so that lookups don't walk the lists.
+"""
+
+from brother_ql.models import ALL_MODELS
+from brother_ql.labels import ALL_LABELS
+
+
+class IdentifierList(tuple):
+    """
+    An immutable list of identifiers with constant time membership tests.
+    """
+
+    def __new__(cls, identifiers=()):
+        self = super(IdentifierList, cls).__new__(cls, identifiers)
+        self._members = frozenset(self)
+        return self
+
+    def __contains__(self, item):
+        try:
+            return item in self._members
+        except TypeError:
+            return False
+
+
+class Registry(object):
+    """
+    Indexes over a collection of :py:class:`brother_ql.models.Model` and
+    :py:class:`brother_ql.labels.Label` records.
+
+    If several models share the same (series code, model code) pair or USB
+    product id, the one listed first wins.
+    """
+
+    __slots__ = ('models', 'labels', 'model_identifiers', 'label_identifiers',
+                 '_models', '_labels', '_models_by_codes', '_models_by_product_id', '_capabilities')
+
+    def __init__(self, models=ALL_MODELS, labels=ALL_LABELS):
+        self.models = tuple(models)
+        self.labels = tuple(labels)
+        self.model_identifiers = IdentifierList(m.identifier for m in self.models)
+        self.label_identifiers = IdentifierList(l.identifier for l in self.labels)
+        self._models = {m.identifier: m for m in self.models}
+        self._labels = {l.identifier: l for l in self.labels}
+        self._models_by_codes = {}
+        self._models_by_product_id = {}
+        for m in self.models:
+            self._models_by_codes.setdefault((m.series_code, m.model_code), m)
+            self._models_by_product_id.setdefault(m.product_id, m)
+        self._capabilities = {}
+
+    def model(self, identifier):
+        """
+        :returns: The model with the given identifier.
+        :raises KeyError: If there is no such model.
+        """
+        return self._models[identifier]
+
+    def label(self, identifier):
+        """
+        :returns: The label with the given identifier.
+        :raises KeyError: If there is no such label.
+        """
+        return self._labels[identifier]
+
+    def model_by_codes(self, series_code, model_code, default=None):
+        """
+        :returns: The model reporting the given series and model code in its status response.
+        """
+        return self._models_by_codes.get((series_code, model_code), default)
+
+    def model_by_product_id(self, product_id, default=None):
+        """
+        :returns: The model with the given USB product id.
+        """
+        return self._models_by_product_id.get(product_id, default)
+
+    def models_with(self, attribute):
+        """
+        :param str attribute: A boolean attribute of :py:class:`brother_ql.models.Model`, e.g. 'two_color'.
+        :returns: The identifiers of all models having the attribute set (:py:class:`IdentifierList`).
+        """
+        try:
+            return self._capabilities[attribute]
+        except KeyError:
+            ids = IdentifierList(m.identifier for m in self.models if getattr(m, attribute))
+            self._capabilities[attribute] = ids
+            return ids
+
+
+_registry = None
+
+def get_registry():
+    """
+    :returns: The :py:class:`Registry` of all models and labels known to this package.
+    """
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
@@ -0,0 +1,341 @@
+"""
+Drawing labels directly as 1-bit images at the resolution of the printer.
+
+Instead of drawing a label in RGB and converting it back to black and
+white, a :py:class:`LabelCanvas` is a mode "1" image with the printable
+size of the label. Text is drawn from a cache of binarized glyphs (see
+:py:class:`GlyphCache`), barcodes (Code 128, EAN-13) and QR codes are
+drawn module by module, so no threshold step is needed. The result
+(:py:meth:`LabelCanvas.bitmap`) is encoded without any preprocessing by
+:py:func:`brother_ql.conversion.convert`::
+
+    canvas = LabelCanvas('QL-720NW', '62', length=200)
+    canvas.text((10, 10), "Part 0815", size=40)
+    canvas.code128((10, 80), "P0815", height=60)
+    data = convert(qlr, [canvas.bitmap()], '62')
+
+QR codes need the optional dependency `qrcode` (``pip install brother_ql[render]``).
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from brother_ql.devicedependent import ENDLESS_LABEL, PTOUCH_ENDLESS_LABEL, label_type_specs
+from brother_ql.encoder import BIT_INVERT, PackedBitmap
+from brother_ql.registry import get_registry
+
+#: The patterns of the Code 128 symbols: the widths of alternating bars and spaces in modules.
+CODE128_PATTERNS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+)
+CODE128_START_B, CODE128_START_C, CODE128_STOP = 104, 105, 106
+
+#: The EAN-13 digit codes of the left half with odd parity (L), a 1 being a bar.
+#: The codes with even parity (G) are the reversed right half codes (R), which are the inverted L codes.
+EAN_L_CODES = ('0001101', '0011001', '0010011', '0111101', '0100011', '0110001', '0101111', '0111011', '0110111', '0001011')
+#: The parities of the left half digits encoding the first digit of an EAN-13.
+EAN_PARITIES = ('LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG', 'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL')
+
+#: A binarized glyph: its mask (mode "1"), its offset from the pen position and the advance of the pen.
+Glyph = namedtuple('Glyph', ['mask', 'offset', 'advance'])
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def printer_dpi(model):
+    """
+    :returns: The resolution of a printer model (dots per inch), see :py:attr:`brother_ql.models.Model.dpi`.
+    :raises KeyError: If the model is unknown.
+    """
+    return get_registry().model(model).dpi
+
+
+class GlyphCache(object):
+    """
+    A bounded LRU cache of binarized glyphs keyed by font, size and character.
+
+    Label text is made of few distinct characters, so rasterizing every
+    glyph once and pasting the cached masks is much faster than drawing
+    the text with FreeType for every label.
+
+    :param int maxsize: The maximum number of glyphs to keep.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._glyphs = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _font_key(font):
+        # Fonts loaded from a file are identified by the file, other fonts by the instance
+        path = getattr(font, 'path', None)
+        return (path if isinstance(path, str) else font, getattr(font, 'size', None), getattr(font, 'index', 0))
+
+    def get(self, font, char):
+        """
+        :returns: The :py:class:`Glyph` of a character of a font.
+        """
+        key = (self._font_key(font), char)
+        with self._lock:
+            glyph = self._glyphs.get(key)
+            if glyph is not None:
+                self._glyphs.move_to_end(key)
+                self.hits += 1
+                return glyph
+            self.misses += 1
+        glyph = self._rasterize(font, char)
+        with self._lock:
+            self._glyphs[key] = glyph
+            if len(self._glyphs) > self.maxsize:
+                self._glyphs.popitem(last=False)
+        return glyph
+
+    @staticmethod
+    def _rasterize(font, char):
+        left, top, right, bottom = font.getbbox(char)
+        advance = font.getlength(char)
+        if right <= left or bottom <= top:
+            return Glyph(None, (0, 0), advance)
+        im = Image.new('L', (right - left, bottom - top), 0)
+        ImageDraw.Draw(im).text((-left, -top), char, fill=255, font=font)
+        return Glyph(im.point([0] * 128 + [255] * 128, '1'), (left, top), advance)
+
+    def info(self):
+        """
+        :returns: Hit and miss counters and the size of the cache (:py:class:`CacheInfo`).
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._glyphs))
+
+    def clear(self):
+        with self._lock:
+            self._glyphs.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._glyphs)
+
+
+_shared_glyph_cache = None
+
+def shared_glyph_cache():
+    """
+    :returns: The :py:class:`GlyphCache` shared by all canvases of this process.
+    """
+    global _shared_glyph_cache
+    if _shared_glyph_cache is None:
+        _shared_glyph_cache = GlyphCache()
+    return _shared_glyph_cache
+
+
+_default_fonts = {}
+
+def default_font(size=10):
+    """
+    :returns: PIL's default font in the given size (one instance per size).
+    """
+    font = _default_fonts.get(size)
+    if font is None:
+        try:
+            font = ImageFont.load_default(size)
+        except TypeError:
+            # Pillow < 10.1 only has a bitmap font in a single size
+            font = ImageFont.load_default()
+        _default_fonts[size] = font
+    return font
+
+
+def code128_modules(data):
+    """
+    Encode a string as Code 128 (code set C for even-length digit strings, else code set B).
+
+    :returns: The widths of the alternating bars and spaces in modules, starting with a bar
+        and including the start, check and stop symbols (without quiet zones).
+    """
+    if data and len(data) % 2 == 0 and data.isascii() and data.isdigit():
+        values = [CODE128_START_C] + [int(data[i:i+2]) for i in range(0, len(data), 2)]
+    else:
+        values = [CODE128_START_B]
+        for char in data:
+            code = ord(char)
+            if not 32 <= code <= 127:
+                raise ValueError("Character %r can't be encoded with Code 128 B." % char)
+            values.append(code - 32)
+    check = (values[0] + sum(i * value for i, value in enumerate(values[1:], 1))) % 103
+    values += [check, CODE128_STOP]
+    return [int(width) for value in values for width in CODE128_PATTERNS[value]]
+
+
+def ean13_check_digit(digits):
+    """
+    :param str digits: The first 12 digits of an EAN-13.
+    :returns: The check digit (int).
+    """
+    total = sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(digits))
+    return (10 - total % 10) % 10
+
+
+def ean13_modules(digits):
+    """
+    :param str digits: 12 digits (the check digit is added) or 13 digits (the check digit is verified).
+    :returns: The 95 modules of the EAN-13 as a string of '1' (bar) and '0' (space).
+    """
+    if not digits.isdigit() or len(digits) not in (12, 13):
+        raise ValueError("An EAN-13 needs 12 or 13 digits, not %r." % digits)
+    check = ean13_check_digit(digits[:12])
+    if len(digits) == 13 and int(digits[12]) != check:
+        raise ValueError("Wrong EAN-13 check digit in %s, expected %d." % (digits, check))
+    digits = digits[:12] + str(check)
+    invert = str.maketrans('01', '10')
+    left = ''
+    for digit, parity in zip(digits[1:7], EAN_PARITIES[int(digits[0])]):
+        code = EAN_L_CODES[int(digit)]
+        left += code if parity == 'L' else code.translate(invert)[::-1]
+    right = ''.join(EAN_L_CODES[int(digit)].translate(invert) for digit in digits[7:])
+    return '101' + left + '01010' + right + '101'
+
+
+class LabelCanvas(object):
+    """
+    A mode "1" image with the printable size of a label to draw on.
+
+    :param str model: The printer model.
+    :param str label: The label identifier.
+    :param int length: The length of the label in dots, for endless labels (required there).
+    :param GlyphCache glyph_cache: The glyph cache to use, by default the one shared in the process.
+    """
+
+    def __init__(self, model, label, length=None, glyph_cache=None):
+        label_specs = label_type_specs[label]
+        width, height = label_specs['dots_printable']
+        if label_specs['kind'] in (ENDLESS_LABEL, PTOUCH_ENDLESS_LABEL):
+            if not length:
+                raise ValueError("The length of an endless label needs to be given.")
+            height = length
+        self.model = model
+        self.label = label
+        self.dpi = printer_dpi(model)
+        self.image = Image.new('1', (width, height), 1)
+        self.glyph_cache = glyph_cache if glyph_cache is not None else shared_glyph_cache()
+        self._draw = ImageDraw.Draw(self.image)
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def mm(self, millimeters):
+        """
+        :returns: A length given in millimeters in dots.
+        """
+        return int(round(millimeters * self.dpi / 25.4))
+
+    def text(self, xy, text, font=None, size=None):
+        """
+        Draw a line of text in black (without kerning).
+
+        :param xy: The position of the top left corner of the text (as PIL's `text()` with anchor 'la').
+        :param font: A PIL font. Defaults to PIL's default font in the given `size`.
+        :param int size: The size of the default font.
+        :returns: The width of the text in dots.
+        """
+        if font is None:
+            font = default_font(size or 10)
+        x, y = xy
+        pen = 0.0
+        for char in text:
+            glyph = self.glyph_cache.get(font, char)
+            if glyph.mask is not None:
+                left, top = glyph.offset
+                self.image.paste(0, (x + int(round(pen)) + left, y + top), glyph.mask)
+            pen += glyph.advance
+        return int(round(pen))
+
+    def rectangle(self, box, fill=True):
+        """
+        Draw a filled black (or white if `fill` is False) rectangle (x0, y0, x1, y1), inclusive.
+        """
+        self._draw.rectangle(box, fill=0 if fill else 1)
+
+    def _bars(self, x, y, widths, height, module_width):
+        bar = True
+        for width in widths:
+            if bar:
+                self._draw.rectangle((x, y, x + width * module_width - 1, y + height - 1), fill=0)
+            x += width * module_width
+            bar = not bar
+        return x
+
+    def code128(self, xy, data, height, module_width=2):
+        """
+        Draw a Code 128 barcode (without quiet zones).
+
+        :param int height: The height of the bars in dots.
+        :param int module_width: The width of the narrowest bar in dots.
+        :returns: The width of the barcode in dots.
+        """
+        x, y = xy
+        return self._bars(x, y, code128_modules(data), height, module_width) - x
+
+    def ean13(self, xy, digits, height, module_width=2):
+        """
+        Draw an EAN-13 barcode (95 modules, without quiet zones and human readable digits).
+
+        :returns: The width of the barcode in dots.
+        """
+        x, y = xy
+        modules = ean13_modules(digits)
+        # Runs of bars and spaces, starting with a bar
+        widths = []
+        previous = None
+        for module in modules:
+            if module == previous:
+                widths[-1] += 1
+            else:
+                widths.append(1)
+                previous = module
+        return self._bars(x, y, widths, height, module_width) - x
+
+    def qr(self, xy, data, module_size=4, error_correction='M'):
+        """
+        Draw a QR code (without quiet zone). Requires the package `qrcode`.
+
+        :param int module_size: The size of a module in dots.
+        :param str error_correction: 'L', 'M', 'Q' or 'H'.
+        :returns: The size of the QR code in dots.
+        """
+        try:
+            import qrcode
+        except ImportError:
+            raise ImportError("Drawing QR codes requires the package qrcode (pip install qrcode).")
+        levels = {'L': qrcode.constants.ERROR_CORRECT_L, 'M': qrcode.constants.ERROR_CORRECT_M,
+                  'Q': qrcode.constants.ERROR_CORRECT_Q, 'H': qrcode.constants.ERROR_CORRECT_H}
+        code = qrcode.QRCode(error_correction=levels[error_correction], box_size=1, border=0)
+        code.add_data(data)
+        code.make(fit=True)
+        matrix = code.get_matrix()
+        modules = len(matrix)
+        im = Image.frombytes('L', (modules, modules), bytes(0 if dark else 255 for row in matrix for dark in row))
+        im = im.resize((modules * module_size,) * 2, Image.NEAREST).convert('1', dither=Image.NONE)
+        self.image.paste(im, xy)
+        return modules * module_size
+
+    def bitmap(self):
+        """
+        :returns: The label as :py:class:`brother_ql.encoder.PackedBitmap` (a set bit is a printed dot).
+        """
+        return PackedBitmap(self.image.tobytes().translate(BIT_INVERT), self.image.size)
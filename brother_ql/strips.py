@@ -0,0 +1,179 @@
+"""
+Strip-wise conversion of long pages on endless labels.
+
+Some models print endless labels of several meters (e.g. 35434 dots on the
+QL-1100). Converting such a page at once holds several full-size copies
+of it (converted, resized, rotated, padded, binarized, packed). Here the
+page is processed in horizontal bands ("strips") of a fixed number of
+raster lines instead: each strip is cut from the source image, resized,
+rotated, padded, binarized and encoded on its own, and the raster data
+is streamed out strip after strip. The memory used for the intermediate
+images is proportional to the height of a strip, and the instructions
+of the page header can be sent before the page is processed.
+
+The strips can be processed by several threads (PIL releases the GIL
+while resizing and converting images), the order of the output is kept.
+
+Only pages for which the strips are independent are processed this way:
+pages on endless labels, rotated by a multiple of 90 degrees and not
+dithered with error diffusion. The result is identical to converting the
+page at once unless the image is resized: resampling a strip can round
+a few pixels differently at the borders of the strips.
+"""
+
+import math
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from brother_ql import conversion
+from brother_ql.geometry import TRANSPOSE, paste_on_canvas
+
+#: The default number of raster lines per strip.
+DEFAULT_STRIP_HEIGHT = 256
+
+#: The height of a strip is rounded up to a multiple of this, so the tiles
+#: of the ordered dithering modes line up across strips.
+STRIP_ALIGNMENT = 16
+
+#: The raster data of a page created strip by strip: the number of raster lines,
+#: whether the data is compressed and an iterator of the raster data (bytes) of the strips.
+StripPage = namedtuple('StripPage', ['height', 'compress', 'chunks'])
+
+
+def strip_plan(im, label_specs, options, strip_height):
+    """
+    :returns: The :py:class:`brother_ql.geometry.PagePlan` of the page if it is to be
+        processed in strips of `strip_height` lines, None otherwise.
+    """
+    geometry = conversion._geometry(label_specs, options)
+    if not geometry.endless or options.get('dither') in (True, 'floyd-steinberg'):
+        return None
+    plan = geometry.page(im.size)
+    if plan is None or plan.size[1] <= strip_height:
+        return None
+    return plan
+
+
+def _source_box(plan, start, end):
+    """
+    :returns: The box of the lines [start, end) of the page in the scaled image (before rotating it).
+    """
+    width, height = plan.scaled_size
+    if plan.angle == 0:
+        return (0, start, width, end)
+    if plan.angle == 180:
+        return (0, height - end, width, height - start)
+    if plan.angle == 90:
+        return (width - end, 0, width - start, height)
+    return (start, 0, end, height)
+
+
+def _strip_image(im, plan, options, start, end):
+    """
+    Cut the lines [start, end) of the page from the source image and
+    preprocess them like :py:func:`brother_ql.conversion.preprocess_image`.
+    """
+    red = options.get('red', False)
+    resample = conversion.RESAMPLE_MODES[options.get('resample') or 'lanczos'][0]
+    scaled_width, scaled_height = plan.scaled_size
+    scale_x, scale_y = im.size[0] / scaled_width, im.size[1] / scaled_height
+    x0, y0, x1, y1 = _source_box(plan, start, end)
+    box = (x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y)
+    # Only a part of the source around the strip is converted, with a margin
+    # for the support of the resampling filter
+    margin_x, margin_y = math.ceil(3 * max(scale_x, 1)) + 2, math.ceil(3 * max(scale_y, 1)) + 2
+    crop = (max(0, math.floor(box[0]) - margin_x), max(0, math.floor(box[1]) - margin_y),
+            min(im.size[0], math.ceil(box[2]) + margin_x), min(im.size[1], math.ceil(box[3]) + margin_y))
+    piece = im.crop(crop)
+    if piece.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        piece = piece.convert('RGBA' if piece.mode.endswith('A') else 'RGB' if red else 'L')
+    if not red and piece.mode in ('RGB', 'RGBA'):
+        piece = piece.convert('LA' if piece.mode == 'RGBA' else 'L')
+    box = (box[0] - crop[0], box[1] - crop[1], box[2] - crop[0], box[3] - crop[1])
+    size = (x1 - x0, y1 - y0)
+    if (scale_x, scale_y) == (1, 1):
+        piece = piece.crop(tuple(int(round(value)) for value in box))
+    else:
+        piece = piece.resize(size, resample, box=box)
+    if piece.mode.endswith('A'):
+        background = Image.new('RGB', piece.size, (255, 255, 255))
+        background.paste(piece, piece.split()[-1])
+        piece = background
+    elif piece.mode == 'L' and red:
+        piece = piece.convert('RGB')
+    if plan.angle:
+        piece = piece.transpose(TRANSPOSE[plan.angle])
+    if plan.canvas_size is not None:
+        piece = paste_on_canvas(piece, (plan.canvas_size[0], piece.size[1]), plan.offset)
+    return conversion.binarize_image(piece, options)
+
+
+def _encode_strip(qlr, im, plan, options, start, end, compress):
+    strip, black_im, red_im = _strip_image(im, plan, options, start, end)
+    page, _ = conversion.encode_page(qlr, strip, black_im, red_im, options.get('red', False), compress)
+    return page.raster
+
+
+def strip_page(qlr, im, plan, options, compress, throughput=None, strip_height=DEFAULT_STRIP_HEIGHT, workers=1):
+    """
+    Create the raster data of a page strip by strip.
+
+    With compress='auto', compression is decided on the first strip.
+    The first strip is processed right away, the others while iterating
+    over :py:attr:`StripPage.chunks`.
+
+    :param PIL.Image.Image im: The image of the page.
+    :param plan: The plan of the page, see :py:func:`strip_plan`.
+    :param int workers: The number of threads processing strips.
+    :returns: A tuple (:py:class:`StripPage`, estimate).
+    """
+    strip_height = -(-strip_height // STRIP_ALIGNMENT) * STRIP_ALIGNMENT
+    height = plan.size[1]
+    bounds = [(start, min(start + strip_height, height)) for start in range(0, height, strip_height)]
+    strip, black_im, red_im = _strip_image(im, plan, options, *bounds[0])
+    first, estimate = conversion.encode_page(qlr, strip, black_im, red_im, options.get('red', False), compress, throughput)
+    del strip, black_im, red_im
+    compress = first.compress
+    return StripPage(height, compress, _iter_chunks(qlr, im, plan, options, bounds, first.raster, compress, workers)), estimate
+
+
+def _iter_chunks(qlr, im, plan, options, bounds, first, compress, workers):
+    yield first
+    if workers <= 1:
+        for start, end in bounds[1:]:
+            yield _encode_strip(qlr, im, plan, options, start, end, compress)
+        return
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for start, end in bounds[1:]:
+                pending.append(executor.submit(_encode_strip, qlr, im, plan, options, start, end, compress))
+                if len(pending) > 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def iter_job(qlr, job, images, strip_height=DEFAULT_STRIP_HEIGHT, workers=1):
+    """
+    The instructions of the pages of a job (see :py:func:`brother_ql.conversion.iter_convert`),
+    long pages are created strip by strip and yielded in several chunks.
+
+    :param dict job: The job settings, see :py:func:`brother_ql.conversion._job_settings`.
+    """
+    label_specs = job['label_specs']
+    options = job['options']
+    for i, (image, is_last) in enumerate(conversion._with_last(images)):
+        im = conversion._open_image(image)
+        plan = strip_plan(im, label_specs, options, strip_height) if isinstance(im, Image.Image) else None
+        if plan is None:
+            page, estimate = conversion.prepare_page(qlr, im, label_specs, options, job['compress'], job['throughput'])
+            yield conversion._assemble_page(qlr, job, page, estimate, i == 0, is_last)
+            continue
+        page, estimate = strip_page(qlr, im, plan, options, job['compress'], job['throughput'], strip_height, workers)
+        yield from conversion._assemble_strip_page(qlr, job, page, estimate, i == 0, is_last)
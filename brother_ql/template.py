@@ -0,0 +1,206 @@
+"""
+Labels made from a template: a fixed base image with a few variable fields.
+
+A :py:class:`LabelTemplate` converts and encodes its base image once. For
+every label only the fields are rasterized: they are placed into the
+packed rows of the base and only the rows covered by the regions of the
+fields are encoded again, the encoded rows in between are reused as they are::
+
+    template = LabelTemplate(qlr, '62', 'base.png', {'part': (20, 30, 400, 40), 'qty': (20, 90, 200, 40)})
+    data = template.convert([{'part': 'Part 0815', 'qty': '10'}, {'part': 'Part 4711', 'qty': '5'}])
+
+The regions are rectangles (x, y, width, height) in dots on the printable area
+of the page, i.e. in the coordinates of a base image that has the printable
+size of the label. A field can be given as
+
+* a string, drawn in black with the font of the template (and binarized like an image),
+* a PIL image, binarized with the threshold of the template (mode "1" images are used as they are),
+* a :py:class:`brother_ql.encoder.PackedBitmap` (a set bit is a printed dot).
+
+It is placed at the top left corner of its region and cut off at the region's
+borders. The region is cleared before, fields not given show the base image.
+"""
+
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+from brother_ql import conversion
+from brother_ql.cache import CachedPage
+from brother_ql.encoder import PackedBitmap, encode_frames, image_to_frame, mirror_frame, place_frame
+
+#: The number of rasterized text fields kept per template (labels often share values).
+TEXT_FIELD_CACHE_SIZE = 256
+
+
+class LabelTemplate(object):
+    """
+    A label with a fixed base image and variable fields.
+
+    :param BrotherQLRaster qlr: The raster instance of the jobs.
+    :param str label: The label identifier.
+    :param base: The base image: a PIL image, the filename of an image or a file handle.
+    :param dict regions: The regions of the fields, mapping their names to
+        rectangles (x, y, width, height) on the printable area.
+    :param font: The PIL font for fields given as strings. Defaults to PIL's default font.
+    :param kwargs: The conversion options of :py:func:`brother_ql.conversion.convert`.
+        Two-color printing and 600 dpi are not supported.
+    """
+
+    def __init__(self, qlr, label, base, regions, font=None, **kwargs):
+        if kwargs.get('red', False) or kwargs.get('dpi_600', False):
+            raise ValueError("Templates support black and white printing at 300 dpi only.")
+        self.qlr = qlr
+        self.label = label
+        self.font = font if font is not None else ImageFont.load_default()
+        self.job = job = conversion._job_settings(qlr, label, **kwargs)
+        options = job['options']
+        self._lut = [0 if 255 - l >= options['threshold'] else 255 for l in range(256)]
+        self._text_fields = OrderedDict()
+        im = base if isinstance(base, Image.Image) else Image.open(base)
+        plan = conversion.plan_geometry(im.size, job['label_specs'], options)
+        if plan is None:
+            raise ValueError("Templates can only be rotated by multiples of 90 degrees.")
+        im, _, _ = conversion.preprocess_image(im, job['label_specs'], qlr, options)
+        self.size = plan.size
+        self.offset = plan.offset if plan.canvas_size is not None else 0
+        self.device_pixel_width = options['device_pixel_width']
+        self.row_len = self.device_pixel_width // 8
+        self.frame = image_to_frame(im)
+        self.regions = {}
+        for name, (x, y, width, height) in regions.items():
+            if x < 0 or y < 0 or width <= 0 or height <= 0 or x + width > self.size[0] or y + height > self.size[1]:
+                raise ValueError("The region %s %s is outside of the page (%dx%d dots)." % (name, (x, y, width, height), *self.size))
+            self.regions[name] = (x, y, width, height)
+
+        compress = job['compress']
+        if not qlr.compression_support:
+            compress = False
+        elif compress == 'auto':
+            compress, _ = conversion._choose_compression(qlr, [self.frame], job['throughput'])
+        self.compress = bool(compress)
+        self._segments = [(start, end, None if dynamic else self._encode(self.frame[start*self.row_len:end*self.row_len]))
+                          for start, end, dynamic in self._split_rows()]
+
+    def _split_rows(self):
+        """
+        :returns: The rows of the page as (start, end, dynamic) ranges, dynamic being
+            True for the ranges covered by regions.
+        """
+        spans = sorted((y, y + height) for x, y, width, height in self.regions.values())
+        merged = []
+        for start, end in spans:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        ranges = []
+        position = 0
+        for start, end in merged:
+            if start > position:
+                ranges.append((position, start, False))
+            ranges.append((start, end, True))
+            position = end
+        if position < self.size[1]:
+            ranges.append((position, self.size[1], False))
+        return ranges
+
+    def _encode(self, frame):
+        qlr = self.qlr
+        zero_raster = qlr.zero_raster_support and qlr.zero_raster_enabled
+        return encode_frames([mirror_frame(frame, self.row_len)], self.row_len, ptouch=qlr.model.startswith('PT'),
+                             compress=self.compress, zero_raster=zero_raster, cache=qlr.row_cache)
+
+    def _field_bits(self, value, size):
+        """
+        :returns: A tuple (data, width, height, invert) with the packed bits of a field.
+        """
+        if isinstance(value, PackedBitmap):
+            width, height = value.size
+            if len(value.data) != (width + 7) // 8 * height:
+                raise ValueError("Bad bitmap data: %d bytes for a size of %s." % (len(value.data), tuple(value.size)))
+            return value.data, width, height, False
+        if isinstance(value, str):
+            key = (value, size)
+            bits = self._text_fields.get(key)
+            if bits is None:
+                im = Image.new('L', size, 255)
+                ImageDraw.Draw(im).text((0, 0), value, fill=0, font=self.font)
+                bits = self._text_fields[key] = self._binarize(im)
+                if len(self._text_fields) > TEXT_FIELD_CACHE_SIZE:
+                    self._text_fields.popitem(last=False)
+            else:
+                self._text_fields.move_to_end(key)
+            return bits
+        if isinstance(value, Image.Image):
+            im = value
+            if im.size[0] > size[0] or im.size[1] > size[1]:
+                im = im.crop((0, 0, min(im.size[0], size[0]), min(im.size[1], size[1])))
+            return self._binarize(im)
+        raise TypeError("A field needs to be a string, an Image() instance or a PackedBitmap, not %r." % type(value))
+
+    def _binarize(self, im):
+        if im.mode != '1':
+            im = im.convert('L').point(self._lut, '1')
+        return im.tobytes(), im.size[0], im.size[1], True
+
+    def render(self, **fields):
+        """
+        Create the raster data of a label.
+
+        :param fields: The values of the fields, by name.
+        :returns: The raster data of the page (:py:class:`brother_ql.cache.CachedPage`).
+        """
+        unknown = set(fields) - set(self.regions)
+        if unknown:
+            raise ValueError("Unknown fields: %s" % ', '.join(sorted(unknown)))
+        row_len = self.row_len
+        clip = (1 << self.device_pixel_width) - 1
+        parts = []
+        for start, end, encoded in self._segments:
+            if encoded is not None:
+                parts.append(encoded)
+                continue
+            rows = bytearray(self.frame[start*row_len:end*row_len])
+            for name, value in fields.items():
+                x, y, width, height = self.regions[name]
+                if y >= end or y + height <= start:
+                    continue
+                data, field_width, field_height, invert = self._field_bits(value, (width, height))
+                placed = place_frame(data, field_width, self.device_pixel_width, self.offset + x, invert=invert)
+                # The bits of the region are cleared and replaced by the bits of the field within the region
+                field_mask = ((1 << width) - 1) << (self.device_pixel_width - self.offset - x - width)
+                keep = clip ^ field_mask
+                for i in range(height):
+                    position = (y - start + i) * row_len
+                    value_row = int.from_bytes(rows[position:position+row_len], 'big') & keep
+                    if i < field_height:
+                        value_row |= int.from_bytes(placed[i*row_len:(i+1)*row_len], 'big') & field_mask
+                    rows[position:position+row_len] = value_row.to_bytes(row_len, 'big')
+            parts.append(self._encode(bytes(rows)))
+        return CachedPage(self.size[1], self.compress, b''.join(parts))
+
+    def iter_convert(self, records, preamble=True):
+        """
+        :param records: An iterable of dicts with the values of the fields, one per label.
+        :returns: A generator of the instructions (bytes) like :py:func:`brother_ql.conversion.iter_convert`.
+        """
+        qlr = self.qlr
+        # add_print_page() leaves the last page of a previous job in the buffer
+        qlr.clear()
+        qlr.add_invalidate()
+        qlr.add_initialize()
+        setup_data = qlr.data
+        qlr.clear()
+        qlr.compression_decisions = []
+        if preamble:
+            yield setup_data
+        pages = (self.render(**record) for record in records)
+        for i, (page, is_last) in enumerate(conversion._with_last(pages)):
+            yield conversion._assemble_page(qlr, self.job, page, None, i == 0, is_last)
+
+    def convert(self, records):
+        """
+        :returns: The instructions for the labels (bytes), see :py:meth:`iter_convert`.
+        """
+        return b''.join(self.iter_convert(records))
@@ -39,7 +39,6 @@ setup(name='brother_ql',
       platforms = 'any',
       install_requires = [
           "click",
-          "packbits",
           "pillow>=10.0.0",
           "pyusb",
           'attrs',
@@ -47,6 +46,8 @@ setup(name='brother_ql',
           'enum34;python_version<"3.4"',
       ],
       extras_require = {
+          'fast': ["numpy",],
+          'render': ["qrcode",],
           #'brother_ql_analyse':  ["matplotlib",],
           #'brother_ql_create' :  ["matplotlib",],
       },
@@ -0,0 +1,102 @@
+from PIL import Image, ImageDraw
+
+from brother_ql.backends import BrotherQLBackendGeneric, helpers
+from brother_ql.conversion import iter_convert
+from brother_ql.print_queue import BrotherPrintQueue
+from brother_ql.raster import BrotherQLRaster
+
+
+def status_response(status_type=0x00, phase_type=0x00):
+    data = bytearray(32)
+    data[0:5] = b'\x80\x20\x42\x34\x37'
+    data[10], data[11], data[18], data[19] = 62, 0x0A, status_type, phase_type
+    return bytes(data)
+
+
+class FakeBackend(BrotherQLBackendGeneric):
+    """ Records the writes and answers with the queued status responses. """
+
+    def __init__(self, device_specifier=None, responses=()):
+        self.writes = []
+        self.responses = list(responses)
+
+    def _write(self, data):
+        self.writes.append(bytes(data))
+
+    def _read(self, length=32):
+        return self.responses.pop(0) if self.responses else b''
+
+    def _dispose(self):
+        pass
+
+
+def label(text, size=(696, 100)):
+    im = Image.new('RGB', size, 'white')
+    ImageDraw.Draw(im).text((20, 40), text, fill='black')
+    return im
+
+
+def test_write_chunks_coalesces_into_blocks():
+    printer = FakeBackend()
+    printer.write_block_size = 100
+    big = bytes(range(256))
+    assert printer.write_chunks([b'a' * 30, b'b' * 30, b'c' * 50, big, b'd' * 10]) == 376
+    assert printer.writes == [b'a' * 30 + b'b' * 30, b'c' * 50, big, b'd' * 10]
+    qlr = BrotherQLRaster('QL-720NW')
+    qlr.add_invalidate()
+    qlr.add_initialize()
+    qlr.add_status_information()
+    printer = FakeBackend()
+    printer.write_chunks(qlr.iter_chunks())
+    assert printer.writes == [qlr.data]
+
+
+def test_send_writes_coalesced_chunks(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    printers = []
+
+    def backend_class(identifier):
+        printers.append(FakeBackend(identifier))
+        return printers[-1]
+
+    monkeypatch.setattr(helpers, 'backend_factory', lambda name: {'list_available_devices': list, 'backend_class': backend_class})
+    instructions = list(iter_convert(BrotherQLRaster('QL-720NW'), [label('first'), label('second')], '62'))
+    status = helpers.send(iter(instructions), 'file:///dev/null', 'linux_kernel', blocking=False)
+    assert status['outcome'] == 'sent'
+    assert b''.join(printers[0].writes) == b''.join(instructions)
+    assert len(printers[0].writes) < len(instructions)
+
+
+def test_send_waits_for_the_status_after_sending(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    clock = [0.0]
+    monkeypatch.setattr(helpers.time, 'time', lambda: clock[0])
+    responses = [status_response(0x01, 0x01), status_response(0x06, 0x00)]
+    monkeypatch.setattr(helpers, 'backend_factory', lambda name: {'list_available_devices': list,
+                                                                  'backend_class': lambda identifier: FakeBackend(identifier, responses)})
+    instructions = list(iter_convert(BrotherQLRaster('QL-720NW'), [label('first'), label('second')], '62'))
+
+    def slowly_created():
+        for chunk in instructions:
+            clock[0] += 8
+            yield chunk
+
+    status = helpers.send(slowly_created(), 'file:///dev/null', 'linux_kernel')
+    assert status['did_print'] and status['ready_for_next_job']
+    # Only instructions given as bytes are written to the debug file
+    assert not (tmp_path / 'debug_printer_command.bin').exists()
+    helpers.send(b''.join(instructions), 'file:///dev/null', 'linux_kernel', blocking=False)
+    assert (tmp_path / 'debug_printer_command.bin').read_bytes() == b''.join(instructions)
+
+
+def test_print_queue_writes_chunks():
+    printer = FakeBackend(responses=[status_response()])
+    queue = BrotherPrintQueue(printer, BrotherQLRaster('QL-720NW'))
+    assert queue.ready
+    assert printer.writes == [b'\x00' * 200, b'\x1b\x40', b'\x1b\x69\x53']
+    pages = list(iter_convert(BrotherQLRaster('QL-720NW'), [label('first')], '62', preamble=False))
+    queue.queue_pages(pages)
+    # Printing started, printing completed, waiting to receive, the reply to the final status request
+    printer.responses += [status_response(0x06, 0x01), status_response(0x01, 0x01), status_response(0x06, 0x00), status_response()]
+    assert queue.submit()
+    assert printer.writes[3:] == pages + [b'\x1b\x69\x53']
@@ -0,0 +1,81 @@
+import os
+
+from PIL import Image, ImageDraw
+
+from brother_ql.cache import CachedPage, DiskPageCache, PageCache, image_digest
+from brother_ql.conversion import convert
+from brother_ql.raster import BrotherQLRaster
+
+
+def label_image(text="Part 0815"):
+    im = Image.new('RGB', (700, 200), 'white')
+    draw = ImageDraw.Draw(im)
+    draw.rectangle((20, 20, 300, 80), fill='black')
+    draw.text((20, 120), text, fill='black')
+    return im
+
+
+def test_cached_pages_are_identical():
+    images = [label_image("a"), label_image("b"), label_image("a")]
+    expected = convert(BrotherQLRaster('QL-720NW'), images, '62', compress=True)
+    cache = PageCache()
+    first = convert(BrotherQLRaster('QL-720NW'), images, '62', compress=True, page_cache=cache)
+    # The third page has the same content as the first one
+    assert cache.info() == (1, 2, 128, 2)
+    images = [label_image("a"), label_image("b"), label_image("a")]
+    second = convert(BrotherQLRaster('QL-720NW'), images, '62', compress=True, page_cache=cache)
+    assert first == second == expected
+    assert cache.info().hits == 4
+
+
+def test_options_are_part_of_the_key():
+    cache = PageCache()
+    convert(BrotherQLRaster('QL-720NW'), [label_image()], '62', page_cache=cache)
+    convert(BrotherQLRaster('QL-720NW'), [label_image()], '62', threshold=40, page_cache=cache)
+    convert(BrotherQLRaster('QL-720NW'), [label_image()], '62', compress=True, page_cache=cache)
+    assert cache.info().hits == 0
+    assert len(cache) == 3
+
+
+def test_disk_tier(tmp_path):
+    image = tmp_path / 'label.png'
+    label_image().save(str(image))
+    directory = str(tmp_path / 'cache')
+    first = convert(BrotherQLRaster('QL-720NW'), [str(image)], '62', copies=2,
+                    page_cache=PageCache(disk=DiskPageCache(directory)))
+    # A new process only shares the disk tier
+    cache = PageCache(disk=DiskPageCache(directory))
+    second = convert(BrotherQLRaster('QL-720NW'), [str(image)], '62', copies=2, page_cache=cache)
+    assert first == second
+    # The copy reuses the first page without a lookup
+    assert cache.disk.info().hits == 1
+    assert cache.info().hits == 1
+    assert [name for name in os.listdir(directory) if not name.endswith('.page')] == []
+
+
+def test_disk_tier_size_limit(tmp_path):
+    disk = DiskPageCache(str(tmp_path), max_bytes=2500)
+    for i in range(5):
+        disk.put('page{}'.format(i), CachedPage(10, False, bytes(1000)))
+        os.utime(str(tmp_path / 'page{}.page'.format(i)), (i, i))
+    assert disk.info().currsize <= 2500
+    assert disk.get('page4') == CachedPage(10, False, bytes(1000))
+    assert disk.get('page0') is None
+
+
+def test_unloaded_images_are_hashed_from_their_source(tmp_path):
+    path = str(tmp_path / 'label.jpg')
+    label_image().resize((2800, 800)).save(path)
+    expected = convert(BrotherQLRaster('QL-720NW'), [path], '62', resample='fast')
+    cache = PageCache()
+    im = Image.open(path)
+    assert image_digest(im)[0] == image_digest(Image.open(path))[0]
+    assert im.size == (2800, 800) and im.tile
+    assert convert(BrotherQLRaster('QL-720NW'), [im], '62', resample='fast', page_cache=cache) == expected
+    # The JPEG was still decoded at a reduced size
+    assert im.size[0] < 2800
+    assert convert(BrotherQLRaster('QL-720NW'), [Image.open(path)], '62', resample='fast', page_cache=cache) == expected
+    assert cache.info().hits == 1
+    loaded = Image.open(path)
+    loaded.load()
+    assert image_digest(loaded)[0] != image_digest(Image.open(path))[0]
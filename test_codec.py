@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+from brother_ql import codec
+
+
+SAMPLES = [
+    b'',
+    b'\x00',
+    b'\x00' * 90,
+    b'\xff' * 129,
+    b'\x01\x02\x03',
+    b'\x01\x01\x02\x02\x03\x03',
+    bytes(range(256)),
+    b'\x00' * 40 + bytes(range(200)) + b'\xaa' * 300 + b'\x01',
+]
+
+
+@pytest.mark.parametrize('data', SAMPLES)
+def test_roundtrip(data):
+    assert codec.decode(codec.encode(data)) == data
+
+
+def test_roundtrip_random_rows():
+    rnd = random.Random(4)
+    for i in range(200):
+        row = bytes(rnd.choice((0, 0, 0, 0xff, rnd.randrange(256))) for j in range(162))
+        assert codec.decode(codec.encode(row)) == row
+
+
+def test_encoding():
+    assert codec.encode(b'\x00' * 90) == b'\xa7\x00'
+    assert codec.encode(b'\x01\x02\x03') == b'\x02\x01\x02\x03'
+    assert codec.encode(b'\xff' * 129) == b'\x81\xff\x00\xff'
+    assert codec.decode(b'\x80\x00\x05') == b'\x05'
+
+
+def test_compatible_with_packbits_module():
+    packbits = pytest.importorskip('packbits')
+    for data in SAMPLES:
+        assert packbits.decode(codec.encode(data)) == data
+        assert codec.decode(packbits.encode(data)) == data
@@ -0,0 +1,194 @@
+import io
+import struct
+
+import pytest
+from PIL import Image, ImageDraw
+
+from brother_ql import conversion
+from brother_ql.conversion import _job_settings, _packed_frame, convert, convert_many, draft_image, encode_page, iter_convert, prepare_page, preprocess_image
+from brother_ql.encoder import PackedBitmap
+from brother_ql.raster import BrotherQLRaster
+
+
+def label_image(size=(700, 200)):
+    im = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(im)
+    draw.rectangle((20, 20, 300, 80), fill='black')
+    draw.text((20, 120), "Part 0815 - 10k resistor", fill='black')
+    return im
+
+
+def test_auto_compression_depends_on_throughput():
+    slow = BrotherQLRaster('QL-720NW')
+    slow_data = convert(slow, [label_image()], '62', compress='auto', backend='network')
+    fast = BrotherQLRaster('QL-720NW')
+    fast_data = convert(fast, [label_image()], '62', compress='auto', throughput=1e12)
+    assert [d['compress'] for d in slow.compression_decisions] == [True]
+    assert [d['compress'] for d in fast.compression_decisions] == [False]
+    decision = slow.compression_decisions[0]
+    assert decision['throughput'] == 150000
+    assert 0 < decision['estimated_ratio'] < 0.5
+    assert abs(decision['achieved_ratio'] - decision['estimated_ratio']) < 0.1
+    assert len(slow_data) < len(fast_data)
+
+
+def test_parallel_rasterization_is_identical(tmp_path):
+    path = tmp_path / 'label.png'
+    label_image((650, 180)).save(str(path))
+    with open(str(path), 'rb') as handle:
+        images = [label_image(), str(path), label_image((700, 300)).convert('P'), handle]
+        expected = convert(BrotherQLRaster('QL-720NW'), images, '62', compress=True)
+        handle.seek(0)
+        assert convert(BrotherQLRaster('QL-720NW'), images, '62', compress=True, workers=2) == expected
+    copies = convert(BrotherQLRaster('QL-720NW'), [label_image()], '62', copies=3, workers=2)
+    assert copies == convert(BrotherQLRaster('QL-720NW'), [label_image()], '62', copies=3)
+
+
+def test_iter_convert_is_lazy():
+    consumed = []
+    def images():
+        for i in range(3):
+            consumed.append(i)
+            yield label_image()
+    chunks = iter_convert(BrotherQLRaster('QL-720NW'), images(), '62')
+    preamble = next(chunks)
+    assert consumed == []
+    first_page = next(chunks)
+    # One image ahead to know whether the page is the last one
+    assert consumed == [0, 1]
+    rest = list(chunks)
+    assert len(rest) == 2
+    expected = convert(BrotherQLRaster('QL-720NW'), [label_image() for i in range(3)], '62')
+    assert b''.join([preamble, first_page] + rest) == expected
+    assert first_page.endswith(b'\x0c') and rest[-1].endswith(b'\x1a')
+
+
+def large_photo():
+    im = Image.new('RGBA', (2800, 1200), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(im)
+    for x in range(0, 2800, 120):
+        draw.rectangle((x, 100, x + 60, 1100), fill=(0, 0, 0, 255))
+    return im
+
+
+@pytest.mark.parametrize('resample', ['balanced', 'fast'])
+@pytest.mark.parametrize('fmt', ['PNG', 'JPEG'])
+def test_shrink_first_resampling(resample, fmt):
+    buf = io.BytesIO()
+    large_photo().convert('RGB').save(buf, fmt)
+    reference = convert(BrotherQLRaster('QL-720NW'), [io.BytesIO(buf.getvalue())], '62', rotate='90')
+    data = convert(BrotherQLRaster('QL-720NW'), [io.BytesIO(buf.getvalue())], '62', rotate='90', resample=resample)
+    assert len(data) == len(reference)
+    differences = sum(bin(a ^ b).count('1') for a, b in zip(data, reference))
+    assert differences < len(data) * 8 * 0.01
+
+
+def test_draft_decodes_jpeg_near_target_size():
+    buf = io.BytesIO()
+    large_photo().convert('RGB').save(buf, 'JPEG')
+    im = Image.open(io.BytesIO(buf.getvalue()))
+    job = _job_settings(BrotherQLRaster('QL-720NW'), '62', resample='fast')
+    draft_image(im, job['label_specs'], job['options'])
+    assert im.mode == 'L'
+    assert 696 <= im.size[0] < 1400
+
+
+def test_resample_modes_at_printable_width():
+    # An image with the printable width is only padded to the device width
+    image = label_image((696, 200))
+    for resample in ('balanced', 'fast'):
+        data = convert(BrotherQLRaster('QL-720NW'), [image], '62', resample=resample)
+        media = data.index(b'\x1b\x69\x7a')
+        assert struct.unpack('<L', data[media+7:media+11]) == (200,)
+    with pytest.raises(ValueError):
+        convert(BrotherQLRaster('QL-720NW'), [image], '62', resample='nearest')
+
+
+def binary_image(size):
+    im = Image.new('1', size, 1)
+    draw = ImageDraw.Draw(im)
+    draw.rectangle((3, 5, size[0] // 2, size[1] // 3), fill=0)
+    draw.text((11, size[1] // 2), "Part 0815", fill=0)
+    return im
+
+
+@pytest.mark.parametrize('model, label, size', [
+    ('QL-720NW', '62', (696, 120)),
+    ('QL-720NW', '62x29', (696, 271)),
+    ('QL-1100', '102', (1164, 80)),
+    ('PT-P750W', '12', (106, 90)),
+])
+def test_binary_input_skips_preprocessing(model, label, size):
+    image = binary_image(size)
+    qlr = BrotherQLRaster(model)
+    job = _job_settings(qlr, label, compress=True)
+    frame = _packed_frame(image, job['label_specs'], job['options'])
+    assert frame is not None
+    im, black_im, red_im = preprocess_image(image, job['label_specs'], qlr, job['options'])
+    expected = encode_page(qlr, im, black_im, red_im, False, True)
+    assert prepare_page(qlr, image, job['label_specs'], job['options'], True) == expected
+    # The same page given as packed bits (a set bit is printed)
+    bitmap = PackedBitmap(memoryview(bytearray(image.tobytes())), size)
+    bitmap = PackedBitmap(memoryview(bytes(b ^ 0xFF for b in bitmap.data)), size)
+    assert prepare_page(qlr, bitmap, job['label_specs'], job['options'], True) == expected
+
+
+def test_packed_bitmap_jobs():
+    image = binary_image((696, 120))
+    bitmap = PackedBitmap(bytes(b ^ 0xFF for b in image.tobytes()), image.size)
+    expected = convert(BrotherQLRaster('QL-720NW'), [image, image.rotate(180)], '62', compress=True)
+    images = [bitmap, PackedBitmap(bytes(b ^ 0xFF for b in image.rotate(180).tobytes()), image.size)]
+    assert convert(BrotherQLRaster('QL-720NW'), images, '62', compress=True) == expected
+    assert convert(BrotherQLRaster('QL-720NW'), images, '62', compress=True, workers=2) == expected
+    # Bitmaps needing a transformation go through the image path
+    image = binary_image((271, 696))
+    bitmap = PackedBitmap(bytes(b ^ 0xFF for b in image.tobytes()), image.size)
+    assert convert(BrotherQLRaster('QL-720NW'), [bitmap], '62x29') == convert(BrotherQLRaster('QL-720NW'), [image], '62x29')
+    with pytest.raises(ValueError):
+        convert(BrotherQLRaster('QL-720NW'), [PackedBitmap(b'\x00' * 10, (696, 120))], '62')
+
+
+def test_ordered_dithering_is_local():
+    # Changing a part of a photo only changes the rows of that part (error diffusion changes the rows below as well)
+    photo = large_photo().convert('L').resize((696, 300)).convert('RGB')
+    changed = photo.copy()
+    ImageDraw.Draw(changed).rectangle((100, 200, 300, 260), fill=(90, 90, 90))
+    for dither, local in (('bayer8', True), ('blue-noise', True), (True, False)):
+        rows = []
+        for im in (photo, changed):
+            job = _job_settings(BrotherQLRaster('QL-720NW'), '62', dither=dither)
+            im, _, _ = preprocess_image(im, job['label_specs'], None, job['options'])
+            rows.append(im.tobytes())
+        assert (rows[0][:200 * 90] == rows[1][:200 * 90]) and (rows[0][261 * 90:] == rows[1][261 * 90:]) == local
+    with pytest.raises(ValueError):
+        convert(BrotherQLRaster('QL-720NW'), [photo], '62', dither='ordered')
+
+
+@pytest.mark.parametrize('fmt, size, resample', [('PNG', (1888, 3004), 'lanczos'), ('PNG', (1888, 3004), 'fast'),
+                                                   ('JPEG', (3776, 6008), 'fast'), ('JPEG', (3776, 6008), 'balanced')])
+def test_convert_many_matches_convert(tmp_path, fmt, size, resample):
+    path = str(tmp_path / ('asset.' + fmt.lower()))
+    im = large_photo().resize(size)
+    (im if fmt == 'PNG' else im.convert('RGB')).save(path, fmt)
+    targets = [('QL-820NWB', '62', dict(resample=resample)), ('TD-4420DN', 'td62x100_203dpi', dict(resample=resample)),
+               ('QL-820NWB', '62', dict(resample=resample, threshold=40, compress=True)), ('QL-820NWB', '62', dict(resample=resample, red=True)),
+               (BrotherQLRaster('QL-720NW'), '62', dict(resample=resample, dither='bayer8', copies=2))]
+    expected = []
+    for model, label, options in targets:
+        model = model.model if isinstance(model, BrotherQLRaster) else model
+        expected.append(convert(BrotherQLRaster(model), [path], label, **options))
+    assert convert_many(path, targets) == expected
+    if fmt == 'JPEG':
+        # Targets needing another draft size open the image again
+        assert convert_many(Image.open(path), targets) == expected
+        with open(path, 'rb') as handle:
+            assert convert_many(handle, targets) == expected
+
+
+def test_convert_many_shares_stages(monkeypatch):
+    calls = []
+    original = conversion.binarize_image
+    monkeypatch.setattr(conversion, 'binarize_image', lambda im, options: calls.append(options['threshold']) or original(im, options))
+    convert_many(label_image((1392, 400)), [('QL-720NW', '62'), ('QL-820NWB', '62'), ('QL-720NW', '62', dict(threshold=40))])
+    # The two printers with the same geometry and threshold share the binarized image
+    assert len(calls) == 2
@@ -0,0 +1,51 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from brother_ql.conversion import _job_settings, convert, encode_page, prepare_page, preprocess_image
+from brother_ql.geometry import PagePlan, geometry_plan, paste_on_canvas
+from brother_ql.raster import BrotherQLRaster
+
+
+def test_endless_plan():
+    geometry = geometry_plan('QL-720NW', '62')
+    assert geometry is geometry_plan('QL-720NW', '62')
+    assert geometry.page((1392, 400)) == PagePlan(0, (696, 200), (696, 200), 12, (720, 200))
+    assert geometry_plan('QL-720NW', '62', 90).page((400, 1392)) == PagePlan(90, (200, 696), (696, 200), 12, (720, 200))
+    assert geometry_plan('QL-720NW', '62', 45).page((400, 1392)) is None
+
+
+def test_die_cut_plan():
+    geometry = geometry_plan('QL-720NW', '62x29')
+    assert geometry.page((696, 271)).angle == 0
+    assert geometry.page((271, 696)) == PagePlan(270, (271, 696), (696, 271), 12, (720, 271))
+    with pytest.raises(ValueError):
+        geometry.page((4000, 3000))
+
+
+def test_canvas_reuse_keeps_margins_white():
+    first = paste_on_canvas(Image.new('L', (10, 4), 0), (16, 4), 2, reuse=True)
+    second = paste_on_canvas(Image.new('L', (10, 4), 128), (16, 4), 2, reuse=True)
+    assert first is second
+    assert second.crop((0, 0, 2, 4)).tobytes() == b'\xff' * 8
+    assert second.crop((2, 0, 12, 4)).tobytes() == b'\x80' * 40
+    assert paste_on_canvas(Image.new('L', (10, 4), 0), (16, 4), 2) is not second
+
+
+def page(text, size=(696, 200)):
+    im = Image.new('RGB', size, 'white')
+    ImageDraw.Draw(im).text((20, 80), text, fill='black')
+    return im
+
+
+def test_pages_sharing_a_canvas():
+    qlr = BrotherQLRaster('QL-720NW')
+    job = _job_settings(qlr, '62')
+    for text in ('first', 'second', 'third'):
+        im, black_im, red_im = preprocess_image(page(text), job['label_specs'], qlr, job['options'])
+        expected, _ = encode_page(qlr, im, black_im, red_im, False, False)
+        assert prepare_page(qlr, page(text), job['label_specs'], job['options'], False) == (expected, None)
+
+
+def test_endless_image_at_printable_width_is_padded():
+    image = page('printable width')
+    assert convert(BrotherQLRaster('QL-720NW'), [image], '62') == convert(BrotherQLRaster('QL-720NW'), [image], '62', resample='balanced')
@@ -0,0 +1,93 @@
+import random
+
+import PIL.ImageChops
+import PIL.ImageOps
+import pytest
+from PIL import Image
+
+from brother_ql.image_trafos import BLUE_NOISE_16, ColorCutoffs, bayer_matrix, filtered_hsv, ordered_dither, separate_colors
+
+
+def pixels(im):
+    data = im.convert('L').tobytes() if im.mode == '1' else im.tobytes()
+    bands = len(im.getbands())
+    return list(data) if bands == 1 else [tuple(data[i:i+bands]) for i in range(0, len(data), bands)]
+
+
+def reference_separation(im, threshold):
+    # The per-pixel implementation separate_colors() replaced
+    def filtered(filter_h, filter_s, filter_v):
+        hsv = im.convert('HSV').split()
+        masks = [band.point(f) for band, f in zip(hsv, (filter_h, filter_s, filter_v))]
+        mask = masks[0]
+        mask.putdata([255 if (h and s and v) else 0 for h, s, v in zip(*(pixels(m) for m in masks))])
+        filtered_im = Image.new("RGB", im.size, color=(255, 255, 255))
+        filtered_im.paste(im, None, mask)
+        layer = PIL.ImageOps.invert(filtered_im.convert("L"))
+        return layer.point(lambda x: 0 if x < threshold else 255, mode="1")
+    red_im = filtered(lambda h: 255 if (h < 40 or h > 210) else 0, lambda s: 255 if s > 100 else 0, lambda v: 255 if v > 80 else 0)
+    black_im = filtered(lambda h: 255, lambda s: 255, lambda v: 255 if v < 80 else 0)
+    return PIL.ImageChops.subtract(black_im, red_im), red_im
+
+
+def random_image(size=(97, 61), seed=0):
+    rng = random.Random(seed)
+    im = Image.new('RGB', size)
+    im.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(size[0] * size[1])])
+    return im
+
+
+@pytest.mark.parametrize('threshold', [0, 1, 76, 178, 255])
+def test_separate_colors_matches_reference(threshold):
+    im = random_image()
+    black_im, red_im = separate_colors(im, threshold)
+    expected_black, expected_red = reference_separation(im, threshold)
+    assert red_im.mode == black_im.mode == '1'
+    assert red_im.tobytes() == expected_red.tobytes()
+    assert black_im.tobytes() == expected_black.tobytes()
+
+
+def test_separate_colors_cutoffs():
+    im = Image.new('RGB', (2, 1))
+    im.putdata([(200, 60, 60), (60, 60, 60)])
+    black_im, red_im = separate_colors(im, 1)
+    assert pixels(red_im) == [255, 0]
+    assert pixels(black_im) == [0, 255]
+    # Everything with a value below 230 is black, nothing is red
+    cutoffs = ColorCutoffs(red_hue=(0, 255), red_saturation=255, red_value=255, black_value=230)
+    black_im, red_im = separate_colors(im, 1, cutoffs)
+    assert pixels(red_im) == [0, 0]
+    assert pixels(black_im) == [255, 255]
+
+
+def test_filtered_hsv():
+    im = random_image(seed=1)
+    result = filtered_hsv(im, lambda h: 255 if h < 40 else 0, lambda s: 7 if s > 100 else 0, lambda v: 255)
+    hsv = im.convert('HSV')
+    expected = [p if (h < 40 and s > 100) else (255, 255, 255) for p, (h, s, v) in zip(pixels(im), pixels(hsv))]
+    assert pixels(result) == expected
+
+
+def test_dither_matrices():
+    assert bayer_matrix(4) == [0, 8, 2, 10, 12, 4, 14, 6, 3, 11, 1, 9, 15, 7, 13, 5]
+    assert sorted(bayer_matrix(8)) == list(range(64))
+    assert sorted(BLUE_NOISE_16) == list(range(256))
+
+
+@pytest.mark.parametrize('mode, n, ranks', [('bayer4', 4, bayer_matrix(4)), ('bayer8', 8, bayer_matrix(8)), ('blue-noise', 16, list(BLUE_NOISE_16))])
+def test_ordered_dither_matches_reference(mode, n, ranks):
+    im = random_image(seed=2).convert('L')
+    result = ordered_dither(im, mode)
+    width = im.size[0]
+    expected = [255 if value > (2 * ranks[(i // width % n) * n + i % width % n] + 1) * 255 // (2 * n * n) else 0 for i, value in enumerate(pixels(im))]
+    assert result.mode == '1'
+    assert pixels(result) == expected
+
+
+@pytest.mark.parametrize('mode', ['bayer4', 'bayer8', 'blue-noise'])
+def test_ordered_dither_levels(mode):
+    # No ink is never printed, full ink always, and the density follows the ink
+    assert pixels(ordered_dither(Image.new('L', (32, 32), 0), mode)) == [0] * 1024
+    assert pixels(ordered_dither(Image.new('L', (32, 32), 255), mode)) == [255] * 1024
+    printed = pixels(ordered_dither(Image.new('L', (32, 32), 64), mode)).count(255)
+    assert 1024 * 0.2 < printed < 1024 * 0.3
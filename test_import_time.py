@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+from bench_import import BUDGETS, HEAVY, best_of
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_no_heavy_imports(module):
+    total, times, modules = best_of(module, 1)
+    assert [name for name in HEAVY if name in modules] == []
+
+
+def test_package_does_not_import_cli_dependencies():
+    total, times, modules = best_of('brother_ql', 1)
+    assert 'click' not in modules
+    assert 'attr' not in modules
+
+
+def test_lazy_attributes():
+    code = "import brother_ql; print(brother_ql.BrotherQLRaster.__module__, brother_ql.create_label.__module__)"
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    assert out.split() == ['brother_ql.raster', 'brother_ql.brother_ql_create']
+
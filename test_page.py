@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import attr
+import pytest
+from PIL import Image, ImageDraw
+
+from brother_ql import BrotherQLRasterError
+from brother_ql.conversion import _job_settings, convert, preprocess_image
+from brother_ql.encoder import PackedBitmap, image_to_frame
+from brother_ql.page import MEDIA_ENDLESS, PageSpec, _header_parts, encode_page, header_template, media_and_quality, page_header
+from brother_ql.raster import BrotherQLRaster
+
+
+def render(text, red=False):
+    im = Image.new('RGB', (696, 120), 'white')
+    ImageDraw.Draw(im).text((20, 50), text, fill='red' if red else 'black')
+    return im
+
+
+def bitmaps(qlr, im, red=False):
+    job = _job_settings(qlr, '62', red=red)
+    im, black_im, red_im = preprocess_image(im, job['label_specs'], qlr, job['options'])
+    return [PackedBitmap(image_to_frame(layer), layer.size) for layer in ((black_im, red_im) if red else (im, ))]
+
+
+@pytest.mark.parametrize('model, kwargs', [('QL-720NW', {}), ('QL-820NWB', {'red': True, 'compress': True}), ('QL-720NW', {'cut': False, 'hq': False})])
+def test_encode_page_matches_convert(model, kwargs):
+    qlr = BrotherQLRaster(model)
+    spec = _job_settings(qlr, '62', **kwargs)['spec']
+    im = render('Part 0815', kwargs.get('red', False))
+    expected = convert(BrotherQLRaster(model), [im], '62', **kwargs)
+    qlr.add_invalidate()
+    qlr.add_initialize()
+    assert qlr.data + encode_page(spec, *bitmaps(qlr, im, kwargs.get('red', False))) == expected
+
+
+def test_pages_encoded_concurrently():
+    qlr = BrotherQLRaster('QL-720NW')
+    spec = qlr.page_spec(media_type=MEDIA_ENDLESS, media_width=62, media_length=0, compress=True)
+    pages = [bitmaps(qlr, render('Label %d' % i))[0] for i in range(40)]
+    expected = [encode_page(spec, page, is_first=False, is_last=False) for page in pages]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(lambda page: encode_page(spec, page, is_first=False, is_last=False), pages)) == expected
+
+
+def test_page_spec_is_immutable():
+    spec = PageSpec('QL-720NW')
+    with pytest.raises(attr.exceptions.FrozenInstanceError):
+        spec.compress = True
+    assert attr.evolve(spec, compress=True).compress and not spec.compress
+    assert hash(spec) == hash(PageSpec('QL-720NW'))
+    with pytest.raises(ValueError):
+        PageSpec('QL-1')
+    with pytest.raises(BrotherQLRasterError):
+        encode_page(spec, PackedBitmap(b'\x00' * 87 * 2, (696, 2)))
+
+
+def test_facade_uses_the_page_commands():
+    qlr = BrotherQLRaster('QL-720NW')
+    qlr.add_initialize()
+    qlr.clear()
+    qlr.mtype, qlr.mwidth, qlr.mlength = MEDIA_ENDLESS, 62, 0
+    qlr.add_media_and_quality(120)
+    qlr.add_media_and_quality(120)
+    assert qlr.data == media_and_quality(MEDIA_ENDLESS, 62, 0, True, 120, True) + media_and_quality(MEDIA_ENDLESS, 62, 0, True, 120, False)
+
+
+@pytest.mark.parametrize('model', ['QL-720NW', 'QL-500', 'PT-P750W'])
+def test_header_templates(model):
+    spec = PageSpec(model, media_type=MEDIA_ENDLESS, media_width=12, media_length=0, compress=True)
+    for is_first in (True, False):
+        for is_last in (True, False):
+            expected = b''.join(_header_parts(spec, 0x12345, True, is_first, is_last))
+            assert page_header(spec, 0x12345, True, is_first, is_last) == expected
+            assert header_template(spec, True, is_first, is_last) is header_template(PageSpec(model, media_type=MEDIA_ENDLESS, media_width=12, media_length=0, compress=True), True, is_first, is_last)
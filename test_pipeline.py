@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+from PIL import Image, ImageDraw
+
+from brother_ql.cache import PageCache
+from brother_ql.conversion import convert
+from brother_ql.pipeline import STAGES, PrintPipeline
+from brother_ql.raster import BrotherQLRaster
+
+
+def label_image(i):
+    im = Image.new('RGB', (700, 300), 'white')
+    ImageDraw.Draw(im).text((10, 10 + i), "Label {}".format(i), fill='black')
+    return im
+
+
+@pytest.mark.parametrize('decoders, rasterizers', [(1, 1), (2, 3)])
+def test_pipeline_output_is_identical(decoders, rasterizers):
+    images = [label_image(i) for i in range(7)]
+    expected = convert(BrotherQLRaster('QL-720NW'), images, '62', compress=True)
+    pipeline = PrintPipeline(BrotherQLRaster('QL-720NW'), '62', decoders=decoders, rasterizers=rasterizers, queue_size=2, compress=True)
+    assert b''.join(pipeline.run(iter(images))) == expected
+    stats = pipeline.stats()
+    assert sorted(stats) == sorted(STAGES)
+    assert stats['rasterize'].items == stats['transmit'].items == 7
+    assert stats['rasterize'].max_queue_depth <= 2
+
+
+def test_pipeline_copies_and_page_cache():
+    cache = PageCache()
+    for i in range(2):
+        pipeline = PrintPipeline(BrotherQLRaster('QL-720NW'), '62', copies=3, page_cache=cache)
+        data = b''.join(pipeline.run([label_image(0)]))
+        assert data == convert(BrotherQLRaster('QL-720NW'), [label_image(0)], '62', copies=3)
+    assert pipeline.stats()['rasterize'].items == 0
+    assert cache.info().hits == 1
+
+
+def test_pipeline_errors():
+    pipeline = PrintPipeline(BrotherQLRaster('QL-720NW'), '29x90')
+    with pytest.raises(ValueError):
+        b''.join(pipeline.run([label_image(i) for i in range(5)]))
+    assert threading.active_count() == 1
+
+
+def test_pipeline_bounded():
+    read = []
+    def images():
+        for i in range(20):
+            read.append(i)
+            yield label_image(i)
+    pipeline = PrintPipeline(BrotherQLRaster('QL-720NW'), '62', max_pages_in_flight=3)
+    chunks = pipeline.run(images())
+    next(chunks)
+    next(chunks)
+    assert len(read) <= 4
+    chunks.close()
+    assert threading.active_count() == 1
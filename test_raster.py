@@ -0,0 +1,124 @@
+import pytest
+from PIL import Image
+
+from brother_ql.raster import BrotherQLRaster, CommandBuffer
+
+
+def test_command_buffer_chunks():
+    buf = CommandBuffer()
+    buf.write(b'\x1B\x40')
+    buf.write(bytearray(b'\x1B\x69\x53'))
+    buf.write(b'')
+    assert len(buf) == 5
+    assert list(buf.iter_chunks()) == [b'\x1B\x40', b'\x1B\x69\x53']
+    assert buf.getvalue() == b'\x1B\x40\x1B\x69\x53'
+    assert bytes(buf.getbuffer()) == buf.getvalue()
+    buf.clear()
+    assert buf.getvalue() == b''
+    assert not buf
+
+
+def test_data_property_compatibility():
+    qlr = BrotherQLRaster('QL-720NW')
+    qlr.add_invalidate()
+    qlr.add_initialize()
+    assert qlr.data == b'\x00' * 200 + b'\x1B\x40'
+    assert b''.join(qlr.iter_chunks()) == qlr.data
+    qlr.data = b'\x1A'
+    qlr.add_print(last_page=False)
+    assert qlr.data == b'\x1A\x0C'
+    qlr.clear()
+    assert qlr.data == b''
+
+
+def test_raster_rows():
+    qlr = BrotherQLRaster('QL-720NW')
+    qlr.zero_raster_enabled = False
+    im = Image.new('1', (qlr.get_pixel_width(), 3), 0)
+    im.putpixel((0, 1), 1)
+    qlr.add_raster_data(im)
+    row_len = qlr.get_pixel_width() // 8
+    rows = [qlr.data[i*(row_len+3):(i+1)*(row_len+3)] for i in range(3)]
+    assert rows[0] == b'\x67\x00' + bytes([row_len]) + b'\x00' * row_len
+    # the image is mirrored: the leftmost pixel ends up in the last bit of the row
+    assert rows[1] == b'\x67\x00' + bytes([row_len]) + b'\x00' * (row_len - 1) + b'\x01'
+
+
+def test_mirror_frame_without_numpy(monkeypatch):
+    from brother_ql import encoder
+    frame = bytes(range(256)) * 3
+    expected = Image.frombytes('1', (64, 96), frame).transpose(Image.FLIP_LEFT_RIGHT).tobytes()
+    assert encoder.mirror_frame(frame, 8) == expected
+    monkeypatch.setattr(encoder, 'np', None)
+    assert encoder.mirror_frame(frame, 8) == expected
+
+
+@pytest.mark.parametrize('offset', [0, 12, -7, 30])
+def test_place_frame(monkeypatch, offset):
+    from brother_ql import encoder
+    frame = bytes(range(256))[:13*16]
+    im = Image.frombytes('1', (100, 16), frame)
+    canvas = Image.new('1', (128, 16), 0)
+    canvas.paste(im, (offset, 0))
+    expected = canvas.tobytes()
+    assert encoder.place_frame(frame, 100, 128, offset) == expected
+    inverted = bytes(b ^ 0xFF for b in frame)
+    assert encoder.place_frame(inverted, 100, 128, offset, invert=True) == expected
+    monkeypatch.setattr(encoder, 'np', None)
+    assert encoder.place_frame(memoryview(frame), 100, 128, offset) == expected
+    assert encoder.place_frame(inverted, 100, 128, offset, invert=True) == expected
+
+
+def test_encode_frames_framing(monkeypatch):
+    from brother_ql import encoder
+    black, red = b'\x01\x02' * 2, b'\x00\x00' * 2
+    two_color = b'\x77\x01\x02\x01\x02\x77\x02\x02\x00\x00' * 2
+    ptouch = b'\x47\x02\x00\x01\x02' * 2
+    assert encoder.encode_frames([black, red], 2) == two_color
+    assert encoder.encode_frames([black], 2, ptouch=True) == ptouch
+    monkeypatch.setattr(encoder, 'np', None)
+    assert encoder.encode_frames([black, red], 2) == two_color
+    assert encoder.encode_frames([black], 2, ptouch=True) == ptouch
+
+
+def test_zero_raster_rows():
+    im = Image.new('1', (720, 3), 0)
+    im.putpixel((0, 1), 1)
+    row = b'\x67\x00\x5a' + b'\x00' * 89 + b'\x01'
+    qlr = BrotherQLRaster('QL-700')
+    qlr.add_raster_data(im)
+    assert qlr.data == b'\x5a' + row + b'\x5a'
+    qlr = BrotherQLRaster('QL-500')
+    qlr.add_raster_data(im)
+    assert len(qlr.data) == 3 * 93
+
+
+def test_zero_raster_two_color_compressed():
+    black = Image.new('1', (720, 2), 0)
+    black.putpixel((719, 1), 1)
+    red = Image.new('1', (720, 2), 0)
+    qlr = BrotherQLRaster('QL-820NWB')
+    qlr.add_compression(True)
+    qlr.add_raster_data(black, red)
+    assert qlr.data == b'\x4d\x02' + b'\x5a' + b'\x77\x01\x04\x00\x80\xa8\x00' + b'\x77\x02\x02\xa7\x00'
+
+
+def test_row_cache_shared_between_pages():
+    from brother_ql.encoder import RowCache
+    cache = RowCache(maxsize=16)
+    im = Image.new('1', (720, 4), 0)
+    for x in range(0, 720, 3):
+        im.putpixel((x, 1), 1)
+        im.putpixel((x, 2), 1)
+    outputs = []
+    for i in range(2):
+        qlr = BrotherQLRaster('QL-720NW')
+        qlr.row_cache = cache
+        qlr.add_compression(True)
+        qlr.add_raster_data(im)
+        outputs.append(qlr.data)
+    assert outputs[0] == outputs[1]
+    info = cache.info()
+    assert (info.hits, info.misses, info.currsize) == (3, 1, 1)
+    cache.clear()
+    assert cache.info().currsize == 0
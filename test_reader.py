@@ -0,0 +1,94 @@
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from brother_ql.conversion import _job_settings, convert, preprocess_image
+from brother_ql.encoder import image_to_frame
+from brother_ql.raster import BrotherQLRaster
+from brother_ql.reader import OPCODES, BrotherQLReader, InstructionParser, chunker, iter_instructions, match_opcode
+
+
+def label(text, size=(696, 120)):
+    im = Image.new('RGB', size, 'white')
+    ImageDraw.Draw(im).text((20, 50), text, fill='black')
+    return im
+
+
+def job():
+    return (convert(BrotherQLRaster('QL-720NW'), [label('first'), label('second')], '62', compress=True) +
+            convert(BrotherQLRaster('PT-P750W'), [label('tape', (128, 60))], '12'))
+
+
+def test_chunker_splits_instructions():
+    data = job()
+    instructions = list(chunker(data))
+    assert b''.join(instructions) == data
+    names = [OPCODES[match_opcode(instruction)][0] for instruction in instructions]
+    assert names.count('init') == 2 and names.count('print') == 3 and names.count('wait') == 3
+    assert 'raster QL' in names and 'raster P-touch' in names and 'zero raster' in names
+
+
+def test_incremental_feeding():
+    data = job()
+    rng = random.Random(0)
+    parser = InstructionParser()
+    instructions = []
+    position = 0
+    while position < len(data):
+        size = rng.randrange(1, 200)
+        instructions += parser.feed(data[position:position + size])
+        position += size
+    instructions += parser.close()
+    assert instructions == list(iter_instructions(data))
+
+
+def test_file_sources(tmp_path):
+    data = job()
+    path = tmp_path / 'job.bin'
+    path.write_bytes(data)
+    with open(str(path), 'rb') as handle:
+        assert list(iter_instructions(handle)) == list(iter_instructions(data))
+    assert list(iter_instructions(io.BytesIO(data), chunk_size=7)) == list(iter_instructions(data))
+
+
+def test_unknown_and_incomplete_instructions():
+    assert list(chunker(b'\x1b\x40\x1b\x69\x7a\x00')) == [b'\x1b\x40', b'\x1b\x69\x7a\x00']
+    with pytest.raises(ValueError):
+        list(chunker(b'\x1b\x40\xff\x1b\x40', raise_exception=True))
+    assert list(chunker(b'\xff\x1b\x40')) == [b'\x1b\x40']
+    with pytest.raises(KeyError):
+        match_opcode(b'\xff')
+
+
+def test_analyse_saves_the_pages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    BrotherQLReader(io.BytesIO(convert(BrotherQLRaster('QL-720NW'), [label('first'), label('second', (696, 80))], '62'))).analyse()
+    first, second = Image.open('label0001.png'), Image.open('label0002.png')
+    assert first.size == (720, 120) and second.size == (720, 80)
+    assert first.convert('L').getextrema() == (0, 255)
+
+
+def test_iter_pages_in_memory():
+    qlr = BrotherQLRaster('QL-720NW')
+    job = _job_settings(qlr, '62')
+    images = [label('first'), label('second', (696, 80))]
+    expected = [image_to_frame(preprocess_image(im, job['label_specs'], qlr, job['options'])[0]) for im in images]
+    pages = list(BrotherQLReader(io.BytesIO(convert(BrotherQLRaster('QL-720NW'), images, '62', compress=True))).iter_pages())
+    assert [page.number for page in pages] == [1, 2]
+    assert [page.black.data for page in pages] == expected
+    assert [page.black.size for page in pages] == [(720, 120), (720, 80)]
+    assert pages[0].red is None and pages[0].image().mode == '1'
+
+
+def test_two_color_page_image():
+    im = Image.new('RGB', (696, 60), 'white')
+    draw = ImageDraw.Draw(im)
+    draw.rectangle((0, 0, 99, 59), fill='black')
+    draw.rectangle((200, 0, 299, 59), fill='red')
+    page, = BrotherQLReader(io.BytesIO(convert(BrotherQLRaster('QL-820NWB'), [im], '62red', red=True))).iter_pages()
+    preview = page.image()
+    assert preview.mode == 'RGBA' and preview.size == (720, 60)
+    # The image is placed 12 dots from the left edge of the 720 dots wide rows
+    assert [preview.getpixel((x + 12, 30)) for x in (50, 250, 500)] == [(0, 0, 0, 255), (255, 0, 0, 255), (255, 255, 255, 255)]
@@ -0,0 +1,30 @@
+import attr
+import pytest
+
+from brother_ql.devicedependent import models, two_color_support
+from brother_ql.registry import IdentifierList, get_registry
+
+
+def test_lookups():
+    registry = get_registry()
+    assert registry.model('QL-820NWB').two_color
+    assert registry.label('62red').tape_size == (62, 0)
+    # QL-500 and QL-550 report the same codes, the first one listed wins
+    assert registry.model_by_codes(0x30, 0x4F).identifier == 'QL-500'
+    assert registry.model_by_codes(0x00, 0x00) is None
+    assert registry.model_by_product_id(0x209D).identifier == 'QL-820NWB'
+    with pytest.raises(KeyError):
+        registry.model('QL-9999')
+
+
+def test_records_are_immutable():
+    with pytest.raises(attr.exceptions.FrozenInstanceError):
+        get_registry().model('QL-700').two_color = True
+
+
+def test_legacy_views():
+    assert isinstance(models, IdentifierList)
+    assert models[0] == 'QL-500'
+    assert 'QL-800' in two_color_support
+    assert 'QL-700' not in two_color_support
+    assert [] not in models
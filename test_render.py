@@ -0,0 +1,86 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from brother_ql.conversion import convert
+from brother_ql.raster import BrotherQLRaster
+from brother_ql.render import (CODE128_PATTERNS, GlyphCache, LabelCanvas, code128_modules, default_font,
+                               ean13_check_digit, ean13_modules)
+
+
+def test_code128_patterns():
+    assert len(CODE128_PATTERNS) == 107 and len(set(CODE128_PATTERNS)) == 107
+    assert all(sum(map(int, pattern)) == 11 for pattern in CODE128_PATTERNS[:-1])
+    assert sum(map(int, CODE128_PATTERNS[-1])) == 13
+    modules = code128_modules('PJJ123C')
+    # Start B, 7 characters, the check symbol and the stop symbol
+    assert len(modules) == 6 * 9 + 7
+    assert modules[:6] == [2, 1, 1, 2, 1, 4] and modules[-7:] == [2, 3, 3, 1, 1, 1, 2]
+    # Even-length digit strings use code set C (two digits per symbol)
+    digits = code128_modules('12345678')
+    assert digits[:6] == [2, 1, 1, 2, 3, 2] and len(digits) == 6 * 6 + 7
+    with pytest.raises(ValueError):
+        code128_modules('é')
+
+
+def test_ean13():
+    assert ean13_check_digit('400638133393') == 1
+    modules = ean13_modules('400638133393')
+    assert modules == ean13_modules('4006381333931')
+    assert len(modules) == 95
+    assert modules.startswith('101') and modules.endswith('101') and modules[45:50] == '01010'
+    with pytest.raises(ValueError):
+        ean13_modules('4006381333932')
+
+
+def test_canvas_size():
+    assert LabelCanvas('QL-720NW', '62x29').size == (696, 271)
+    assert LabelCanvas('QL-720NW', '62', length=100).size == (696, 100)
+    assert LabelCanvas('PT-P750W', '12', length=100).dpi == 180
+    with pytest.raises(ValueError):
+        LabelCanvas('QL-720NW', '62')
+
+
+def test_canvas_at_the_resolution_of_the_model():
+    canvas = LabelCanvas('TD-4420DN', 'td62x100_203dpi')
+    assert canvas.size == (472, 751) and canvas.dpi == 203
+    assert canvas.mm(25.4) == 203 and canvas.mm(10) == 80
+    assert LabelCanvas('QL-720NW', '62x29').mm(10) == 118
+    assert LabelCanvas('PT-P900W', 'pt36', length=100).dpi == 360
+    canvas.code128((canvas.mm(5), canvas.mm(5)), "P0815", height=canvas.mm(10))
+    expected = convert(BrotherQLRaster('TD-4420DN'), [canvas.image], 'td62x100_203dpi')
+    assert convert(BrotherQLRaster('TD-4420DN'), [canvas.bitmap()], 'td62x100_203dpi') == expected
+
+
+def test_glyph_cache_text():
+    cache = GlyphCache()
+    canvas = LabelCanvas('QL-720NW', '62', length=60, glyph_cache=cache)
+    width = canvas.text((10, 10), "Part 0815", size=30)
+    assert cache.info().misses == 9
+    canvas.text((10, 10), "Part 0815", size=30)
+    assert cache.info() == (9, 9, 4096, 9)
+    font = default_font(30)
+    assert abs(width - font.getlength("Part 0815")) <= 1
+    # About as many dots as PIL draws for the same text
+    reference = Image.new('1', canvas.size, 1)
+    ImageDraw.Draw(reference).text((10, 10), "Part 0815", fill=0, font=font)
+    dots = canvas.image.histogram()[0]
+    assert abs(dots - reference.histogram()[0]) < dots * 0.15
+
+
+def test_canvas_is_encoded_without_preprocessing():
+    canvas = LabelCanvas('QL-720NW', '62', length=120)
+    canvas.text((10, 5), "Part 0815", size=24)
+    canvas.code128((10, 40), "P0815", height=30)
+    canvas.ean13((300, 40), '400638133393', height=30)
+    canvas.rectangle((0, 110, 695, 119))
+    expected = convert(BrotherQLRaster('QL-720NW'), [canvas.image], '62')
+    assert convert(BrotherQLRaster('QL-720NW'), [canvas.bitmap()], '62') == expected
+
+
+def test_qr_code():
+    pytest.importorskip('qrcode')
+    canvas = LabelCanvas('QL-720NW', '62', length=200)
+    size = canvas.qr((10, 10), 'https://inventree.org', module_size=4)
+    assert size % 4 == 0 and size >= 21 * 4
+    # The finder pattern in the top left corner is dark
+    assert canvas.image.getpixel((10, 10)) == 0 and canvas.image.getpixel((9, 9)) == 255
@@ -0,0 +1,55 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from brother_ql.conversion import _job_settings, convert, iter_convert
+from brother_ql.raster import BrotherQLRaster
+from brother_ql.strips import strip_plan
+
+
+def banner(size, mode='RGB'):
+    im = Image.new(mode, size, 'white')
+    draw = ImageDraw.Draw(im)
+    for i in range(0, max(size), 97):
+        draw.line((0, i, size[0], i + 40), fill='black', width=3)
+        draw.text((20, i + 10), "Banner %d" % i, fill='black')
+    draw.ellipse((10, 10, size[0] - 10, size[1] - 10), outline='black', width=5)
+    return im
+
+
+@pytest.mark.parametrize('size, kwargs', [
+    ((696, 1500), {}),
+    ((1500, 696), {'rotate': 90}),
+    ((1500, 696), {'rotate': 270, 'compress': True}),
+    ((696, 1500), {'rotate': 180, 'dither': 'bayer8'}),
+    ((696, 1500), {'compress': 'auto', 'workers': 3}),
+])
+def test_strips_are_identical_without_scaling(size, kwargs):
+    expected = convert(BrotherQLRaster('QL-720NW'), [banner(size)], '62', **kwargs)
+    assert convert(BrotherQLRaster('QL-720NW'), [banner(size)], '62', strip_height=200, **kwargs) == expected
+
+
+def test_strips_of_a_scaled_image():
+    images = [banner((1392, 3000)), banner((696, 100))]
+    expected = convert(BrotherQLRaster('QL-720NW'), images, '62')
+    data = convert(BrotherQLRaster('QL-720NW'), images, '62', strip_height=256, workers=2)
+    assert len(data) == len(expected)
+    # Resampling the strips only rounds a few pixels at their borders differently
+    assert sum(a != b for a, b in zip(data, expected)) < len(data) * 0.01
+
+
+def test_strips_are_streamed():
+    chunks = list(iter_convert(BrotherQLRaster('QL-720NW'), [banner((696, 1500))], '62', strip_height=256))
+    # Preamble, page header, 6 strips, print command
+    assert len(chunks) == 9
+    assert chunks[-1] == b'\x1a'
+
+
+def test_strip_plan():
+    qlr = BrotherQLRaster('QL-720NW')
+    job = _job_settings(qlr, '62')
+    assert strip_plan(banner((696, 1500)), job['label_specs'], job['options'], 256).size == (696, 1500)
+    assert strip_plan(banner((696, 200)), job['label_specs'], job['options'], 256) is None
+    job = _job_settings(qlr, '62', dither=True)
+    assert strip_plan(banner((696, 1500)), job['label_specs'], job['options'], 256) is None
+    job = _job_settings(qlr, '62x29')
+    assert strip_plan(banner((696, 271)), job['label_specs'], job['options'], 100) is None
@@ -0,0 +1,58 @@
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from brother_ql.conversion import convert
+from brother_ql.encoder import PackedBitmap
+from brother_ql.raster import BrotherQLRaster
+from brother_ql.template import LabelTemplate
+
+REGIONS = {'part': (20, 30, 400, 40), 'qty': (420, 30, 200, 40), 'note': (20, 150, 500, 30)}
+
+
+def base_image():
+    im = Image.new('RGB', (696, 240), 'white')
+    draw = ImageDraw.Draw(im)
+    draw.rectangle((0, 0, 695, 10), fill='black')
+    draw.text((20, 100), "Inventory label", fill='black')
+    draw.rectangle((30, 40, 600, 60), fill='black')
+    return im
+
+
+def composed(fields):
+    # The label as it would be drawn in full
+    im = base_image()
+    font = ImageFont.load_default()
+    for name, value in fields.items():
+        x, y, width, height = REGIONS[name]
+        region = Image.new('RGB', (width, height), 'white')
+        if isinstance(value, str):
+            ImageDraw.Draw(region).text((0, 0), value, fill='black', font=font)
+        else:
+            region.paste(value.crop((0, 0, width, height)).convert('RGB'))
+        im.paste(region, (x, y))
+    return im
+
+
+@pytest.mark.parametrize('model, compress', [('QL-720NW', False), ('QL-720NW', True), ('QL-500', False)])
+def test_template_matches_full_conversion(model, compress):
+    records = [{'part': 'Part 0815', 'qty': '10'}, {'note': 'fragile', 'qty': '5'}, {}]
+    stamp = Image.new('L', (900, 50), 255)
+    ImageDraw.Draw(stamp).ellipse((0, 0, 600, 45), fill=20)
+    records.append({'part': stamp, 'note': 'stamped'})
+    template = LabelTemplate(BrotherQLRaster(model), '62', base_image(), REGIONS, compress=compress)
+    expected = convert(BrotherQLRaster(model), [composed(record) for record in records], '62', compress=compress)
+    assert template.convert(records) == expected
+    assert template.convert(records) == expected
+
+
+def test_template_fields():
+    template = LabelTemplate(BrotherQLRaster('QL-720NW'), '62', base_image(), REGIONS)
+    bitmap = Image.new('1', (400, 40), 1)
+    ImageDraw.Draw(bitmap).rectangle((5, 5, 300, 30), fill=0)
+    packed = PackedBitmap(bytes(b ^ 0xFF for b in bitmap.tobytes()), bitmap.size)
+    assert template.render(part=packed) == template.render(part=bitmap)
+    with pytest.raises(ValueError):
+        template.render(price='1.00')
+    with pytest.raises(ValueError):
+        LabelTemplate(BrotherQLRaster('QL-720NW'), '62', base_image(), {'wide': (600, 0, 200, 10)})
+